@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# ping/download/upload обслуживаются нативными async-обработчиками
+from speedtest_app.asgi_views import measurement_router  # noqa: E402
+
+application = measurement_router(django_application)
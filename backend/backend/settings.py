@@ -34,6 +34,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Метрики снаружи всех, чтобы видеть и быстрый путь
+    'speedtest_app.middleware.MetricsMiddleware',
+    # ping/download/upload обходят остальные middleware
+    'speedtest_app.middleware.MeasurementFastPathMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -149,6 +153,58 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 
+# Геолокация по IP: локальный индекс (manage.py build_geoip_index),
+# при промахе - запрос к ipapi.co
+GEOIP_INDEX_PATH = BASE_DIR / 'geoip' / 'geoip.idx'
+IP_INFO_REMOTE_FALLBACK = True
+
+# Геоданные результатов, которых нет в локальном индексе, заполняются в
+# фоновом потоке. Если False - только командой manage.py enrich_results
+GEO_ENRICHMENT_IN_PROCESS = True
+
+# Запись результатов: 'sync' - каждый результат сразу своей транзакцией,
+# 'buffered' - через очередь и bulk_create пачками (быстрее, но до
+# RESULTS_FLUSH_INTERVAL секунд результаты только в памяти процесса)
+RESULTS_WRITE_MODE = 'sync'
+RESULTS_FLUSH_SIZE = 100
+RESULTS_FLUSH_INTERVAL = 1.0
+
+# Сводки для /api/stats/ обновляются при каждой записи. Если False - только
+# периодической командой manage.py compact_rollups
+ROLLUPS_INLINE = True
+
+# Хранение результатов: строки старше RESULTS_RETENTION_DAYS дней (None -
+# хранить все) переносятся в gzip NDJSON по месяцам в RESULTS_ARCHIVE_DIR и
+# удаляются, статистика остается в сводках (manage.py archive_results)
+RESULTS_RETENTION_DAYS = 365
+RESULTS_ARCHIVE_DIR = BASE_DIR / 'archive'
+
+# Имя этого узла в SpeedTestResult.server (остальные узлы - модель TestServer)
+LOCAL_SERVER_NAME = 'pythonanywhere'
+
+# Кэш Django: версии и ответы /api/history/ и /api/stats/
+# (speedtest_app.response_cache). При нескольких воркерах нужен общий
+# бэкенд (Redis/Memcached), иначе воркеры не видят сброс версий друг друга
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+# Контроль допуска download/upload (на процесс; None - без ограничения):
+# одновременные передачи, суммарная скорость и частота передач с одного IP
+TRANSFER_MAX_CONCURRENT = 32
+TRANSFER_MAX_BANDWIDTH_MBPS = 900
+TRANSFER_RATE_PER_IP = 4.0  # передач в секунду
+TRANSFER_BURST_PER_IP = 60
+# Число прокси перед приложением (PythonAnywhere - один): IP клиента для
+# лимита берется из записи X-Forwarded-For, которую добавил первый из них
+TRANSFER_TRUSTED_PROXIES = 1
+
+# Метрики: время запросов и фаз в Server-Timing и /metrics (формат Prometheus)
+METRICS_ENABLED = True
+
 # Настройки авторизации
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
@@ -0,0 +1,79 @@
+"""Адаптивный размер порций download/upload теста.
+
+Клиент скачивает (загружает) порцию, сообщает серверу все измерения
+[[байт, секунд], ...], а сервер отвечает размером следующей порции.
+Размер растет геометрически (не больше чем в GROWTH раз за шаг), пока
+порция не станет занимать около TARGET_INTERVAL секунд. Тест
+останавливается, когда скорость последних STABLE_INTERVALS порций
+отличается от их средней не больше чем на TOLERANCE, либо по лимитам
+времени и объема. На медленных каналах это экономит время и трафик, на
+быстрых - порции становятся достаточно большими для точного измерения.
+"""
+import math
+
+INITIAL_SIZE = 128 * 1024  # 128 KB
+MAX_STEP_SIZE = 64 * 1024 * 1024  # 64 MB
+GROWTH = 4
+TARGET_INTERVAL = 0.5  # секунды
+MIN_INTERVAL = 0.2  # более короткие порции для оценки не годятся
+STABLE_INTERVALS = 3
+TOLERANCE = 0.1
+MAX_TOTAL_TIME = 15.0  # секунды
+MAX_TOTAL_BYTES = 400 * 1024 * 1024
+MAX_INTERVALS = 30
+
+
+def _is_number(value):
+    # bool - подкласс int, а JSON 1e400 превращается в inf
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def parse_intervals(raw):
+    """Список (байт, секунд) из присланных клиентом данных или ValueError"""
+    if not isinstance(raw, list) or len(raw) > MAX_INTERVALS:
+        raise ValueError(f'intervals: список не длиннее {MAX_INTERVALS}')
+    intervals = []
+    for item in raw:
+        if not isinstance(item, (list, tuple)) or len(item) != 2 or not all(_is_number(value) for value in item):
+            raise ValueError('intervals: элементы - пары чисел [байт, секунд]')
+        size, seconds = int(item[0]), float(item[1])
+        if size < 0 or not seconds > 0:
+            raise ValueError('intervals: байты >= 0, секунды > 0')
+        intervals.append((size, seconds))
+    return intervals
+
+
+def _mbps(size, seconds):
+    return size * 8 / (seconds * 1000000)
+
+
+def next_step(intervals, max_step_size=MAX_STEP_SIZE):
+    """Следующий шаг: {'done', 'next_size', 'mbps', 'reason'}"""
+    if not intervals:
+        return {'done': False, 'next_size': INITIAL_SIZE, 'mbps': None, 'reason': 'start'}
+
+    total_bytes = sum(size for size, _ in intervals)
+    total_time = sum(seconds for _, seconds in intervals)
+    speeds = [_mbps(size, seconds) for size, seconds in intervals if seconds >= MIN_INTERVAL]
+
+    # Оценка: среднее по последним достаточно длинным порциям
+    recent = speeds[-STABLE_INTERVALS:]
+    mbps = round(sum(recent) / len(recent), 3) if recent else round(_mbps(total_bytes, total_time), 3)
+
+    if len(recent) == STABLE_INTERVALS:
+        mean = sum(recent) / len(recent)
+        if mean > 0 and all(abs(speed - mean) <= TOLERANCE * mean for speed in recent):
+            return {'done': True, 'next_size': 0, 'mbps': mbps, 'reason': 'stable'}
+
+    if total_time >= MAX_TOTAL_TIME or len(intervals) >= MAX_INTERVALS:
+        return {'done': True, 'next_size': 0, 'mbps': mbps, 'reason': 'time_limit'}
+    if total_bytes >= MAX_TOTAL_BYTES:
+        return {'done': True, 'next_size': 0, 'mbps': mbps, 'reason': 'size_limit'}
+
+    last_size, last_seconds = intervals[-1]
+    # Размер, который при текущей скорости займет TARGET_INTERVAL
+    wanted = int(last_size / last_seconds * TARGET_INTERVAL)
+    next_size = max(last_size, min(wanted, last_size * GROWTH))
+    next_size = max(INITIAL_SIZE, min(next_size, max_step_size, MAX_TOTAL_BYTES - total_bytes))
+
+    return {'done': False, 'next_size': next_size, 'mbps': mbps, 'reason': 'ramp_up'}
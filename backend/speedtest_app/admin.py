@@ -1,3 +1,141 @@
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.core.paginator import Paginator
+from django.db import connection
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
 
-# Register your models here.
+from . import enrichment, ingest
+from .models import ResultRollup, SpeedTestResult, TestServer
+
+# Точный счет строк по фильтру не дальше этого числа
+COUNT_LIMIT = 10000
+MAX_FILTER_CHOICES = 200
+
+
+def estimate_rows(model):
+    """Примерное число строк таблицы без COUNT(*) или None, если оценки нет"""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+                [table],
+            )
+        else:
+            # В SQLite статистики нет, а id растут монотонно: MIN и MAX берутся из первичного ключа
+            pk = connection.ops.quote_name(model._meta.pk.column)
+            cursor.execute(f'SELECT MAX({pk}) - MIN({pk}) + 1 FROM {connection.ops.quote_name(table)}')
+        row = cursor.fetchone()
+    if not row or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор без COUNT(*) по всей таблице.
+
+    Без фильтров число строк берется из статистики БД, с фильтрами
+    считается точно, но не дальше COUNT_LIMIT.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_rows(queryset.model)
+            if estimate is not None:
+                return estimate
+        return queryset.order_by()[:COUNT_LIMIT].count()
+
+
+class RollupValueFilter(admin.SimpleListFilter):
+    """Фильтр по полю результата; варианты берутся из суточных сводок,
+    а не SELECT DISTINCT по всей таблице результатов"""
+    field = None
+
+    def lookups(self, request, model_admin):
+        values = (
+            ResultRollup.objects.filter(period=ResultRollup.PERIOD_DAY).exclude(**{self.field: ''})
+            .values_list(self.field, flat=True).distinct().order_by(self.field)[:MAX_FILTER_CHOICES]
+        )
+        return [(value, value) for value in values]
+
+    def queryset(self, request, queryset):
+        if self.value() is not None:
+            return queryset.filter(**{self.field: self.value()})
+        return queryset
+
+
+class CountryFilter(RollupValueFilter):
+    title = 'страна'
+    parameter_name = field = 'country'
+
+
+class ProviderFilter(RollupValueFilter):
+    title = 'провайдер'
+    parameter_name = field = 'provider'
+
+
+class ServerFilter(RollupValueFilter):
+    title = 'сервер'
+    parameter_name = field = 'server'
+
+
+@admin.register(SpeedTestResult)
+class SpeedTestResultAdmin(admin.ModelAdmin):
+    list_display = ('timestamp', 'user', 'download', 'upload', 'ping', 'provider', 'country', 'server')
+    # Все фильтры и date_hierarchy идут по индексам result_*_time_idx
+    list_filter = ('timestamp', CountryFilter, ProviderFilter, ServerFilter)
+    list_select_related = ('user',)
+    date_hierarchy = 'timestamp'
+    ordering = ('-timestamp', '-id')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    raw_id_fields = ('user',)
+    readonly_fields = ('geo_pending', 'geo_attempts', 'geo_retry_at', 'rolled_up')
+    actions = ('re_enrich_geo', 'delete_in_batches')
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # Стандартное удаление загружает все выбранные объекты для страницы подтверждения
+        actions.pop('delete_selected', None)
+        return actions
+
+    @admin.action(description='Заново заполнить геоданные', permissions=['change'])
+    def re_enrich_geo(self, request, queryset):
+        marked = enrichment.requeue(queryset)
+        self.message_user(request, f'Поставлено в очередь геоданных: {marked}')
+
+    @admin.action(description='Удалить пачками', permissions=['delete'])
+    def delete_in_batches(self, request, queryset):
+        if request.POST.get('post') == 'yes':
+            deleted = ingest.delete_results(queryset)
+            self.message_user(request, f'Удалено результатов: {deleted}')
+            return None
+
+        # Страница подтверждения без загрузки объектов: только число строк,
+        # посчитанное не дальше COUNT_LIMIT, и выбор для повторной отправки
+        count = queryset.order_by()[:COUNT_LIMIT + 1].count()
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Удалить результаты пачками?',
+            'opts': self.model._meta,
+            'media': self.media,
+            'count': min(count, COUNT_LIMIT),
+            'more': count > COUNT_LIMIT,
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'select_across': request.POST.get('select_across') == '1',
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        }
+        request.current_app = self.admin_site.name
+        return TemplateResponse(request, 'admin/speedtest_app/speedtestresult/delete_in_batches.html', context)
+
+
+@admin.register(TestServer)
+class TestServerAdmin(admin.ModelAdmin):
+    list_display = ('name', 'url', 'city', 'country', 'capacity', 'is_active', 'healthy', 'rtt_ms', 'checked_at')
+    list_filter = ('is_active', 'healthy', 'country')
+    readonly_fields = ('geohash', 'healthy', 'active_transfers', 'rtt_ms', 'checked_at')
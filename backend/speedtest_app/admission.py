@@ -0,0 +1,281 @@
+"""Контроль допуска для download/upload.
+
+Одновременно идет не больше max_concurrent передач, суммарная скорость
+передач не больше max_bandwidth, а каждый IP начинает передачи не чаще, чем
+позволяет его корзина токенов (rate в секунду, запас burst). Сверх лимита
+клиент сразу получает отказ с retry_after_ms вместо теста, который был бы
+испорчен общей перегрузкой, и повторяет попытку позже.
+
+Лимиты действуют на процесс: при нескольких воркерах общий лимит сервера -
+лимит процесса, умноженный на число воркеров.
+"""
+import math
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+from . import metrics
+
+# Окно измерения суммарной скорости
+WINDOW = 1.0  # секунды
+SLOTS = 10
+MAX_TRACKED_IPS = 10000
+MIN_RETRY_MS = 100
+MAX_RETRY_MS = 10000
+# Начальная оценка длительности передачи, пока нет завершенных
+DEFAULT_TRANSFER_SECONDS = 1.0
+
+REASON_CONCURRENCY = 'concurrency'
+REASON_BANDWIDTH = 'bandwidth'
+REASON_RATE_LIMIT = 'rate_limit'
+
+
+class Ticket:
+    """Допуск одной передачи: учитывает байты и освобождает место"""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.started = controller.clock()
+        self.released = False
+
+    def record(self, size):
+        self.controller._record(size)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+    def track(self, chunks):
+        return _TrackedChunks(self, chunks)
+
+
+class _TrackedChunks:
+    """Итератор кусков ответа: байты идут в учет скорости, место
+    освобождается в конце передачи или в close() (его вызывает сервер,
+    даже если ответ так и не начали читать)"""
+
+    def __init__(self, ticket, chunks):
+        self.ticket = ticket
+        self.chunks = iter(chunks)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.ticket.release()
+            raise
+        self.ticket.record(len(chunk))
+        return chunk
+
+    def close(self):
+        self.ticket.release()
+        close = getattr(self.chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+class Admission:
+
+    def __init__(self, max_concurrent=None, max_bandwidth=None, rate=None, burst=None, clock=time.monotonic):
+        # None - ограничение выключено; max_bandwidth - байт/с, rate - передач/с на IP
+        self.max_concurrent = max_concurrent
+        self.max_bandwidth = max_bandwidth
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.clock = clock
+
+        self.active = 0
+        self.admitted = 0
+        self.rejected = dict.fromkeys((REASON_CONCURRENCY, REASON_BANDWIDTH, REASON_RATE_LIMIT), 0)
+        self.avg_seconds = DEFAULT_TRANSFER_SECONDS
+        self._buckets = OrderedDict()
+        self._refusals = deque(maxlen=10000)
+        self._slots = [0] * SLOTS
+        self._slot = 0
+        self._slot_at = 0.0
+        self._lock = threading.Lock()
+
+    # --- Суммарная скорость по слотам окна ---
+
+    def _advance(self, now):
+        slot_seconds = WINDOW / SLOTS
+        steps = int((now - self._slot_at) / slot_seconds)
+        if steps <= 0:
+            return
+        for _ in range(min(steps, SLOTS)):
+            self._slot = (self._slot + 1) % SLOTS
+            self._slots[self._slot] = 0
+        self._slot_at += steps * slot_seconds
+
+    def _record(self, size):
+        with self._lock:
+            self._advance(self.clock())
+            self._slots[self._slot] += size
+
+    def _bandwidth(self, now):
+        self._advance(now)
+        return sum(self._slots) / WINDOW
+
+    # --- Допуск ---
+
+    def _waiting(self, now):
+        # Очередь - отказанные клиенты, которые вернутся в пределах средней
+        # длительности передачи
+        while self._refusals and self._refusals[0] < now - self.avg_seconds:
+            self._refusals.popleft()
+        return len(self._refusals)
+
+    def _take_token(self, ip, now):
+        """Списывает токен IP; возвращает 0 или секунды до нового токена"""
+        tokens, updated = self._buckets.pop(ip, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            self._buckets[ip] = (tokens - 1, now)
+            wait = 0
+        else:
+            self._buckets[ip] = (tokens, now)
+            wait = (1 - tokens) / self.rate
+        while len(self._buckets) > MAX_TRACKED_IPS:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def admit(self, ip):
+        """(Ticket, None) при допуске или (None, отказ) с причиной и retry_after_ms"""
+        with self._lock:
+            now = self.clock()
+            reason = None
+            if self.max_concurrent is not None and self.active >= self.max_concurrent:
+                reason = REASON_CONCURRENCY
+            elif self.max_bandwidth is not None and self._bandwidth(now) >= self.max_bandwidth:
+                reason = REASON_BANDWIDTH
+
+            if reason is None and self.rate is not None:
+                wait = self._take_token(ip or '', now)
+                if wait:
+                    self.rejected[REASON_RATE_LIMIT] += 1
+                    return None, _refusal(REASON_RATE_LIMIT, wait)
+
+            if reason is not None:
+                waiting = self._waiting(now)
+                self._refusals.append(now)
+                self.rejected[reason] += 1
+                # Место освобождается примерно раз в avg_seconds / max_concurrent;
+                # случайный множитель разводит повторы клиентов во времени
+                per_slot = self.avg_seconds / max(1, self.max_concurrent or 1)
+                wait = (self.avg_seconds + waiting * per_slot) * random.uniform(0.5, 1.5)
+                return None, _refusal(reason, wait)
+
+            self.active += 1
+            self.admitted += 1
+            ticket = Ticket(self)
+
+        metrics.count_admission('admitted')
+        return ticket, None
+
+    def _release(self, ticket):
+        with self._lock:
+            self.active -= 1
+            seconds = self.clock() - ticket.started
+            # Скользящее среднее длительности передачи
+            self.avg_seconds += (seconds - self.avg_seconds) * 0.1
+
+    def snapshot(self):
+        """Текущий бюджет: занятые места, скорость, очередь, отказы"""
+        with self._lock:
+            now = self.clock()
+            return {
+                'active': self.active,
+                'max_concurrent': self.max_concurrent,
+                'bandwidth_mbps': round(self._bandwidth(now) * 8 / 1000000, 3),
+                'max_bandwidth_mbps': round(self.max_bandwidth * 8 / 1000000, 3) if self.max_bandwidth else None,
+                'waiting': self._waiting(now),
+                'avg_transfer_seconds': round(self.avg_seconds, 3),
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'per_ip_rate': self.rate,
+                'per_ip_burst': self.burst,
+            }
+
+
+def _refusal(reason, seconds):
+    retry_ms = int(min(MAX_RETRY_MS, max(MIN_RETRY_MS, math.ceil(seconds * 1000))))
+    metrics.count_admission(reason)
+    return {'status': 'busy', 'reason': reason, 'retry_after_ms': retry_ms}
+
+
+def http_status(refusal):
+    # rate_limit - превышен лимит клиента, остальное - перегрузка сервера
+    return 429 if refusal['reason'] == REASON_RATE_LIMIT else 503
+
+
+def retry_after(refusal):
+    """Значение заголовка Retry-After (целые секунды)"""
+    return str(math.ceil(refusal['retry_after_ms'] / 1000))
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                max_mbps = getattr(settings, 'TRANSFER_MAX_BANDWIDTH_MBPS', None)
+                _controller = Admission(
+                    max_concurrent=getattr(settings, 'TRANSFER_MAX_CONCURRENT', None),
+                    max_bandwidth=max_mbps * 1000000 / 8 if max_mbps else None,
+                    rate=getattr(settings, 'TRANSFER_RATE_PER_IP', None),
+                    burst=getattr(settings, 'TRANSFER_BURST_PER_IP', None),
+                )
+    return _controller
+
+
+def reset():
+    """Пересоздать контроллер по текущим настройкам (для тестов)"""
+    global _controller
+    with _controller_lock:
+        _controller = None
+
+
+def client_ip(remote_addr, forwarded_for=None):
+    """IP, по которому считается лимит частоты передач.
+
+    Левые записи X-Forwarded-For присылает сам клиент, поэтому берется
+    запись, которую добавил ближайший к клиенту из TRANSFER_TRUSTED_PROXIES
+    доверенных прокси (при 0 - адрес соединения).
+    """
+    hops = getattr(settings, 'TRANSFER_TRUSTED_PROXIES', 0)
+    if hops and forwarded_for:
+        entries = [entry.strip() for entry in forwarded_for.split(',') if entry.strip()]
+        if len(entries) >= hops:
+            return entries[-hops]
+    return remote_addr
+
+
+def admit(ip):
+    return get_controller().admit(ip)
+
+
+def snapshot():
+    return get_controller().snapshot()
+
+
+def _collect(registry):
+    if _controller is None:
+        return
+    state = _controller.snapshot()
+    registry.set('speedtest_admission_active', (), state['active'])
+    registry.set('speedtest_admission_waiting', (), state['waiting'])
+    registry.set('speedtest_admission_bandwidth_bytes', (), state['bandwidth_mbps'] * 1000000 / 8)
+
+
+metrics.register_collector(_collect)
@@ -0,0 +1,345 @@
+"""Нативные ASGI-обработчики для ping, download, upload и WebSocket-задержки.
+
+Django ASGIHandler читает все тело запроса во временный файл до вызова view,
+а sync-генераторы StreamingHttpResponse гоняет через пул потоков. Поэтому
+измерительные эндпоинты под ASGI обслуживаются напрямую: download отдает
+данные из async-генератора, upload считает куски тела по мере прихода.
+Одна передача не занимает поток, и один процесс держит тысячи тестов.
+"""
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+from . import admission, latency, metrics, multistream, payload, upload_sink
+
+NO_CACHE_HEADERS = [
+    (b'cache-control', b'no-store, no-cache, must-revalidate, max-age=0'),
+    (b'pragma', b'no-cache'),
+]
+
+
+def _query(scope):
+    params = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    return {key: values[-1] for key, values in params.items()}
+
+
+def _admission_ip(scope):
+    # Как views.get_admission_ip; несколько заголовков X-Forwarded-For - один список
+    forwarded = [value.decode('latin-1') for name, value in scope.get('headers', ()) if name == b'x-forwarded-for']
+    client = scope.get('client')
+    return admission.client_ip(client[0] if client else None, ','.join(forwarded))
+
+
+def _extra_headers():
+    # Те же CORS-заголовки, что добавил бы corsheaders
+    if getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', False):
+        return [(b'access-control-allow-origin', b'*')]
+    return []
+
+
+def _server_timing(started):
+    return (b'server-timing', f'app;dur={(time.perf_counter() - started) * 1000:.3f}'.encode('latin-1'))
+
+
+async def _send_json(send, data, status=200, started=None):
+    body = json.dumps(data).encode('utf-8')
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode('latin-1')),
+    ] + _extra_headers()
+    if started is not None:
+        headers.append(_server_timing(started))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': headers,
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _send_busy(send, refusal):
+    """Быстрый отказ контроля допуска (см. views.busy_response)"""
+    body = json.dumps(refusal).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': admission.http_status(refusal),
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('latin-1')),
+            (b'retry-after', admission.retry_after(refusal).encode('latin-1')),
+        ] + _extra_headers(),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def ping_test(scope, receive, send):
+    """Тест ping"""
+    started = time.perf_counter()
+    await _send_json(send, {
+        'timestamp': time.time(),
+        'status': 'ok'
+    }, started=started)
+
+
+async def payload_stream(chunks):
+    """Async-генератор над итератором кусков payload"""
+    for chunk in chunks:
+        yield chunk
+        # Даем циклу событий обслужить остальные соединения
+        await asyncio.sleep(0)
+
+
+async def download_test(scope, receive, send):
+    """Отдача тестовых данных для скачивания (см. views.download_test)"""
+    query = _query(scope)
+    try:
+        session, stream = multistream.from_params(query)
+    except LookupError as e:
+        await _send_json(send, {'status': 'error', 'message': str(e)}, status=404)
+        return
+    except ValueError as e:
+        await _send_json(send, {'status': 'error', 'message': str(e)}, status=400)
+        return
+
+    duration = payload.parse_duration(query.get('duration'))
+    headers = [(b'content-type', b'application/octet-stream')] + NO_CACHE_HEADERS + _extra_headers()
+    if duration:
+        size = payload.parse_size(query['size']) if 'size' in query else None
+    else:
+        size = payload.parse_size(query.get('size'))
+        headers.append((b'content-length', str(size).encode('latin-1')))
+
+    ticket, refusal = admission.admit(_admission_ip(scope))
+    if refusal is not None:
+        await _send_busy(send, refusal)
+        return
+
+    chunks = payload.iter_payload(size, duration)
+    if session is not None:
+        chunks = session.track('download', chunks, stream)
+
+    watcher = None
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        watcher = asyncio.ensure_future(_wait_disconnect(receive))
+        async for chunk in payload_stream(chunks):
+            if watcher.done():
+                return
+            ticket.record(len(chunk))
+            await send({'type': 'http.response.body', 'body': bytes(chunk), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        chunks.close()
+        ticket.release()
+
+
+async def upload_test(scope, receive, send):
+    """Прием тестовых данных: куски тела считаются по мере прихода"""
+    if scope['method'] != 'POST':
+        await _send_json(send, {'error': 'POST method required'}, status=400)
+        return
+
+    query = _query(scope)
+    try:
+        start_time = float(query.get('start_time', time.time()))
+    except ValueError:
+        start_time = time.time()
+
+    try:
+        session, stream = multistream.from_params(query)
+    except LookupError as e:
+        await _send_json(send, {'status': 'error', 'message': str(e)}, status=404)
+        return
+    except ValueError as e:
+        await _send_json(send, {'status': 'error', 'message': str(e)}, status=400)
+        return
+    ticket, refusal = admission.admit(_admission_ip(scope))
+    if refusal is not None:
+        await _send_busy(send, refusal)
+        return
+
+    def on_data(size):
+        ticket.record(size)
+        if session is not None:
+            session.record('upload', size, stream)
+
+    meter = upload_sink.UploadMeter(on_data=on_data)
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            meter.feed(len(message.get('body', b'')))
+            if not message.get('more_body', False):
+                break
+    finally:
+        ticket.release()
+
+    stats = meter.result()
+    await _send_json(send, {
+        'status': 'ok',
+        'bytes_received': stats['bytes_received'],
+        'duration': stats['duration'],
+        'mbps': stats['mbps'],
+        'samples': stats['samples'],
+        'server_time': time.time(),
+        'client_start': start_time
+    })
+
+
+async def latency_socket(scope, receive, send):
+    """WebSocket-измерение RTT и джиттера (см. latency).
+
+    Клиент начинает с {"type": "start", "count": N, "interval_ms": I},
+    отвечает на каждую пробу и в конце получает {"type": "result", ...}.
+    """
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+
+    async def send_json(data):
+        await send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+    session = None
+    sender = None
+    loop = asyncio.get_running_loop()
+    # До start ждем не дольше START_TIMEOUT, после - время проб плюс LOSS_TIMEOUT
+    deadline = loop.time() + latency.START_TIMEOUT
+
+    async def send_probes():
+        for seq in range(session.count):
+            await send_json(session.probe(seq))
+            await asyncio.sleep(session.interval)
+
+    try:
+        while session is None or not session.complete:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                message = await asyncio.wait_for(receive(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if message['type'] == 'websocket.disconnect':
+                return
+            if message['type'] != 'websocket.receive':
+                continue
+
+            try:
+                data = json.loads(message.get('text') or message.get('bytes') or b'{}')
+            except ValueError:
+                continue
+            if not isinstance(data, dict):
+                continue
+
+            if data.get('type') == 'start' and session is None:
+                try:
+                    session = latency.ProbeSession(
+                        data.get('count', latency.DEFAULT_COUNT),
+                        data.get('interval_ms', latency.DEFAULT_INTERVAL_MS),
+                    )
+                except (TypeError, ValueError, OverflowError):
+                    session = latency.ProbeSession()
+                deadline = loop.time() + session.count * session.interval + latency.LOSS_TIMEOUT
+                sender = asyncio.ensure_future(send_probes())
+            elif data.get('type') == 'echo' and session is not None:
+                seq = data.get('seq')
+                # Номер пробы - только целое число: список или объект не ищутся в словаре проб
+                if isinstance(seq, int) and not isinstance(seq, bool):
+                    session.echo(seq)
+
+        if session is not None:
+            await send_json(session.result())
+        await send({'type': 'websocket.close', 'code': 1000})
+    finally:
+        if sender is not None:
+            sender.cancel()
+
+
+ROUTES = {
+    '/api/ping/': ping_test,
+    '/api/download/': download_test,
+    '/api/upload/': upload_test,
+}
+
+# Имена эндпоинтов для метрик (как url name в urls.py)
+ROUTE_NAMES = {
+    '/api/ping/': 'ping',
+    '/api/download/': 'download',
+    '/api/upload/': 'upload',
+}
+TRANSFER_ENDPOINTS = ('download', 'upload')
+
+WEBSOCKET_ROUTES = {
+    '/api/ws/latency/': latency_socket,
+}
+
+
+async def instrumented(handler, endpoint, scope, receive, send):
+    """Вызывает обработчик, считая время, статус и байты тела в обе стороны"""
+    started = time.perf_counter()
+    state = {'status': 0, 'sent': 0, 'received': 0}
+
+    async def counting_receive():
+        message = await receive()
+        if message['type'] == 'http.request':
+            state['received'] += len(message.get('body', b''))
+        return message
+
+    async def counting_send(message):
+        if message['type'] == 'http.response.body':
+            state['sent'] += len(message.get('body', b''))
+        elif message['type'] == 'http.response.start':
+            state['status'] = message['status']
+        await send(message)
+
+    transfer = endpoint in TRANSFER_ENDPOINTS
+    if transfer:
+        metrics.transfer_started(endpoint)
+    try:
+        await handler(scope, counting_receive, counting_send)
+    finally:
+        if transfer:
+            metrics.transfer_finished(endpoint)
+        metrics.observe_request(endpoint, scope['method'], state['status'], time.perf_counter() - started)
+        metrics.count_sent(endpoint, state['sent'])
+        metrics.count_received(endpoint, state['received'])
+
+
+def measurement_router(application):
+    """Оборачивает Django ASGI-приложение: измерительные запросы
+    обслуживаются напрямую, все остальное (включая CORS preflight) - Django"""
+
+    async def router(scope, receive, send):
+        if scope['type'] == 'http' and scope['method'] in ('GET', 'POST'):
+            handler = ROUTES.get(scope['path'])
+            if handler is not None:
+                if getattr(settings, 'METRICS_ENABLED', True):
+                    await instrumented(handler, ROUTE_NAMES[scope['path']], scope, receive, send)
+                else:
+                    await handler(scope, receive, send)
+                return
+        elif scope['type'] == 'websocket':
+            handler = WEBSOCKET_ROUTES.get(scope['path'])
+            if handler is not None:
+                await handler(scope, receive, send)
+            else:
+                # Django сам WebSocket не обслуживает
+                await send({'type': 'websocket.close', 'code': 4404})
+            return
+        await application(scope, receive, send)
+
+    return router
@@ -0,0 +1,178 @@
+"""Отложенное заполнение геоданных сохраненных результатов.
+
+save_result пишет строку сразу, с IP клиента и geo_pending=True. Провайдер,
+город, страну и координаты потом дописывает фоновый обработчик: пачками,
+по одному запросу геолокации на каждый IP в пачке.
+
+Если API геолокации не ответил, строки остаются geo_pending=True и ждут
+повтора (geo_retry_at) с растущей задержкой. После MAX_ATTEMPTS неудач
+строка сохраняется без геоданных и попадает в сводки.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from . import rollups
+from .ip_service import lookup_ip_info
+from .models import SpeedTestResult
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+# Задержки повторов: 1 мин, 4 мин, 16 мин, ... не больше суток
+RETRY_DELAY = 60  # секунды
+RETRY_GROWTH = 4
+MAX_RETRY_DELAY = 24 * 60 * 60
+MAX_ATTEMPTS = 8
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='geo-enrichment')
+_scheduled = False
+_lock = threading.Lock()
+_retry_timer = None
+
+
+def geo_fields(ip_info):
+    """Поля SpeedTestResult из ответа ip_service"""
+    return {
+        'provider': ip_info['isp'],
+        'city': ip_info['city'],
+        'country': ip_info['country'],
+        'latitude': ip_info.get('lat', 0),
+        'longitude': ip_info.get('lon', 0),
+    }
+
+
+def retry_delay(attempts):
+    """Задержка перед повтором после attempts неудачных запросов"""
+    return min(MAX_RETRY_DELAY, RETRY_DELAY * RETRY_GROWTH ** (attempts - 1))
+
+
+def due():
+    """Ожидающие строки, которым пора делать запрос"""
+    return SpeedTestResult.objects.filter(geo_pending=True).filter(
+        Q(geo_retry_at__isnull=True) | Q(geo_retry_at__lte=timezone.now())
+    )
+
+
+def _enrich_batch(batch_size):
+    # (обработано строк, обновлено строк)
+    pending = list(due().order_by('id').values_list('id', 'ip_address', 'geo_attempts')[:batch_size])
+    if not pending:
+        return 0, 0
+
+    rows_by_ip = {}
+    for pk, ip, attempts in pending:
+        rows_by_ip.setdefault(ip, []).append((pk, attempts))
+
+    updated = 0
+    for ip, rows in rows_by_ip.items():
+        ids = [pk for pk, _ in rows]
+        info = lookup_ip_info(ip) if ip else None
+        if ip and info is None:
+            attempts = max(attempts for _, attempts in rows) + 1
+            if attempts < MAX_ATTEMPTS:
+                delay = retry_delay(attempts)
+                logger.warning('Геоданные для %s не получены (попытка %d), повтор через %d с', ip, attempts, delay)
+                SpeedTestResult.objects.filter(pk__in=ids).update(
+                    geo_attempts=attempts, geo_retry_at=timezone.now() + timedelta(seconds=delay))
+                continue
+            logger.warning('Геоданные для %s не получены за %d попыток, строки сохранены без них', ip, attempts)
+        fields = geo_fields(info) if info else {}
+        updated += SpeedTestResult.objects.filter(pk__in=ids).update(
+            geo_pending=False, geo_attempts=0, geo_retry_at=None, **fields)
+
+    if rollups.inline_enabled():
+        # Строки, ждущие повтора, roll_up пропускает сам (geo_pending=True)
+        rollups.roll_up([pk for pk, _, _ in pending])
+    return len(pending), updated
+
+
+def enrich_batch(batch_size=BATCH_SIZE):
+    """Заполняет одну пачку ожидающих строк. Возвращает число обновленных строк"""
+    return _enrich_batch(batch_size)[1]
+
+
+def enrich_pending(batch_size=BATCH_SIZE):
+    """Обрабатывает пачки, пока есть строки, которым пора делать запрос.
+    Возвращает число обновленных строк"""
+    total = 0
+    while True:
+        processed, updated = _enrich_batch(batch_size)
+        total += updated
+        if processed == 0:
+            return total
+
+
+def next_retry():
+    """Ближайшее время повтора или None"""
+    return SpeedTestResult.objects.filter(geo_pending=True).aggregate(at=Min('geo_retry_at'))['at']
+
+
+def requeue(queryset, batch_size=BATCH_SIZE * 10):
+    """Снова ставит результаты queryset в очередь заполнения геоданных.
+
+    Строки помечаются пачками по первичному ключу. Уже учтенные в сводках
+    результаты там не перераспределяются - меняются только их поля.
+    Возвращает число помеченных строк.
+    """
+    marked = 0
+    last_pk = 0
+    while True:
+        ids = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        marked += SpeedTestResult.objects.filter(pk__in=ids).update(geo_pending=True, geo_attempts=0, geo_retry_at=None)
+        last_pk = ids[-1]
+    if marked:
+        transaction.on_commit(schedule)
+    return marked
+
+
+def _run():
+    global _scheduled
+    # Сбрасываем флаг до обработки: строки, сохраненные во время работы,
+    # запустят еще один проход
+    with _lock:
+        _scheduled = False
+    try:
+        close_old_connections()
+        enrich_pending()
+        _schedule_retry(next_retry())
+    except Exception:
+        logger.exception('Ошибка заполнения геоданных')
+    finally:
+        connections.close_all()
+
+
+def _schedule_retry(at):
+    # Повтор неудачных запросов в этом же процессе: один таймер на ближайшее время
+    global _retry_timer
+    if at is None:
+        return
+    with _lock:
+        if _retry_timer is not None:
+            _retry_timer.cancel()
+        _retry_timer = threading.Timer(max(0.0, (at - timezone.now()).total_seconds()), schedule)
+        _retry_timer.daemon = True
+        _retry_timer.start()
+
+
+def schedule():
+    """Запускает обработку в фоновом потоке (если включено в настройках).
+
+    Иначе строки ждут команды manage.py enrich_results.
+    """
+    global _scheduled
+    if not getattr(settings, 'GEO_ENRICHMENT_IN_PROCESS', True):
+        return
+    with _lock:
+        if _scheduled:
+            return
+        _scheduled = True
+    _executor.submit(_run)
@@ -0,0 +1,80 @@
+"""Потоковая выгрузка результатов в CSV/NDJSON.
+
+Строки читаются QuerySet.iterator() пачками по CHUNK_ROWS, форматируются
+в буфер и отдаются кусками около CHUNK_BYTES (по желанию - сразу сжатыми
+gzip). В памяти одновременно только одна пачка строк и один кусок ответа,
+поэтому расход памяти не зависит от размера выгрузки.
+"""
+import csv
+import io
+import json
+import zlib
+
+CHUNK_ROWS = 2000
+CHUNK_BYTES = 64 * 1024
+
+FIELDS = (
+    'id', 'timestamp', 'ping', 'jitter', 'packet_loss', 'download', 'upload',
+    'server', 'provider', 'city', 'country', 'latitude', 'longitude',
+)
+# Глобальная выгрузка (staff) дополнительно содержит пользователя
+GLOBAL_FIELDS = FIELDS + ('user_id',)
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+def format_row(row):
+    return [value.isoformat() if hasattr(value, 'isoformat') else value for value in row]
+
+
+def iter_rows(queryset, fields, chunk_size=CHUNK_ROWS):
+    for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size):
+        yield format_row(row)
+
+
+def iter_csv(rows, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def iter_ndjson(rows, fields):
+    parts = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(fields, row)), ensure_ascii=False)
+        parts.append(line)
+        size += len(line) + 1
+        if size >= CHUNK_BYTES:
+            yield ('\n'.join(parts) + '\n').encode('utf-8')
+            parts = []
+            size = 0
+    if parts:
+        yield ('\n'.join(parts) + '\n').encode('utf-8')
+
+
+def gzip_chunks(chunks, level=6):
+    """Сжимает поток кусков в формат gzip на лету"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream(queryset, fields, fmt='csv', compress=False):
+    """Итератор байтов выгрузки queryset в формате fmt"""
+    rows = iter_rows(queryset, fields)
+    chunks = iter_csv(rows, fields) if fmt == 'csv' else iter_ndjson(rows, fields)
+    return gzip_chunks(chunks) if compress else chunks
@@ -0,0 +1,112 @@
+"""Geohash: координаты -> строка base32, у соседних точек общий префикс.
+
+Ячейка длины n вложена в ячейку длины n - 1, поэтому поиск "в ячейке"
+- это поиск по диапазону строк [prefix, prefix + '~'), который идет по
+обычному индексу БД.
+"""
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE = {char: i for i, char in enumerate(BASE32)}
+EARTH_RADIUS_KM = 6371.0
+
+
+def encode(lat, lon, precision=8):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        middle = (rng[0] + rng[1]) / 2
+        if coord >= middle:
+            value = (value << 1) | 1
+            rng[0] = middle
+        else:
+            value <<= 1
+            rng[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def bounds(code):
+    """(min_lat, min_lon, max_lat, max_lon) ячейки"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in code:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            middle = (rng[0] + rng[1]) / 2
+            if value >> shift & 1:
+                rng[0] = middle
+            else:
+                rng[1] = middle
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def center(code):
+    min_lat, min_lon, max_lat, max_lon = bounds(code)
+    return (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+
+
+def neighbours(code):
+    """Ячейка и ее 8 соседей той же длины (с переходом через 180-й меридиан)"""
+    min_lat, min_lon, max_lat, max_lon = bounds(code)
+    lat, lon = (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+    height, width = max_lat - min_lat, max_lon - min_lon
+    cells = set()
+    for dlat in (-height, 0, height):
+        for dlon in (-width, 0, width):
+            nlat = lat + dlat
+            if not -90 < nlat < 90:
+                continue
+            nlon = (lon + dlon + 180) % 360 - 180
+            cells.add(encode(nlat, nlon, len(code)))
+    return cells
+
+
+def cell_size(precision):
+    """(высота, ширина) ячейки длины precision в градусах"""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def covering(min_lat, min_lon, max_lat, max_lon, precision):
+    """Ячейки длины precision, покрывающие прямоугольник (без перехода через 180-й меридиан)"""
+    height, width = cell_size(precision)
+    lats = _steps(max(min_lat, -90.0), min(max_lat, 90.0), height)
+    lons = _steps(max(min_lon, -180.0), min(max_lon, 180.0), width)
+    return {encode(lat, lon, precision) for lat in lats for lon in lons}
+
+
+def _steps(start, end, step):
+    # Шаг в одну ячейку плюс правая граница, чтобы задеть крайнюю ячейку
+    values = []
+    value = start
+    while value < end:
+        values.append(value)
+        value += step
+    values.append(end)
+    return values
+
+
+def prefix_range(prefix):
+    """Границы диапазона строк с этим префиксом: prefix <= x < end"""
+    return prefix, prefix + '~'
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Расстояние по большому кругу (формула гаверсинусов)"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
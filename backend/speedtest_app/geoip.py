@@ -0,0 +1,197 @@
+"""Локальная база IP -> местоположение/провайдер.
+
+Индекс строится из CSV-дампа диапазонов командой build_geoip_index и
+хранится в одном файле:
+
+    заголовок   MAGIC, число диапазонов, смещение таблицы мест (<8sQQ)
+    диапазоны   начало (16 байт), конец (16 байт), номер места (uint32)
+    места       JSON-список [страна, город, провайдер, широта, долгота]
+
+Адреса IPv4 хранятся как IPv4-mapped IPv6, поэтому оба семейства лежат в
+одном массиве. Big-endian байты сравниваются так же, как числа, поэтому
+поиск - обычный бинарный поиск прямо по mmap без декодирования.
+"""
+import bisect
+import csv
+import ipaddress
+import json
+import logging
+import mmap
+import os
+import socket
+import struct
+import threading
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SPGEO1\x00\x00'
+HEADER = struct.Struct('<8sQQ')
+RECORD = struct.Struct('>16s16sI')
+IPV4_PREFIX = b'\x00' * 10 + b'\xff\xff'
+
+
+def ip_key(value):
+    """16-байтовый ключ адреса (IPv4 -> ::ffff:a.b.c.d)"""
+    if isinstance(value, int) or (isinstance(value, str) and value.isdigit()):
+        address = ipaddress.ip_address(int(value))
+        return (IPV4_PREFIX + address.packed) if address.version == 4 else address.packed
+
+    value = str(value).strip()
+    try:
+        return IPV4_PREFIX + socket.inet_pton(socket.AF_INET, value)
+    except OSError:
+        pass
+    try:
+        return socket.inet_pton(socket.AF_INET6, value)
+    except OSError:
+        raise ValueError(f'Некорректный IP-адрес: {value!r}')
+
+
+class _Starts:
+    """Последовательность начал диапазонов поверх mmap для bisect"""
+
+    def __init__(self, buffer, count):
+        self.buffer = buffer
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        offset = HEADER.size + index * RECORD.size
+        return self.buffer[offset:offset + 16]
+
+
+class GeoIPIndex:
+    """Отсортированный массив диапазонов, открытый через mmap"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.mtime = os.path.getmtime(self.path)
+        with open(self.path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count, locations_offset = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f'{self.path}: не похоже на индекс GeoIP')
+        self.locations = json.loads(self._mmap[locations_offset:].decode('utf-8'))
+        self._starts = _Starts(self._mmap, self.count)
+
+    def close(self):
+        self._mmap.close()
+
+    def lookup(self, ip):
+        """Данные о месте в формате ip_service или None"""
+        try:
+            key = ip_key(ip)
+        except ValueError:
+            return None
+
+        index = bisect.bisect_right(self._starts, key) - 1
+        if index < 0:
+            return None
+        _, end, location = RECORD.unpack_from(self._mmap, HEADER.size + index * RECORD.size)
+        if key > end:
+            return None
+
+        country, city, isp, lat, lon = self.locations[location]
+        return {
+            'ip': ip,
+            'country': country,
+            'city': city,
+            'isp': isp,
+            'provider': isp,
+            'lat': lat,
+            'lon': lon
+        }
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def read_csv(f):
+    """Строки дампа: начало, конец, страна, город, провайдер, широта, долгота.
+
+    Адреса - в текстовом виде или числом. Строка заголовка пропускается.
+    """
+    for row in csv.reader(f):
+        if not row or row[0].startswith('#'):
+            continue
+        try:
+            start, end = ip_key(row[0]), ip_key(row[1])
+        except ValueError:
+            continue  # заголовок или мусор
+        row = row + [''] * (7 - len(row))
+        yield start, end, (row[2], row[3], row[4], _float(row[5]), _float(row[6]))
+
+
+def build_index(ranges, path):
+    """Записывает индекс атомарно (через временный файл).
+
+    ranges - итератор (начало, конец, (страна, город, провайдер, lat, lon)).
+    Возвращает число диапазонов.
+    """
+    location_ids = {}
+    records = []
+    for start, end, location in ranges:
+        if start > end:
+            start, end = end, start
+        location_id = location_ids.setdefault(location, len(location_ids))
+        records.append((start, end, location_id))
+    records.sort()
+
+    locations = [list(location) for location in location_ids]
+    tmp_path = f'{path}.tmp'
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp_path, 'wb') as f:
+        locations_offset = HEADER.size + len(records) * RECORD.size
+        f.write(HEADER.pack(MAGIC, len(records), locations_offset))
+        for record in records:
+            f.write(RECORD.pack(*record))
+        f.write(json.dumps(locations, ensure_ascii=False).encode('utf-8'))
+    os.replace(tmp_path, path)
+
+    return len(records)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Открытый индекс или None, если файла нет. После пересборки файла
+    индекс переоткрывается автоматически"""
+    global _index
+    path = getattr(settings, 'GEOIP_INDEX_PATH', None)
+    if not path or not os.path.exists(path):
+        return None
+
+    index = _index
+    if index is not None and index.path == str(path) and index.mtime == os.path.getmtime(path):
+        return index
+
+    with _index_lock:
+        if _index is None or _index.path != str(path) or _index.mtime != os.path.getmtime(path):
+            try:
+                _index = GeoIPIndex(path)
+            except (OSError, ValueError):
+                logger.exception('Ошибка открытия индекса GeoIP %s', path)
+                _index = None
+        return _index
+
+
+def lookup(ip):
+    index = get_index()
+    if index is None or not ip:
+        return None
+    with metrics.phase('geoip'):
+        return index.lookup(ip)
@@ -0,0 +1,182 @@
+"""Запись результатов тестов.
+
+RESULTS_WRITE_MODE = 'sync' - каждый результат сохраняется сразу (одна
+транзакция на результат). 'buffered' - результаты копятся в очереди и
+пишутся через bulk_create, когда набирается RESULTS_FLUSH_SIZE штук или
+проходит RESULTS_FLUSH_INTERVAL секунд. Это быстрее на SQLite, но
+результаты, еще не записанные в БД, теряются при падении процесса.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+from . import enrichment, response_cache, rollups
+from .models import SpeedTestResult
+
+logger = logging.getLogger(__name__)
+
+BULK_BATCH_SIZE = 500
+DELETE_BATCH_SIZE = 5000
+
+
+def _roll_up_inline(ids):
+    """Сразу учитывает сохраненные результаты в сводках.
+
+    Ошибка сводок не отменяет сохранение: строки остаются с rolled_up=False,
+    и их учтет compact_rollups. roll_up работает в своей транзакции (внутри
+    другой - в точке сохранения), поэтому откатывается только он сам.
+    """
+    try:
+        rollups.roll_up(ids)
+    except Exception:
+        logger.exception('Ошибка обновления сводок, результаты учтет compact_rollups')
+
+
+def write_results(results):
+    """Пишет пачку результатов одной транзакцией"""
+    with transaction.atomic():
+        SpeedTestResult.objects.bulk_create(results, batch_size=BULK_BATCH_SIZE)
+        if any(result.geo_pending for result in results):
+            transaction.on_commit(enrichment.schedule)
+        if rollups.inline_enabled():
+            _roll_up_inline([result.pk for result in results if not result.geo_pending])
+        # История этих пользователей изменилась
+        response_cache.bump(*{response_cache.user_scope(result.user_id) for result in results if result.user_id})
+    return len(results)
+
+
+def delete_results(queryset, batch_size=DELETE_BATCH_SIZE):
+    """Удаляет результаты queryset пачками по batch_size, каждая пачка - своя транзакция.
+
+    Короткие транзакции не держат блокировку таблицы на все удаление.
+    Сводки не меняются: они хранят статистику и по удаленным результатам.
+    Возвращает число удаленных строк.
+    """
+    deleted = 0
+    while True:
+        rows = list(queryset.order_by('pk').values_list('pk', 'user_id')[:batch_size])
+        if not rows:
+            return deleted
+        deleted += delete_rows(rows)
+
+
+def delete_rows(rows):
+    """Удаляет одну пачку результатов [(id, user_id)] и сбрасывает кэш истории их пользователей"""
+    with transaction.atomic():
+        deleted = SpeedTestResult.objects.filter(pk__in=[pk for pk, _ in rows]).delete()[0]
+        response_cache.bump(*{response_cache.user_scope(user_id) for _, user_id in rows if user_id})
+    return deleted
+
+
+class WriteBehindQueue:
+    """Ограниченная очередь результатов с записью пачками в фоновом потоке.
+
+    Если очередь доросла до max_pending (фон не успевает), пачку пишет
+    вызывающий поток - результаты не теряются и память не растет.
+    """
+
+    def __init__(self, flush_size=100, flush_interval=1.0, max_pending=5000):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.flushed = 0
+        self._items = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def put(self, result):
+        with self._lock:
+            self._items.append(result)
+            pending = len(self._items)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='results-flusher', daemon=True)
+                self._thread.start()
+
+        if pending >= self.max_pending:
+            try:
+                self.flush()
+            except Exception:
+                # Вызывающий получит ошибку и может повторить запрос, поэтому
+                # его результат из очереди убираем, чтобы не записать дважды
+                with self._lock:
+                    self._items = [item for item in self._items if item is not result]
+                raise
+        elif pending >= self.flush_size:
+            self._wakeup.set()
+
+    def pending(self):
+        return len(self._items)
+
+    def flush(self):
+        """Записывает все накопленное. Возвращает число записанных строк.
+
+        Если запись не удалась (например, БД заблокирована), результаты
+        возвращаются в начало очереди и будут записаны следующей попыткой.
+        """
+        with self._flush_lock:
+            with self._lock:
+                items, self._items = self._items, []
+            if not items:
+                return 0
+            try:
+                write_results(items)
+            except Exception:
+                for item in items:
+                    # bulk_create мог успеть выдать id в откаченной транзакции
+                    item.pk = None
+                    item._state.adding = True
+                with self._lock:
+                    self._items[:0] = items
+                raise
+            self.flushed += len(items)
+            return len(items)
+
+    def _loop(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Ошибка записи результатов, в очереди %d', self.pending())
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = WriteBehindQueue(
+                    flush_size=getattr(settings, 'RESULTS_FLUSH_SIZE', 100),
+                    flush_interval=getattr(settings, 'RESULTS_FLUSH_INTERVAL', 1.0),
+                )
+                atexit.register(_queue.flush)
+    return _queue
+
+
+def save_result(result):
+    """Сохраняет результат согласно RESULTS_WRITE_MODE.
+
+    Возвращает True, если строка уже в БД (есть id), False - если в очереди.
+    """
+    if getattr(settings, 'RESULTS_WRITE_MODE', 'sync') == 'buffered':
+        get_queue().put(result)
+        return False
+
+    result.save()
+    if result.user_id:
+        response_cache.bump(response_cache.user_scope(result.user_id))
+    if result.geo_pending:
+        transaction.on_commit(enrichment.schedule)
+    elif rollups.inline_enabled():
+        _roll_up_inline([result.pk])
+    return True
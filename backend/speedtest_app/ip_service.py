@@ -1,20 +1,108 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
 import requests
-import json
+from django.conf import settings
+from requests.adapters import HTTPAdapter
 
+from . import geoip, metrics
 
-def get_ip_info(client_ip=None):
-    """Получение информации о местоположении по IP"""
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = 'https://ipapi.co'
+REQUEST_TIMEOUT = 5
+
+# Успешные ответы живут час, ошибки - минуту, чтобы не долбить упавший API
+CACHE_TTL = 60 * 60
+FAILURE_TTL = 60
+CACHE_MAX_SIZE = 10000
+
+
+class IPInfoCache:
+    """Кэш ответов по IP с TTL и вытеснением самых старых записей (LRU)"""
+
+    def __init__(self, max_size=CACHE_MAX_SIZE, clock=time.monotonic):
+        self.max_size = max_size
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at > self.clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, self.clock() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.ok = False
+
+
+_cache = IPInfoCache()
+_inflight = {}
+_inflight_lock = threading.Lock()
+_collapsed = 0
+
+# Одна сессия на процесс: keep-alive соединения и TLS переиспользуются
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+_session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+def _fallback(client_ip):
+    return {
+        'ip': client_ip if client_ip else 'Не определен',
+        'country': 'Не определен',
+        'city': 'Не определен',
+        'isp': 'Не определен',
+        'provider': 'Не определен',
+        'lat': 0,
+        'lon': 0
+    }
+
+
+def _fetch(client_ip):
+    """Запрос к API. Возвращает (данные, успех)"""
+    base_url = getattr(settings, 'IP_INFO_API_URL', DEFAULT_API_URL).rstrip('/')
     try:
         # Если передан IP, используем его. Если нет — автоопределение
+        # (вернет IP сервера PythonAnywhere)
         if client_ip:
-            # Используем ipapi.co с переданным IP
-            url = f'https://ipapi.co/{client_ip}/json/'
+            url = f'{base_url}/{client_ip}/json/'
         else:
-            # Автоопределение (вернет IP сервера PythonAnywhere)
-            url = 'https://ipapi.co/json/'
+            url = f'{base_url}/json/'
 
-        # Отправляем запрос
-        response = requests.get(url, timeout=5)
+        response = _session.get(url, timeout=REQUEST_TIMEOUT)
 
         if response.status_code == 200:
             data = response.json()
@@ -28,20 +116,100 @@ def get_ip_info(client_ip=None):
                 'provider': data.get('org', data.get('isp', 'Не определен')),
                 'lat': data.get('latitude', 0),
                 'lon': data.get('longitude', 0)
-            }
+            }, True
         else:
             raise Exception(f"API вернул статус {response.status_code}")
 
     except Exception as e:
-        print(f"Ошибка получения информации о IP: {e}")
+        logger.warning('Ошибка получения информации о IP: %s', e)
 
         # Fallback данные
-        return {
-            'ip': client_ip if client_ip else 'Не определен',
-            'country': 'Не определен',
-            'city': 'Не определен',
-            'isp': 'Не определен',
-            'provider': 'Не определен',
-            'lat': 0,
-            'lon': 0
-        }
\ No newline at end of file
+        return _fallback(client_ip), False
+
+
+def _lookup(client_ip):
+    """(данные, успех). При ошибке API данные - заглушка _fallback"""
+    global _collapsed
+
+    local = geoip.lookup(client_ip)
+    if local is not None:
+        metrics.count_lookup('local')
+        return local, True
+    if not getattr(settings, 'IP_INFO_REMOTE_FALLBACK', True):
+        # Без API ответ окончательный, повторять запрос незачем
+        metrics.count_lookup('fallback')
+        return _fallback(client_ip), True
+
+    key = client_ip or ''
+
+    cached = _cache.get(key)
+    if cached is not None:
+        metrics.count_lookup('cache')
+        data, ok = cached
+        return dict(data), ok
+
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = _Flight()
+        else:
+            _collapsed += 1
+
+    if not leader:
+        metrics.count_lookup('collapsed')
+        with metrics.phase('ipapi'):
+            flight.done.wait(REQUEST_TIMEOUT * 2)
+        if flight.result is None:
+            return _fallback(client_ip), False
+        return dict(flight.result), flight.ok
+
+    try:
+        with metrics.phase('ipapi'):
+            data, ok = _fetch(client_ip)
+        metrics.count_lookup('remote' if ok else 'remote_error')
+        _cache.set(key, (data, ok), CACHE_TTL if ok else FAILURE_TTL)
+        flight.result, flight.ok = data, ok
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+        flight.done.set()
+
+    return dict(data), ok
+
+
+def get_ip_info(client_ip=None):
+    """Получение информации о местоположении по IP.
+
+    Сначала ищем в локальном индексе GeoIP (без сети). Если адреса там нет,
+    обращаемся к API (если IP_INFO_REMOTE_FALLBACK не выключен): ответы
+    кэшируются по IP, а одновременные запросы одного и того же IP
+    склеиваются в один запрос. Если API не ответил, возвращается заглушка
+    "Не определен".
+    """
+    return _lookup(client_ip)[0]
+
+
+def lookup_ip_info(client_ip):
+    """Как get_ip_info, но None, если API не ответил и запрос стоит повторить позже"""
+    data, ok = _lookup(client_ip)
+    return data if ok else None
+
+
+def get_cache_stats():
+    """Счетчики кэша для мониторинга"""
+    total = _cache.hits + _cache.misses
+    return {
+        'hits': _cache.hits,
+        'misses': _cache.misses,
+        'hit_ratio': round(_cache.hits / total, 4) if total else 0.0,
+        'collapsed': _collapsed,
+        'size': len(_cache),
+        'max_size': _cache.max_size,
+    }
+
+
+def clear_cache():
+    global _collapsed
+    _cache.clear()
+    _collapsed = 0
@@ -0,0 +1,77 @@
+"""Измерение задержки по WebSocket.
+
+Сервер отправляет пробы {"type": "probe", "seq": n} с интервалом
+interval_ms, клиент сразу отвечает {"type": "echo", "seq": n}. RTT
+считается по часам сервера. Ответ позже LATE_MS - опоздавший, без ответа
+за LOSS_TIMEOUT после последней пробы - потерянный.
+"""
+import statistics
+import time
+
+DEFAULT_COUNT = 20
+MAX_COUNT = 200
+DEFAULT_INTERVAL_MS = 50
+MIN_INTERVAL_MS = 5
+MAX_INTERVAL_MS = 1000
+# Пробы занимают не больше MAX_DURATION секунд: иначе редкие пробы держали
+# бы соединение открытым сколько угодно
+MAX_DURATION = 30.0  # секунды
+LATE_MS = 500
+LOSS_TIMEOUT = 2.0  # секунды
+START_TIMEOUT = 10.0  # секунды до сообщения start
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class ProbeSession:
+
+    def __init__(self, count=DEFAULT_COUNT, interval_ms=DEFAULT_INTERVAL_MS):
+        interval_ms = max(MIN_INTERVAL_MS, min(int(interval_ms), MAX_INTERVAL_MS))
+        self.interval = interval_ms / 1000
+        self.count = max(1, min(int(count), MAX_COUNT, int(MAX_DURATION / self.interval)))
+        self.sent = {}
+        self.rtts = {}
+
+    def probe(self, seq):
+        """Сообщение пробы; запоминает время отправки"""
+        self.sent[seq] = time.perf_counter()
+        return {'type': 'probe', 'seq': seq}
+
+    def echo(self, seq):
+        """Учитывает ответ на пробу seq (повторы и чужие номера игнорируются)"""
+        sent_at = self.sent.get(seq)
+        if sent_at is None or seq in self.rtts:
+            return
+        self.rtts[seq] = (time.perf_counter() - sent_at) * 1000
+
+    @property
+    def complete(self):
+        return len(self.sent) == self.count and len(self.rtts) == self.count
+
+    def result(self):
+        # RTT в порядке отправки - для джиттера важна последовательность
+        rtts = [self.rtts[seq] for seq in sorted(self.rtts)]
+        received = len(rtts)
+        result = {
+            'type': 'result',
+            'sent': len(self.sent),
+            'received': received,
+            'lost': len(self.sent) - received,
+            'late': sum(1 for rtt in rtts if rtt > LATE_MS),
+            'packet_loss': round((len(self.sent) - received) * 100 / len(self.sent), 2) if self.sent else 0.0,
+            'min': None,
+            'median': None,
+            'p95': None,
+            'jitter': None,
+        }
+        if rtts:
+            result['min'] = round(min(rtts), 3)
+            result['median'] = round(statistics.median(rtts), 3)
+            result['p95'] = round(_percentile(rtts, 0.95), 3)
+            # Среднее изменение RTT между соседними пробами (как в RFC 3550)
+            diffs = [abs(b - a) for a, b in zip(rtts, rtts[1:])]
+            result['jitter'] = round(sum(diffs) / len(diffs), 3) if diffs else 0.0
+        return result
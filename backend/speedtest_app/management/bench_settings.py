@@ -0,0 +1,15 @@
+"""Настройки серверов, которые запускает bench_concurrency.
+
+Берет все настройки из модуля BENCH_BASE_SETTINGS (по умолчанию
+backend.settings) и выключает контроль допуска: все клиенты замера идут
+с одного IP, и иначе замер считал бы отказы 429/503, а не передачи.
+"""
+import os
+from importlib import import_module
+
+_base = import_module(os.environ.get('BENCH_BASE_SETTINGS', 'backend.settings'))
+globals().update({name: value for name, value in vars(_base).items() if name.isupper()})
+
+TRANSFER_MAX_CONCURRENT = None
+TRANSFER_MAX_BANDWIDTH_MBPS = None
+TRANSFER_RATE_PER_IP = None
@@ -0,0 +1,31 @@
+"""Общие функции команд нагрузочных замеров (bench_concurrency, speedbench)"""
+import socket
+import time
+
+
+def free_port(host):
+    """Свободный порт для запуска тестового сервера"""
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def wait_port(host, port, timeout=15.0):
+    """Ждет, пока порт начнет принимать соединения; False по таймауту"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def percentile(values, q):
+    """Квантиль q (0..1) по ближайшему рангу или None для пустого списка"""
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[index]
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from speedtest_app import retention
+
+
+class Command(BaseCommand):
+    help = 'Переносит старые результаты в gzip NDJSON по месяцам, удаляет их пачками и возвращает место в БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Хранить результаты за N дней (по умолчанию RESULTS_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=retention.BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=retention.BATCH_PAUSE,
+                            help='Пауза между пачками удаления, секунды')
+        parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                            help='Один раз перевести SQLite в auto_vacuum = INCREMENTAL (полный VACUUM)')
+        parser.add_argument('--loop', type=float, default=0,
+                            help='Работать постоянно, запускаясь раз в N секунд')
+
+    def handle(self, *args, **options):
+        if options['enable_incremental_vacuum']:
+            if not retention.incremental_vacuum_enabled():
+                self.stdout.write('Полный VACUUM для перехода на инкрементальный режим...')
+                retention.enable_incremental_vacuum()
+            if not retention.incremental_vacuum_enabled():
+                raise CommandError('Инкрементальный vacuum доступен только для SQLite')
+
+        while True:
+            result = retention.run(options['days'], options['batch_size'], options['pause'])
+            months = ', '.join(result['months']) or '-'
+            self.stdout.write(f"Архивировано результатов: {result['archived']} (месяцы: {months})")
+            if result['vacuumed_pages'] is None:
+                self.stdout.write('Инкрементальный vacuum не включен (--enable-incremental-vacuum)')
+            elif result['vacuumed_pages']:
+                self.stdout.write(f"Освобождено страниц: {result['vacuumed_pages']}")
+            if not options['loop']:
+                return
+            time.sleep(options['loop'])
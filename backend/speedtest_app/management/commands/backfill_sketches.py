@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from speedtest_app import rollups, sketch
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает квантильные скетчи сводок (ResultRollup) по сохраненным результатам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', default=None, help='Только корзины начиная с этого времени (ISO)')
+        parser.add_argument('--chunk-size', type=int, default=50000)
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f"Некорректное время: {options['since']}")
+
+        if sketch.np is None:
+            self.stdout.write('numpy не установлен, значения раскладываются по корзинам без векторизации')
+
+        started = time.perf_counter()
+        processed = rollups.rebuild_sketches(since, options['chunk_size'])
+        self.stdout.write(f'Обработано результатов: {processed} за {time.perf_counter() - started:.1f} с')
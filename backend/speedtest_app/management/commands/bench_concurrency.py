@@ -0,0 +1,165 @@
+import asyncio
+import json
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from speedtest_app.management.benchutil import free_port, percentile, wait_port
+
+# Команды запуска серверов. {host} и {port} подставляются при запуске
+DEFAULT_SERVERS = {
+    'wsgi': 'gunicorn backend.wsgi:application --workers 1 --threads {threads} --bind {host}:{port}',
+    'asgi': 'uvicorn backend.asgi:application --workers 1 --host {host} --port {port} --log-level warning',
+}
+
+
+async def _client(host, port, path, connect_timeout):
+    """Один клиент: GET path, статус, время до первого байта и число байт тела.
+
+    ttfb считается только для ответа 200: отказы (429, 503) и ошибки сервера
+    приходят быстро и исказили бы время начала передачи.
+    """
+    started = time.perf_counter()
+    result = {'status': None, 'ttfb': None, 'bytes': 0, 'error': None, 'elapsed': None}
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), connect_timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        result['error'] = f'connect: {e.__class__.__name__}'
+        return result
+
+    try:
+        writer.write(
+            f'GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n'.encode('latin-1')
+        )
+        await writer.drain()
+
+        head = await reader.readuntil(b'\r\n\r\n')
+        first_byte = time.perf_counter() - started
+        result['status'] = int(head.split(b' ', 2)[1])
+        if result['status'] == 200:
+            result['ttfb'] = first_byte
+
+        while True:
+            chunk = await reader.read(256 * 1024)
+            if not chunk:
+                break
+            result['bytes'] += len(chunk)
+    except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+        result['error'] = e.__class__.__name__
+    finally:
+        result['elapsed'] = time.perf_counter() - started
+        writer.close()
+
+    return result
+
+
+async def _run_clients(host, port, path, clients, connect_timeout):
+    tasks = [_client(host, port, path, connect_timeout) for _ in range(clients)]
+    return await asyncio.gather(*tasks)
+
+
+class Command(BaseCommand):
+    help = 'Сравнение числа одновременных клиентов download-теста под WSGI и ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', default='wsgi,asgi', help='Какие серверы запускать: wsgi,asgi')
+        parser.add_argument('--clients', type=int, default=200, help='Число одновременных клиентов')
+        parser.add_argument('--duration', type=float, default=5.0, help='Длительность каждой передачи, с')
+        parser.add_argument('--threads', type=int, default=8, help='Потоков у WSGI-воркера')
+        parser.add_argument('--start-threshold', type=float, default=1.0,
+                            help='Клиент считается обслуженным, если первый байт пришел быстрее, с')
+        parser.add_argument('--admission', action='store_true',
+                            help='Оставить контроль допуска (по умолчанию выключен: все клиенты с одного IP)')
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--wsgi-cmd', default=DEFAULT_SERVERS['wsgi'])
+        parser.add_argument('--asgi-cmd', default=DEFAULT_SERVERS['asgi'])
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        results = []
+        for name in [s.strip() for s in options['servers'].split(',') if s.strip()]:
+            if name not in DEFAULT_SERVERS:
+                raise CommandError(f'Неизвестный сервер: {name}')
+            results.append(self.bench_server(name, options))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for r in results:
+            self.stdout.write(
+                f"{r['server']:>5}: {r['served']}/{r['clients']} клиентов начали получать данные "
+                f"за {r['start_threshold']} с, TTFB p50={r['ttfb_p50']} p99={r['ttfb_p99']} с, "
+                f"{r['mbps']} Мбит/с суммарно, "
+                f"ответы не 200: {', '.join(f'{code}: {n}' for code, n in r['statuses'].items()) or 'нет'}, "
+                f"ошибок соединения: {r['errors']}"
+            )
+
+    def bench_server(self, name, options):
+        host = options['host']
+        port = free_port(host)
+        command = options[f'{name}_cmd'].format(host=host, port=port, threads=options['threads'])
+
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+        if not options['admission']:
+            # Те же настройки, но без лимитов admission (см. bench_settings)
+            env['BENCH_BASE_SETTINGS'] = settings.SETTINGS_MODULE
+            env['DJANGO_SETTINGS_MODULE'] = 'speedtest_app.management.bench_settings'
+        try:
+            process = subprocess.Popen(
+                shlex.split(command), cwd=settings.BASE_DIR, env=env,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+        except FileNotFoundError:
+            raise CommandError(f'Не найден сервер для {name}: {command}')
+
+        try:
+            if not wait_port(host, port):
+                raise CommandError(f'Сервер {name} не запустился: {command}')
+
+            path = f"/api/download/?duration={options['duration']}"
+            started = time.perf_counter()
+            outcomes = asyncio.run(_run_clients(
+                host, port, path, options['clients'], connect_timeout=options['duration'] * 4,
+            ))
+            wall = time.perf_counter() - started
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+        ttfbs = [o['ttfb'] for o in outcomes if o['ttfb'] is not None]
+        total_bytes = sum(o['bytes'] for o in outcomes if o['status'] == 200)
+        threshold = options['start_threshold']
+        statuses = {}
+        for o in outcomes:
+            if o['status'] is not None and o['status'] != 200:
+                statuses[str(o['status'])] = statuses.get(str(o['status']), 0) + 1
+
+        return {
+            'server': name,
+            'command': command,
+            'clients': options['clients'],
+            'duration': options['duration'],
+            'start_threshold': threshold,
+            'served': sum(1 for t in ttfbs if t <= threshold),
+            'ttfb_p50': round(percentile(ttfbs, 0.5), 4) if ttfbs else None,
+            'ttfb_p99': round(percentile(ttfbs, 0.99), 4) if ttfbs else None,
+            'median_elapsed': round(statistics.median(o['elapsed'] for o in outcomes), 3),
+            'wall_time': round(wall, 3),
+            'bytes': total_bytes,
+            'mbps': round(total_bytes * 8 / (wall * 1000000), 1) if wall else 0,
+            # Ответы не 200 по кодам; errors - обрывы соединения и чтения
+            'statuses': dict(sorted(statuses.items())),
+            'errors': sum(1 for o in outcomes if o['error']),
+            'python': sys.version.split()[0],
+        }
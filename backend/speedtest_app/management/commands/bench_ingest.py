@@ -0,0 +1,61 @@
+import os
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from speedtest_app import ingest
+from speedtest_app.models import SpeedTestResult
+
+
+def _make(user, i):
+    return SpeedTestResult(
+        user=user, ip_address='10.0.0.1', ping=10 + i % 50, download=100.0, upload=20.0,
+        server='bench', provider='ISP', city='Город', country='Страна',
+    )
+
+
+class Command(BaseCommand):
+    help = ('Скорость записи результатов: save_result по одному против очереди с bulk_create. '
+            'Обе стороны делают одинаковую работу после записи (сводки и сброс кэша истории). '
+            'Работает на временной копии БД, рабочую базу не трогает')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000)
+        parser.add_argument('--flush-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        tmp = tempfile.TemporaryDirectory()
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tmp.name, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            user = User.objects.create_user('bench')
+
+            # Как /api/save/ в режиме sync: save(), сводки и сброс кэша на каждую строку
+            started = time.perf_counter()
+            with override_settings(RESULTS_WRITE_MODE='sync', ROLLUPS_INLINE=True):
+                for i in range(rows):
+                    ingest.save_result(_make(user, i))
+            single = rows / (time.perf_counter() - started)
+
+            # write_results делает то же самое, но на пачку
+            queue = ingest.WriteBehindQueue(flush_size=options['flush_size'], flush_interval=3600,
+                                            max_pending=options['flush_size'])
+            started = time.perf_counter()
+            for i in range(rows):
+                queue.put(_make(user, i))
+            queue.flush()
+            batched = rows / (time.perf_counter() - started)
+
+            assert SpeedTestResult.objects.filter(rolled_up=True).count() == rows * 2
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            tmp.cleanup()
+
+        self.stdout.write(f'save_result по одному:   {single:10.0f} строк/с')
+        self.stdout.write(f"очередь + bulk_create:   {batched:10.0f} строк/с (пачки по {options['flush_size']})")
+        self.stdout.write(f'ускорение: x{batched / single:.1f}')
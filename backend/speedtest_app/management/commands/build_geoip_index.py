@@ -0,0 +1,39 @@
+import gzip
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from speedtest_app import geoip
+
+
+def _open(path):
+    if str(path).endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+class Command(BaseCommand):
+    help = ('Строит (или обновляет) локальный индекс GeoIP из CSV-дампов диапазонов: '
+            'начало,конец,страна,город,провайдер,широта,долгота')
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv', nargs='+', help='CSV-файлы (можно .gz), IPv4 и IPv6')
+        parser.add_argument('--output', default=None, help='Путь к индексу (по умолчанию GEOIP_INDEX_PATH)')
+
+    def handle(self, *args, **options):
+        output = options['output'] or getattr(settings, 'GEOIP_INDEX_PATH', None)
+        if not output:
+            raise CommandError('Не задан путь к индексу (GEOIP_INDEX_PATH или --output)')
+
+        def ranges():
+            for path in options['csv']:
+                try:
+                    with _open(path) as f:
+                        yield from geoip.read_csv(f)
+                except OSError as e:
+                    raise CommandError(f'Не удалось прочитать {path}: {e}')
+
+        started = time.perf_counter()
+        count = geoip.build_index(ranges(), output)
+        self.stdout.write(f'Индекс {output}: {count} диапазонов за {time.perf_counter() - started:.1f} с')
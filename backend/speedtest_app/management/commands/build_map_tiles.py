@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from speedtest_app import tiles
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает ячейки карты (MapTile) по результатам, уже учтенным в сводках'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=tiles.REBUILD_CHUNK)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        processed = tiles.rebuild(options['chunk_size'])
+        self.stdout.write(f'Обработано результатов: {processed} за {time.perf_counter() - started:.1f} с')
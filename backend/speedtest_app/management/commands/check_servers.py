@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from speedtest_app import servers
+from speedtest_app.models import TestServer
+
+
+class Command(BaseCommand):
+    help = 'Проверяет тестовые узлы: задержку /api/ping/ и занятость /api/admission/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=float, default=0,
+                            help='Работать постоянно, проверяя узлы раз в N секунд')
+
+    def handle(self, *args, **options):
+        while True:
+            nodes = list(TestServer.objects.filter(is_active=True).order_by('name'))
+            healthy = servers.check_all(nodes)
+            if options['verbosity'] > 1:
+                for node in nodes:
+                    state = f'{node.rtt_ms} мс, передач {node.active_transfers}/{node.capacity}' if node.healthy else 'недоступен'
+                    self.stdout.write(f'{node.name}: {state}')
+            self.stdout.write(f'Здоровых узлов: {healthy} из {len(nodes)}')
+            if not options['loop']:
+                return
+            time.sleep(options['loop'])
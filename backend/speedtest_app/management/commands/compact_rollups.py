@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from speedtest_app import rollups
+
+
+class Command(BaseCommand):
+    help = 'Учитывает в сводках (ResultRollup) результаты, которые еще не учтены'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=rollups.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        total = rollups.compact(options['batch_size'])
+        self.stdout.write(f'Учтено результатов: {total}')
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from speedtest_app import enrichment
+
+
+class Command(BaseCommand):
+    help = 'Заполняет провайдера, город, страну и координаты у результатов с geo_pending=True'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=enrichment.BATCH_SIZE)
+        parser.add_argument('--loop', type=float, default=0,
+                            help='Работать постоянно, проверяя новые строки раз в N секунд')
+
+    def handle(self, *args, **options):
+        while True:
+            updated = enrichment.enrich_pending(options['batch_size'])
+            if updated or options['verbosity'] > 1:
+                self.stdout.write(f'Обновлено строк: {updated}')
+            if not options['loop']:
+                return
+            time.sleep(options['loop'])
@@ -0,0 +1,56 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+
+FAST_PATH = 'speedtest_app.middleware.MeasurementFastPathMiddleware'
+
+
+def _measure(path, requests, host):
+    client = Client(HTTP_HOST=host)
+    client.get(path)  # прогрев
+
+    totals = []
+    app = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.get(path)
+        totals.append((time.perf_counter() - started) * 1000)
+        if response.has_header('Server-Timing'):
+            # app;dur=... ставит быстрый путь, остальное - MetricsMiddleware
+            timings = dict(part.strip().split(';dur=') for part in response['Server-Timing'].split(','))
+            if 'app' in timings:
+                app.append(float(timings['app']))
+
+    totals.sort()
+    return {
+        'median_ms': round(statistics.median(totals), 4),
+        'p99_ms': round(totals[int(0.99 * (len(totals) - 1))], 4),
+        'app_median_ms': round(statistics.median(app), 4) if app else None,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Серверные накладные расходы на /api/ping/ с быстрым путем и без него'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--path', default='/api/ping/')
+
+    def handle(self, *args, **options):
+        host = settings.ALLOWED_HOSTS[-1] if settings.ALLOWED_HOSTS else 'localhost'
+
+        full_stack = [m for m in settings.MIDDLEWARE if m != FAST_PATH]
+        with override_settings(MIDDLEWARE=full_stack):
+            full = _measure(options['path'], options['requests'], host)
+        fast = _measure(options['path'], options['requests'], host)
+
+        self.stdout.write(f"Полный стек middleware: median={full['median_ms']} мс, p99={full['p99_ms']} мс")
+        self.stdout.write(
+            f"Быстрый путь:           median={fast['median_ms']} мс, p99={fast['p99_ms']} мс, "
+            f"из них view={fast['app_median_ms']} мс"
+        )
+        self.stdout.write(f"Осталось накладных расходов (обработчик Django и тестовый клиент): {round(fast['median_ms'] - (fast['app_median_ms'] or 0), 4)} мс")
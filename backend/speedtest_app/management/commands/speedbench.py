@@ -0,0 +1,317 @@
+import asyncio
+import json
+import os
+import resource
+import select
+import subprocess
+import sys
+import tempfile
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from speedtest_app.management.benchutil import free_port, percentile, wait_port
+
+ENDPOINTS = ('ping', 'download', 'upload', 'save', 'history')
+READY = 'SPEEDBENCH READY'
+
+# Что сравнивается с --baseline: метрика и направление (больше - лучше или хуже)
+REGRESSION_KEYS = (('rps', 1), ('p99_ms', -1), ('cpu_ms_per_mb', -1))
+
+
+def _proc_cpu(pid):
+    """Процессорное время процесса (user + sys), с. Только Linux, иначе None"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def _proc_peak_rss(pid):
+    """Пиковый RSS процесса, МБ. Только Linux, иначе None"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+async def _request(host, port, method, path, body=b'', headers=()):
+    """Один HTTP-запрос: (статус, байт тела ответа, секунд) или исключение"""
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = [f'{method} {path} HTTP/1.1', f'Host: {host}', 'Connection: close', *headers]
+        if body:
+            head.append(f'Content-Length: {len(body)}')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        if body:
+            writer.write(body)
+        await writer.drain()
+
+        status_line = await reader.readuntil(b'\r\n\r\n')
+        status = int(status_line.split(b' ', 2)[1])
+        received = 0
+        while True:
+            chunk = await reader.read(256 * 1024)
+            if not chunk:
+                break
+            received += len(chunk)
+    finally:
+        writer.close()
+    return status, received, time.perf_counter() - started
+
+
+async def _drive(host, port, request, clients, duration):
+    """clients клиентов шлют запросы подряд в течение duration секунд"""
+    latencies = []
+    totals = {'sent': 0, 'received': 0, 'errors': 0}
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        while time.perf_counter() < deadline:
+            method, path, body, headers = request
+            try:
+                status, received, elapsed = await _request(host, port, method, path, body, headers)
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                totals['errors'] += 1
+                continue
+            if status != 200:
+                totals['errors'] += 1
+                continue
+            latencies.append(elapsed)
+            totals['sent'] += len(body)
+            totals['received'] += received
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies, totals, time.perf_counter() - started
+
+
+def compare(results, baseline, max_regression):
+    """Список ухудшений относительно baseline больше чем на max_regression"""
+    regressions = []
+    for name, current in results['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous:
+            continue
+        for key, direction in REGRESSION_KEYS:
+            old, new = previous.get(key), current.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * direction
+            if change < -max_regression:
+                regressions.append({'endpoint': name, 'metric': key, 'baseline': old, 'current': new,
+                                    'change': round(change, 3)})
+    return regressions
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест ping/download/upload/save/history на локально запущенном '
+            'сервере. Работает офлайн: отдельная временная БД, геолокация без сети')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi',
+                            help='wsgi - встроенный многопоточный сервер Django, asgi - uvicorn')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+        parser.add_argument('--clients', type=int, default=10, help='Одновременных клиентов')
+        parser.add_argument('--duration', type=float, default=5.0, help='Секунд на каждый эндпоинт')
+        parser.add_argument('--size', type=int, default=1024 * 1024, help='Байт на download/upload')
+        parser.add_argument('--history-rows', type=int, default=500, help='Результатов в истории пользователя')
+        parser.add_argument('--admission', action='store_true',
+                            help='Оставить контроль допуска (по умолчанию выключен: все клиенты с одного IP)')
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+        parser.add_argument('--output', help='Сохранить JSON-результат в файл')
+        parser.add_argument('--baseline', help='JSON прошлого запуска для сравнения')
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help='Допустимое ухудшение относительно baseline (доля)')
+        # Внутренний режим: дочерний процесс с сервером
+        parser.add_argument('--serve', action='store_true', help='(внутреннее) запустить сервер')
+        parser.add_argument('--port', type=int)
+        parser.add_argument('--db')
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            return self.serve(options)
+
+        endpoints = [e.strip() for e in options['endpoints'].split(',') if e.strip()]
+        for name in endpoints:
+            if name not in ENDPOINTS:
+                raise CommandError(f'Неизвестный эндпоинт: {name}')
+
+        results = self.bench(endpoints, options)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        regressions = []
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                regressions = compare(results, json.load(f), options['max_regression'])
+            results['regressions'] = regressions
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.report(results)
+
+        if regressions:
+            raise CommandError(f'Ухудшение относительно {options["baseline"]}: {len(regressions)} метрик')
+
+    def bench(self, endpoints, options):
+        host = options['host']
+        port = free_port(host)
+        tmp = tempfile.TemporaryDirectory()
+        command = [
+            sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'speedbench', '--serve',
+            '--server', options['server'], '--host', host, '--port', str(port),
+            '--db', os.path.join(tmp.name, 'bench.sqlite3'), '--history-rows', str(options['history_rows']),
+        ]
+        if options['admission']:
+            command.append('--admission')
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env, text=True,
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        try:
+            ready, _, _ = select.select([process.stdout], [], [], 60)
+            line = process.stdout.readline() if ready else ''
+            if not line.startswith(READY) or not wait_port(host, port):
+                raise CommandError(f'Сервер не запустился: {" ".join(command)}')
+            cookie = line.split()[-1]
+
+            payload = os.urandom(options['size'])
+            save_body = json.dumps({'ping': 12.5, 'download': 95.1, 'upload': 40.2, 'server': 'bench'}).encode()
+            requests = {
+                'ping': ('GET', '/api/ping/', b'', ()),
+                'download': ('GET', f"/api/download/?size={options['size']}", b'', ()),
+                'upload': ('POST', '/api/upload/', payload, ('Content-Type: application/octet-stream',)),
+                'save': ('POST', '/api/save/', save_body, ('Content-Type: application/json', f'Cookie: {cookie}')),
+                'history': ('GET', '/api/history/?limit=20', b'', (f'Cookie: {cookie}',)),
+            }
+
+            results = {
+                'server': options['server'],
+                'clients': options['clients'],
+                'duration': options['duration'],
+                'size': options['size'],
+                'python': sys.version.split()[0],
+                'endpoints': {},
+            }
+            for name in endpoints:
+                cpu_before = _proc_cpu(process.pid)
+                latencies, totals, wall = asyncio.run(_drive(
+                    host, port, requests[name], options['clients'], options['duration'],
+                ))
+                cpu_after = _proc_cpu(process.pid)
+                results['endpoints'][name] = self.summarise(latencies, totals, wall, cpu_before, cpu_after)
+
+            results['peak_rss_mb'] = _proc_peak_rss(process.pid)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            tmp.cleanup()
+
+        if results.get('peak_rss_mb') is None:
+            # Не Linux: пиковый RSS завершившихся дочерних процессов (в КБ, на macOS - в байтах)
+            maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            results['peak_rss_mb'] = maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+        results['peak_rss_mb'] = round(results['peak_rss_mb'], 1)
+        return results
+
+    def summarise(self, latencies, totals, wall, cpu_before, cpu_after):
+        count = len(latencies)
+        megabytes = (totals['sent'] + totals['received']) / (1024 * 1024)
+        cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+        return {
+            'requests': count,
+            'errors': totals['errors'],
+            'rps': round(count / wall, 1) if wall else 0,
+            'mb_per_s': round(megabytes / wall, 2) if wall else 0,
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+            'cpu_seconds': round(cpu, 3) if cpu is not None else None,
+            'cpu_ms_per_request': round(cpu * 1000 / count, 3) if cpu is not None and count else None,
+            'cpu_ms_per_mb': round(cpu * 1000 / megabytes, 3) if cpu is not None and megabytes else None,
+        }
+
+    def report(self, results):
+        self.stdout.write(
+            f"Сервер {results['server']}, клиентов: {results['clients']}, "
+            f"{results['duration']} с на эндпоинт, пиковый RSS {results['peak_rss_mb']} МБ"
+        )
+        for name, r in results['endpoints'].items():
+            self.stdout.write(
+                f"{name:>9}: {r['rps']:8.1f} запр/с, {r['mb_per_s']:8.2f} МБ/с, "
+                f"p50={r['p50_ms']} мс p99={r['p99_ms']} мс, CPU {r['cpu_ms_per_request']} мс/запр "
+                f"({r['cpu_ms_per_mb']} мс/МБ), ошибок: {r['errors']}"
+            )
+        for item in results.get('regressions', []):
+            self.stdout.write(self.style.ERROR(
+                f"{item['endpoint']} {item['metric']}: {item['baseline']} -> {item['current']}"
+            ))
+
+    def serve(self, options):
+        """Дочерний процесс: временная БД, геолокация без сети, сервер"""
+        overrides = {}
+        if not options['admission']:
+            overrides.update(TRANSFER_MAX_CONCURRENT=None, TRANSFER_MAX_BANDWIDTH_MBPS=None, TRANSFER_RATE_PER_IP=None)
+        override_settings(
+            DEBUG=False,
+            ALLOWED_HOSTS=['*'],
+            GEOIP_INDEX_PATH=None,
+            IP_INFO_REMOTE_FALLBACK=False,
+            RESULTS_WRITE_MODE='sync',
+            **overrides,
+        ).enable()
+        from django.db import connection
+        connection.settings_dict['NAME'] = options['db']
+        call_command('migrate', verbosity=0, interactive=False)
+
+        from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+        from django.contrib.auth.models import User
+        from speedtest_app.models import SpeedTestResult
+
+        user = User.objects.create_user('speedbench')
+        SpeedTestResult.objects.bulk_create([
+            SpeedTestResult(user=user, ip_address='127.0.0.1', ping=10 + i % 40, download=100.0, upload=20.0,
+                            server='bench', provider='ISP', city='Город', country='Страна')
+            for i in range(options['history_rows'])
+        ])
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        connection.close()
+
+        print(f'{READY} {settings.SESSION_COOKIE_NAME}={session.session_key}', flush=True)
+
+        if options['server'] == 'asgi':
+            try:
+                import uvicorn
+            except ImportError:
+                raise CommandError('Для --server asgi нужен uvicorn')
+            from backend.asgi import application
+            uvicorn.run(application, host=options['host'], port=options['port'], log_level='warning')
+        else:
+            from django.core.servers.basehttp import run
+            from django.core.wsgi import get_wsgi_application
+            run(options['host'], options['port'], get_wsgi_application(), threading=True)
@@ -0,0 +1,254 @@
+"""Легкая инструментация: гистограммы задержек, счетчики байт и передач.
+
+Метрики живут в памяти процесса (у каждого воркера gunicorn/uvicorn свои,
+Prometheus собирает их с каждого). Запись метрики - пара операций со
+словарем под общей блокировкой, поэтому слой можно держать включенным в
+продакшене.
+
+Фазы запроса (db, geoip, ipapi, ...) копятся в contextvar текущего запроса
+и в конце попадают в гистограмму speedtest_phase_seconds и в заголовок
+Server-Timing. Вне запроса (фоновые потоки) фазы не пишутся.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_lock = threading.Lock()
+_timings = contextvars.ContextVar('speedtest_timings', default=None)
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+
+
+class Registry:
+    """Счетчики, gauge и гистограммы с метками в виде кортежей"""
+
+    def __init__(self):
+        self.help = {}
+        self.kinds = {}
+        self.label_names = {}
+        self.values = {}
+        # Функции, обновляющие gauge перед выдачей (состояние других модулей)
+        self.collectors = []
+
+    def describe(self, name, kind, help_text, labels=()):
+        self.kinds[name] = kind
+        self.help[name] = help_text
+        self.label_names[name] = labels
+        self.values[name] = {}
+
+    def inc(self, name, labels=(), amount=1):
+        with _lock:
+            series = self.values[name]
+            series[labels] = series.get(labels, 0) + amount
+
+    def dec(self, name, labels=(), amount=1):
+        self.inc(name, labels, -amount)
+
+    def series(self, name):
+        """Копия значений метрики {метки: значение}"""
+        with _lock:
+            return dict(self.values[name])
+
+    def set(self, name, labels, value):
+        with _lock:
+            self.values[name][labels] = value
+
+    def observe(self, name, labels, seconds):
+        with _lock:
+            series = self.values[name]
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = _Histogram()
+            histogram.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram.sum += seconds
+
+    def reset(self):
+        with _lock:
+            for series in self.values.values():
+                series.clear()
+
+    def render(self):
+        """Текстовый формат экспозиции Prometheus"""
+        for collect in self.collectors:
+            collect(self)
+        with _lock:
+            snapshot = {
+                name: [
+                    (labels, (list(value.counts), value.sum) if isinstance(value, _Histogram) else value)
+                    for labels, value in series.items()
+                ]
+                for name, series in self.values.items()
+            }
+
+        lines = []
+        for name, series in snapshot.items():
+            kind = self.kinds[name]
+            lines.append(f'# HELP {name} {self.help[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+            names = self.label_names[name]
+            for labels, value in sorted(series):
+                if kind != 'histogram':
+                    lines.append(f'{name}{_labels(names, labels)} {value}')
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(names + ("le",), labels + (str(bound),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(names, labels)} {total:.6f}')
+                lines.append(f'{name}_count{_labels(names, labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+registry = Registry()
+registry.describe('speedtest_request_duration_seconds', 'histogram',
+                  'Время обработки запроса по эндпоинтам', ('endpoint', 'method', 'status'))
+registry.describe('speedtest_phase_seconds', 'histogram',
+                  'Время фаз запроса (db, geoip, ipapi) по эндпоинтам', ('endpoint', 'phase'))
+registry.describe('speedtest_sent_bytes_total', 'counter',
+                  'Отданные байты тела ответа', ('endpoint',))
+registry.describe('speedtest_received_bytes_total', 'counter',
+                  'Принятые байты тела запроса', ('endpoint',))
+registry.describe('speedtest_active_transfers', 'gauge',
+                  'Идущие download/upload передачи', ('endpoint',))
+registry.describe('speedtest_ip_lookups_total', 'counter',
+                  'Поиск геоданных по источнику ответа', ('source',))
+registry.describe('speedtest_response_cache_total', 'counter',
+                  'Кэш ответов: hit, miss, not_modified (304)', ('namespace', 'result'))
+registry.describe('speedtest_admission_decisions_total', 'counter',
+                  'Решения контроля допуска передач: admitted или причина отказа', ('decision',))
+registry.describe('speedtest_admission_active', 'gauge', 'Допущенные и еще идущие передачи')
+registry.describe('speedtest_admission_waiting', 'gauge', 'Отказанные клиенты, ожидающие повтора')
+registry.describe('speedtest_admission_bandwidth_bytes', 'gauge', 'Суммарная скорость передач, байт/с')
+
+
+# --- Фазы запроса ---
+
+def start_request():
+    """Начинает сбор фаз; возвращает токен для finish_request"""
+    return _timings.set({})
+
+
+def finish_request(token, endpoint):
+    """Записывает фазы запроса в гистограмму; возвращает {фаза: секунды}"""
+    timings = _timings.get()
+    _timings.reset(token)
+    for name, seconds in timings.items():
+        registry.observe('speedtest_phase_seconds', (endpoint, name), seconds)
+    return timings
+
+
+def add_phase(name, seconds):
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name):
+    """Учитывает время блока как фазу name текущего запроса"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase(name, time.perf_counter() - started)
+
+
+def db_timer(execute, sql, params, many, context):
+    """Обертка connection.execute_wrapper: время SQL-запросов - фаза db"""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        add_phase('db', time.perf_counter() - started)
+
+
+def server_timing(timings, total):
+    """Значение заголовка Server-Timing: фазы и общее время, мс"""
+    parts = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in timings.items()]
+    parts.append(f'total;dur={total * 1000:.3f}')
+    return ', '.join(parts)
+
+
+# --- Передачи ---
+
+def observe_request(endpoint, method, status, seconds):
+    registry.observe('speedtest_request_duration_seconds', (endpoint, method, str(status)), seconds)
+
+
+def count_sent(endpoint, size):
+    if size:
+        registry.inc('speedtest_sent_bytes_total', (endpoint,), size)
+
+
+def count_received(endpoint, size):
+    if size:
+        registry.inc('speedtest_received_bytes_total', (endpoint,), size)
+
+
+def count_lookup(source):
+    registry.inc('speedtest_ip_lookups_total', (source,))
+
+
+def count_response_cache(namespace, result):
+    registry.inc('speedtest_response_cache_total', (namespace, result))
+
+
+def count_admission(decision):
+    registry.inc('speedtest_admission_decisions_total', (decision,))
+
+
+def register_collector(collect):
+    registry.collectors.append(collect)
+
+
+def transfer_started(endpoint):
+    registry.inc('speedtest_active_transfers', (endpoint,))
+
+
+def transfer_finished(endpoint):
+    registry.dec('speedtest_active_transfers', (endpoint,))
+
+
+def track_stream(endpoint, chunks):
+    """Оборачивает streaming_content: считает байты и держит передачу
+    активной, пока клиент читает ответ"""
+    transfer_started(endpoint)
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        count_sent(endpoint, sent)
+        transfer_finished(endpoint)
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def render():
+    return registry.render()
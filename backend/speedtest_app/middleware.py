@@ -0,0 +1,91 @@
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.urls import ResolverMatch, reverse
+
+from . import metrics, views
+
+# Измерительные эндпоинты: url name -> view
+FAST_PATH_VIEWS = {
+    'ping': views.ping_test,
+    'download': views.download_test,
+    'upload': views.upload_test,
+}
+
+
+class MeasurementFastPathMiddleware:
+    """Быстрый путь для ping/download/upload.
+
+    Стоит первым в MIDDLEWARE и для измерительных запросов вызывает view
+    напрямую: без сессий (чтения из БД), CSRF, auth и messages. Время работы
+    сервера отдается в заголовке Server-Timing, чтобы было видно, сколько
+    накладных расходов осталось в измеренном ping.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._routes = None
+
+    @property
+    def routes(self):
+        if self._routes is None:
+            # resolver_match готовится один раз: по нему MetricsMiddleware
+            # узнает имя эндпоинта
+            self._routes = {
+                reverse(name): (view, ResolverMatch(view, (), {}, url_name=name))
+                for name, view in FAST_PATH_VIEWS.items()
+            }
+        return self._routes
+
+    def __call__(self, request):
+        started = time.perf_counter()
+
+        route = self.routes.get(request.path_info) if request.method in ('GET', 'POST') else None
+        if route is None:
+            return self.get_response(request)
+
+        view, request.resolver_match = route
+        response = view(request)
+        if getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', False):
+            response['Access-Control-Allow-Origin'] = '*'
+        response['Server-Timing'] = f'app;dur={(time.perf_counter() - started) * 1000:.3f}'
+        return response
+
+
+class MetricsMiddleware:
+    """Время запросов и фаз (db, geoip, ipapi), байты по эндпоинтам.
+
+    Стоит в MIDDLEWARE самым первым, чтобы учитывать и быстрый путь.
+    Фазы и общее время добавляются в Server-Timing. Передачи download/upload
+    (активные и отданные потоком байты) учитывают сами view.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        token = metrics.start_request()
+        try:
+            with connection.execute_wrapper(metrics.db_timer):
+                response = self.get_response(request)
+        finally:
+            match = getattr(request, 'resolver_match', None)
+            endpoint = (match.url_name if match is not None else None) or 'unknown'
+            timings = metrics.finish_request(token, endpoint)
+        elapsed = time.perf_counter() - started
+
+        metrics.observe_request(endpoint, request.method, response.status_code, elapsed)
+        metrics.count_received(endpoint, int(request.META.get('CONTENT_LENGTH') or 0))
+        if not response.streaming:
+            metrics.count_sent(endpoint, len(response.content))
+
+        timing = metrics.server_timing(timings, elapsed)
+        if response.has_header('Server-Timing'):
+            timing = f"{response['Server-Timing']}, {timing}"
+        response['Server-Timing'] = timing
+        return response
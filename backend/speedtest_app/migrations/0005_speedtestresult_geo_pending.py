@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 09:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speedtest_app', '0004_speedtestresult_city_speedtestresult_country_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='speedtestresult',
+            name='geo_pending',
+            field=models.BooleanField(db_index=True, default=False, help_text='Ждет заполнения геоданных'),
+        ),
+    ]
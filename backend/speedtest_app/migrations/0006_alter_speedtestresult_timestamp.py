@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-18 09:26
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speedtest_app', '0005_speedtestresult_geo_pending'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='speedtestresult',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
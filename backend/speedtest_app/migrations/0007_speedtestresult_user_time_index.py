@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 09:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speedtest_app', '0006_alter_speedtestresult_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='speedtestresult',
+            index=models.Index(fields=['user', 'timestamp', 'id'], name='result_user_time_idx'),
+        ),
+    ]
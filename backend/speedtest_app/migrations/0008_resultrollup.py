@@ -0,0 +1,56 @@
+# Generated by Django 4.2 on 2026-10-18 09:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speedtest_app', '0007_speedtestresult_user_time_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Час'), ('day', 'Сутки')], max_length=4)),
+                ('bucket', models.DateTimeField(help_text='Начало часа/суток (UTC)')),
+                ('provider', models.CharField(blank=True, default='', max_length=200)),
+                ('city', models.CharField(blank=True, default='', max_length=100)),
+                ('country', models.CharField(blank=True, default='', max_length=100)),
+                ('server', models.CharField(blank=True, default='', max_length=200)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('ping_sum', models.FloatField(default=0)),
+                ('ping_min', models.FloatField(null=True)),
+                ('ping_max', models.FloatField(null=True)),
+                ('download_sum', models.FloatField(default=0)),
+                ('download_min', models.FloatField(null=True)),
+                ('download_max', models.FloatField(null=True)),
+                ('upload_sum', models.FloatField(default=0)),
+                ('upload_min', models.FloatField(null=True)),
+                ('upload_max', models.FloatField(null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='speedtestresult',
+            name='rolled_up',
+            field=models.BooleanField(db_index=True, default=False, help_text='Учтен в ResultRollup'),
+        ),
+        migrations.AddIndex(
+            model_name='resultrollup',
+            index=models.Index(fields=['period', 'provider', 'bucket'], name='rollup_provider_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='resultrollup',
+            index=models.Index(fields=['period', 'country', 'city', 'bucket'], name='rollup_location_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='resultrollup',
+            index=models.Index(fields=['period', 'server', 'bucket'], name='rollup_server_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='resultrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'provider', 'city', 'country', 'server'), name='rollup_unique_key'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-18 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speedtest_app', '0008_resultrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resultrollup',
+            name='download_sketch',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='resultrollup',
+            name='ping_sketch',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='resultrollup',
+            name='upload_sketch',
+            field=models.BinaryField(default=b''),
+        ),
+    ]
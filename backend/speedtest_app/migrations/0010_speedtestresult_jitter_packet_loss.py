@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 09:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speedtest_app', '0009_resultrollup_sketches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='speedtestresult',
+            name='jitter',
+            field=models.FloatField(blank=True, help_text='В миллисекундах', null=True),
+        ),
+        migrations.AddField(
+            model_name='speedtestresult',
+            name='packet_loss',
+            field=models.FloatField(blank=True, help_text='Потерянные пробы, %', null=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-18 09:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speedtest_app', '0010_speedtestresult_jitter_packet_loss'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestServer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.SlugField(help_text='Записывается в SpeedTestResult.server', unique=True)),
+                ('url', models.URLField(help_text='Базовый адрес узла, например https://eu1.example.com')),
+                ('city', models.CharField(blank=True, default='', max_length=100)),
+                ('country', models.CharField(blank=True, default='', max_length=100)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('geohash', models.CharField(editable=False, max_length=12)),
+                ('capacity', models.PositiveIntegerField(default=32, help_text='Одновременных передач')),
+                ('is_active', models.BooleanField(default=True)),
+                ('healthy', models.BooleanField(default=True)),
+                ('active_transfers', models.PositiveIntegerField(default=0)),
+                ('rtt_ms', models.FloatField(blank=True, help_text='RTT проверки здоровья', null=True)),
+                ('checked_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='testserver',
+            index=models.Index(fields=['geohash'], name='testserver_geohash_idx'),
+        ),
+    ]
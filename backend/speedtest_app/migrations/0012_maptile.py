@@ -0,0 +1,35 @@
+# Generated by Django 4.2 on 2026-10-18 09:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speedtest_app', '0011_testserver'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MapTile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('precision', models.PositiveSmallIntegerField()),
+                ('geohash', models.CharField(max_length=12)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('ping_sum', models.FloatField(default=0)),
+                ('download_sum', models.FloatField(default=0)),
+                ('upload_sum', models.FloatField(default=0)),
+                ('ping_median', models.FloatField(null=True)),
+                ('download_median', models.FloatField(null=True)),
+                ('upload_median', models.FloatField(null=True)),
+                ('ping_sketch', models.BinaryField(default=b'')),
+                ('download_sketch', models.BinaryField(default=b'')),
+                ('upload_sketch', models.BinaryField(default=b'')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='maptile',
+            constraint=models.UniqueConstraint(fields=('precision', 'geohash'), name='maptile_unique_cell'),
+        ),
+    ]
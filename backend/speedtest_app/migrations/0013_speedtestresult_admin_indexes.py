@@ -0,0 +1,29 @@
+# Generated by Django 4.2 on 2026-10-18 09:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speedtest_app', '0012_maptile'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='speedtestresult',
+            index=models.Index(fields=['timestamp', 'id'], name='result_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='speedtestresult',
+            index=models.Index(fields=['country', 'timestamp', 'id'], name='result_country_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='speedtestresult',
+            index=models.Index(fields=['provider', 'timestamp', 'id'], name='result_provider_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='speedtestresult',
+            index=models.Index(fields=['server', 'timestamp', 'id'], name='result_server_time_idx'),
+        ),
+    ]
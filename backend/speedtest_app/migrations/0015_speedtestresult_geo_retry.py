@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speedtest_app', '0014_archivedmaptile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='speedtestresult',
+            name='geo_attempts',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Неудачных запросов геоданных'),
+        ),
+        migrations.AddField(
+            model_name='speedtestresult',
+            name='geo_retry_at',
+            field=models.DateTimeField(blank=True, help_text='Не раньше этого времени повторить запрос', null=True),
+        ),
+    ]
@@ -1,11 +1,18 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from . import geohash
 
 class SpeedTestResult(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Не auto_now_add: при пакетной записи время ставится при создании объекта,
+    # а офлайн-клиенты присылают время своих тестов
+    timestamp = models.DateTimeField(default=timezone.now)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     ping = models.FloatField(help_text="В миллисекундах")
+    jitter = models.FloatField(null=True, blank=True, help_text="В миллисекундах")
+    packet_loss = models.FloatField(null=True, blank=True, help_text="Потерянные пробы, %")
     download = models.FloatField(help_text="В Мбит/с")
     upload = models.FloatField(help_text="В Мбит/с")
     server = models.CharField(max_length=200, default="local")
@@ -14,9 +21,165 @@ class SpeedTestResult(models.Model):
     country = models.CharField(max_length=100, blank=True, null=True)
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
+    geo_pending = models.BooleanField(default=False, db_index=True, help_text="Ждет заполнения геоданных")
+    geo_attempts = models.PositiveSmallIntegerField(default=0, help_text="Неудачных запросов геоданных")
+    geo_retry_at = models.DateTimeField(null=True, blank=True, help_text="Не раньше этого времени повторить запрос")
+    rolled_up = models.BooleanField(default=False, db_index=True, help_text="Учтен в ResultRollup")
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # История пользователя: WHERE user_id = ? ORDER BY timestamp DESC, id DESC
+            models.Index(fields=['user', 'timestamp', 'id'], name='result_user_time_idx'),
+            # Админка: сортировка и date_hierarchy по времени, фильтры по стране, провайдеру и серверу
+            models.Index(fields=['timestamp', 'id'], name='result_time_idx'),
+            models.Index(fields=['country', 'timestamp', 'id'], name='result_country_time_idx'),
+            models.Index(fields=['provider', 'timestamp', 'id'], name='result_provider_time_idx'),
+            models.Index(fields=['server', 'timestamp', 'id'], name='result_server_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.timestamp.strftime('%Y-%m-%d %H:%M')} - DL: {self.download:.2f} Mbps"
+
+
+class ResultRollup(models.Model):
+    """Сводка результатов за час или сутки по провайдеру, городу, стране и серверу.
+
+    Обновляется инкрементально (rollups.roll_up), поэтому статистика не
+    требует чтения сырых результатов.
+    """
+    PERIOD_HOUR = 'hour'
+    PERIOD_DAY = 'day'
+    PERIOD_CHOICES = [(PERIOD_HOUR, 'Час'), (PERIOD_DAY, 'Сутки')]
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField(help_text="Начало часа/суток (UTC)")
+    provider = models.CharField(max_length=200, blank=True, default='')
+    city = models.CharField(max_length=100, blank=True, default='')
+    country = models.CharField(max_length=100, blank=True, default='')
+    server = models.CharField(max_length=200, blank=True, default='')
+
+    count = models.PositiveIntegerField(default=0)
+    ping_sum = models.FloatField(default=0)
+    ping_min = models.FloatField(null=True)
+    ping_max = models.FloatField(null=True)
+    download_sum = models.FloatField(default=0)
+    download_min = models.FloatField(null=True)
+    download_max = models.FloatField(null=True)
+    upload_sum = models.FloatField(default=0)
+    upload_min = models.FloatField(null=True)
+    upload_max = models.FloatField(null=True)
+    # Квантильные скетчи (sketch.DDSketch.to_bytes) для p50/p90/p99
+    ping_sketch = models.BinaryField(default=b'')
+    download_sketch = models.BinaryField(default=b'')
+    upload_sketch = models.BinaryField(default=b'')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['period', 'bucket', 'provider', 'city', 'country', 'server'],
+                name='rollup_unique_key',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'provider', 'bucket'], name='rollup_provider_idx'),
+            models.Index(fields=['period', 'country', 'city', 'bucket'], name='rollup_location_idx'),
+            models.Index(fields=['period', 'server', 'bucket'], name='rollup_server_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.period} {self.bucket:%Y-%m-%d %H:%M} {self.provider or '-'}: {self.count}"
+
+
+class MapTile(models.Model):
+    """Сводка результатов в ячейке geohash длины precision для карты.
+
+    Обновляется вместе со сводками (tiles.add), поэтому /api/map/ читает
+    только готовые ячейки в пределах видимой области.
+    """
+    precision = models.PositiveSmallIntegerField()
+    geohash = models.CharField(max_length=12)
+
+    count = models.PositiveIntegerField(default=0)
+    ping_sum = models.FloatField(default=0)
+    download_sum = models.FloatField(default=0)
+    upload_sum = models.FloatField(default=0)
+    # Медианы пересчитываются из скетчей при каждом обновлении ячейки
+    ping_median = models.FloatField(null=True)
+    download_median = models.FloatField(null=True)
+    upload_median = models.FloatField(null=True)
+    ping_sketch = models.BinaryField(default=b'')
+    download_sketch = models.BinaryField(default=b'')
+    upload_sketch = models.BinaryField(default=b'')
+
+    class Meta:
+        constraints = [
+            # Индекс ограничения обслуживает и выборку по диапазонам префиксов
+            models.UniqueConstraint(fields=['precision', 'geohash'], name='maptile_unique_cell'),
+        ]
+
+    def __str__(self):
+        return f"{self.geohash}: {self.count}"
+
+
+class ArchivedMapTile(models.Model):
+    """Вклад перенесенных в архив результатов в ячейку карты.
+
+    Пополняется в одной транзакции с удалением строк (retention.archive),
+    чтобы пересчет MapTile (tiles.rebuild) не терял архивные результаты.
+    """
+    precision = models.PositiveSmallIntegerField()
+    geohash = models.CharField(max_length=12)
+
+    count = models.PositiveIntegerField(default=0)
+    ping_sum = models.FloatField(default=0)
+    download_sum = models.FloatField(default=0)
+    upload_sum = models.FloatField(default=0)
+    ping_sketch = models.BinaryField(default=b'')
+    download_sketch = models.BinaryField(default=b'')
+    upload_sketch = models.BinaryField(default=b'')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['precision', 'geohash'], name='archivedmaptile_unique_cell'),
+        ]
+
+    def __str__(self):
+        return f"{self.geohash}: {self.count}"
+
+
+class TestServer(models.Model):
+    """Узел для тестов скорости в одном из регионов.
+
+    geohash считается из координат при сохранении и индексируется: поиск
+    ближайших узлов идет по диапазонам префиксов, а не перебором (servers.nearest).
+    """
+    name = models.SlugField(max_length=50, unique=True, help_text="Записывается в SpeedTestResult.server")
+    url = models.URLField(help_text="Базовый адрес узла, например https://eu1.example.com")
+    city = models.CharField(max_length=100, blank=True, default='')
+    country = models.CharField(max_length=100, blank=True, default='')
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    geohash = models.CharField(max_length=12, editable=False)
+    capacity = models.PositiveIntegerField(default=32, help_text="Одновременных передач")
+    is_active = models.BooleanField(default=True)
+    # Заполняются проверкой здоровья (manage.py check_servers)
+    healthy = models.BooleanField(default=True)
+    active_transfers = models.PositiveIntegerField(default=0)
+    rtt_ms = models.FloatField(null=True, blank=True, help_text="RTT проверки здоровья")
+    checked_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['geohash'], name='testserver_geohash_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.geohash = geohash.encode(self.latitude, self.longitude, 12)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
-        return f"{self.timestamp.strftime('%Y-%m-%d %H:%M')} - DL: {self.download:.2f} Mbps"
\ No newline at end of file
+        return f"{self.name} ({self.city or self.url})"
@@ -0,0 +1,171 @@
+"""Сессии многопоточного теста скорости.
+
+Клиент создает сессию (POST /api/session/) и запускает N параллельных
+download/upload с ?session=<id>&stream=<k>. Сервер складывает байты всех
+потоков в общую шкалу времени с шагом SLOT, отбрасывает разгон TCP
+(первые WARMUP секунд направления) и отдает общую скорость в
+GET /api/session/<id>/.
+
+Сессии живут в памяти процесса (не больше MAX_SESSIONS, TTL секунд),
+поэтому при нескольких воркерах все потоки сессии должны попадать в один
+процесс.
+"""
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+DIRECTIONS = ('download', 'upload')
+DEFAULT_STREAMS = 4
+MAX_STREAMS = 16
+SLOT = 0.1  # секунды
+MAX_SLOTS = 1200  # 2 минуты
+WARMUP = 1.0  # секунды
+TTL = 5 * 60
+MAX_SESSIONS = 1000
+
+
+class _Direction:
+    def __init__(self):
+        self.slots = []
+        self.started_at = None
+        self.streams = set()
+        self.active = 0
+        self.total = 0
+
+
+class StreamSession:
+
+    def __init__(self, streams=DEFAULT_STREAMS):
+        self.id = secrets.token_urlsafe(12)
+        self.streams = streams
+        self.created_at = time.monotonic()
+        self.directions = {direction: _Direction() for direction in DIRECTIONS}
+        self._stream_ids = set()
+        self._lock = threading.Lock()
+
+    def join(self, stream):
+        """Регистрирует номер потока; ValueError, если потоков уже столько, сколько объявлено"""
+        if stream is None:
+            return
+        with self._lock:
+            if stream not in self._stream_ids:
+                if len(self._stream_ids) >= self.streams:
+                    raise ValueError(f'В сессии не больше {self.streams} потоков')
+                self._stream_ids.add(stream)
+
+    def record(self, direction, size, stream=None):
+        """Учитывает size байт, переданных потоком stream прямо сейчас"""
+        now = time.monotonic()
+        with self._lock:
+            state = self.directions[direction]
+            if state.started_at is None:
+                state.started_at = now
+            slot = int((now - state.started_at) / SLOT)
+            if slot >= MAX_SLOTS:
+                return
+            if slot >= len(state.slots):
+                state.slots.extend([0] * (slot + 1 - len(state.slots)))
+            state.slots[slot] += size
+            state.total += size
+            if stream is not None:
+                state.streams.add(stream)
+
+    def track(self, direction, chunks, stream=None):
+        """Оборачивает итератор кусков ответа: каждый отданный кусок учитывается"""
+        with self._lock:
+            self.directions[direction].active += 1
+        try:
+            for chunk in chunks:
+                yield chunk
+                self.record(direction, len(chunk), stream)
+        finally:
+            with self._lock:
+                self.directions[direction].active -= 1
+
+    def summary(self, direction):
+        with self._lock:
+            state = self.directions[direction]
+            slots = list(state.slots)
+            result = {
+                'bytes': state.total,
+                'streams': len(state.streams),
+                'active_streams': state.active,
+                'mbps': 0.0,
+                'measured_bytes': 0,
+                'duration': 0.0,
+            }
+
+        # Разгон: первые WARMUP секунд, но не больше четверти всего теста
+        warmup_slots = min(int(WARMUP / SLOT), len(slots) // 4)
+        measured = slots[warmup_slots:]
+        # Последний слот обычно неполный - его не считаем, если есть из чего выбрать
+        if len(measured) > 1:
+            measured = measured[:-1]
+        duration = len(measured) * SLOT
+        if duration > 0:
+            result['measured_bytes'] = sum(measured)
+            result['duration'] = round(duration, 3)
+            result['mbps'] = round(sum(measured) * 8 / (duration * 1000000), 3)
+        return result
+
+    def to_dict(self):
+        return {
+            'session': self.id,
+            'streams': self.streams,
+            'download': self.summary('download'),
+            'upload': self.summary('upload'),
+        }
+
+
+class SessionStore:
+    """Ограниченное хранилище сессий с истечением по времени"""
+
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl=TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.created_at < self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+
+    def create(self, streams=DEFAULT_STREAMS):
+        session = StreamSession(max(1, min(streams, MAX_STREAMS)))
+        with self._lock:
+            self._sessions[session.id] = session
+            self._expire(session.created_at)
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and time.monotonic() - session.created_at >= self.ttl:
+                del self._sessions[session_id]
+                return None
+            return session
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+store = SessionStore()
+
+
+def from_params(params):
+    """(сессия, номер потока) из ?session=&stream=. (None, None), если
+    параметра нет; LookupError, если сессия не найдена или истекла;
+    ValueError, если номер потока сверх объявленного при создании числа"""
+    session_id = params.get('session')
+    if not session_id:
+        return None, None
+    session = store.get(session_id)
+    if session is None:
+        raise LookupError('Сессия не найдена или истекла')
+    stream = params.get('stream')
+    session.join(stream)
+    return session, stream
@@ -0,0 +1,78 @@
+import os
+import random
+import threading
+import time
+
+# Размер одного блока пула. Блоки отдаются клиенту как есть, без копирования
+CHUNK_SIZE = 256 * 1024  # 256 KB
+
+# Общий объем случайных данных, которые генерируются один раз на процесс
+POOL_SIZE = 8 * 1024 * 1024  # 8 MB
+
+DEFAULT_SIZE = 2 * 1024 * 1024  # 2 MB
+MAX_SIZE = 100 * 1024 * 1024  # 100 MB
+
+# Ограничение для режима "скачивать в течение N секунд"
+MAX_DURATION = 30.0  # секунды
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Пул несжимаемых случайных блоков (создается при первом обращении)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = tuple(os.urandom(CHUNK_SIZE) for _ in range(POOL_SIZE // CHUNK_SIZE))
+    return _pool
+
+
+def parse_size(value, default=DEFAULT_SIZE):
+    """Размер из ?size=, ограниченный диапазоном 1 байт .. MAX_SIZE"""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_SIZE))
+
+
+def parse_duration(value):
+    """Длительность из ?duration= в секундах, не больше MAX_DURATION"""
+    try:
+        duration = float(value)
+    except (TypeError, ValueError):
+        return None
+    if duration != duration or duration <= 0:  # NaN или неположительное
+        return None
+    return min(duration, MAX_DURATION)
+
+
+def iter_payload(size=None, duration=None):
+    """Отдает данные кусками из пула.
+
+    Останавливается после size байт и/или по истечении duration секунд -
+    смотря что наступит раньше. Целые блоки возвращаются как bytes из пула
+    (без копирования), последний неполный блок - как memoryview-срез.
+    Начальный блок выбирается случайно, чтобы соседние запросы не получали
+    одинаковые данные. Память на запрос не зависит от объема передачи.
+    """
+    pool = get_pool()
+    index = random.randrange(len(pool))
+    remaining = size
+    deadline = time.monotonic() + duration if duration else None
+
+    while remaining is None or remaining > 0:
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        block = pool[index]
+        if remaining is None:
+            yield block
+        elif remaining >= CHUNK_SIZE:
+            yield block
+            remaining -= CHUNK_SIZE
+        else:
+            yield memoryview(block)[:remaining]
+            remaining = 0
+        index = (index + 1) % len(pool)
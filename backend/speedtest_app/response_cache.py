@@ -0,0 +1,101 @@
+"""Кэш ответов read-эндпоинтов (история, статистика, карта) с версиями.
+
+Ключ ответа содержит версию данных: у каждого пользователя своя версия
+истории, у статистики и карты - общая. Запись результатов меняет версию одним
+cache.set, поэтому сброс - O(1), без перебора ключей: старые ответы просто
+перестают находиться и вытесняются сами. Каждый ответ отдается с ETag,
+и повторный запрос браузера с If-None-Match получает 304 без тела.
+
+Версии живут в кэше Django (CACHES['default']). При нескольких воркерах
+кэш должен быть общим (Redis, Memcached), иначе воркер не увидит смену
+версии, сделанную другим.
+"""
+import hashlib
+import uuid
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+
+from . import metrics
+
+HISTORY_TIMEOUT = 24 * 60 * 60
+# Статистика по умолчанию считается за окно до "сейчас", поэтому даже без
+# новых данных живет недолго
+STATS_TIMEOUT = 60
+# Ячейки карты не зависят от текущего времени и меняются только со сменой версии
+MAP_TIMEOUT = 60 * 60
+VERSION_TIMEOUT = None  # версии не истекают (вытесняются только при нехватке места)
+
+STATS_SCOPE = 'stats'
+
+
+def _version_key(scope):
+    return f'respver:{scope}'
+
+
+def get_version(scope):
+    """Текущая версия данных scope (создается при первом обращении)"""
+    version = cache.get(_version_key(scope))
+    if version is None:
+        cache.add(_version_key(scope), uuid.uuid4().hex, VERSION_TIMEOUT)
+        version = cache.get(_version_key(scope))
+    return version
+
+
+def bump(*scopes):
+    """Новые версии scopes после коммита транзакции: кэш старых ответов больше не используется"""
+    def apply():
+        cache.set_many({_version_key(scope): uuid.uuid4().hex for scope in scopes}, VERSION_TIMEOUT)
+    if scopes:
+        transaction.on_commit(apply)
+
+
+def user_scope(user_id):
+    return f'history:{user_id}'
+
+
+def cached_response(request, namespace, scope, build, timeout):
+    """Ответ build() из кэша по версии scope и параметрам запроса.
+
+    Кэшируются только ответы 200. ETag - хэш тела, Cache-Control: no-cache
+    заставляет браузер каждый раз сверять ETag с сервером.
+    """
+    query = urlencode(sorted(request.GET.items()))
+    digest = hashlib.md5(query.encode('utf-8')).hexdigest()
+    key = f'resp:{namespace}:{scope}:{get_version(scope)}:{digest}'
+
+    entry = cache.get(key)
+    if entry is None:
+        response = build()
+        if response.status_code != 200:
+            return response
+        etag = quote_etag(hashlib.md5(response.content).hexdigest())
+        entry = (response.content, response['Content-Type'], etag)
+        cache.set(key, entry, timeout)
+        metrics.count_response_cache(namespace, 'miss')
+    else:
+        metrics.count_response_cache(namespace, 'hit')
+
+    content, content_type, etag = entry
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        metrics.count_response_cache(namespace, 'not_modified')
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type=content_type)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def get_stats():
+    """Доля попаданий по пространствам имен (для /api/cache/stats/)"""
+    counts = {}
+    for (namespace, result), value in metrics.registry.series('speedtest_response_cache_total').items():
+        counts.setdefault(namespace, {'hit': 0, 'miss': 0, 'not_modified': 0})[result] = value
+    for namespace, item in counts.items():
+        total = item['hit'] + item['miss']
+        item['hit_ratio'] = round(item['hit'] / total, 3) if total else None
+    return counts
@@ -0,0 +1,160 @@
+"""Хранение результатов: старые строки уходят в архив и удаляются из таблицы.
+
+Результаты старше RESULTS_RETENTION_DAYS пишутся в gzip NDJSON по месяцам
+(RESULTS_ARCHIVE_DIR/results-ГГГГ-ММ.ndjson.gz) и удаляются пачками по
+BATCH_SIZE, каждая своей короткой транзакцией, с паузой между пачками,
+чтобы запись новых результатов не ждала долго. Удаляются только строки,
+уже учтенные в сводках и ячейках карты, поэтому статистика по ним остается.
+Вклад удаленных строк в ячейки карты запоминается в ArchivedMapTile.
+Освободившееся место SQLite возвращает инкрементальный vacuum шагами по
+VACUUM_STEP_PAGES страниц.
+
+Каждый запуск дописывает в файл месяца новый gzip-член, gzip и zcat читают
+такой файл целиком. Пачка сначала сбрасывается на диск и только потом
+удаляется: при сбое строки могут повториться в архиве (id уникален), но не
+потеряются.
+"""
+import os
+import time
+from datetime import timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from . import export, ingest, rollups, tiles
+from .models import SpeedTestResult
+
+ARCHIVE_FIELDS = export.GLOBAL_FIELDS + ('ip_address',)
+BATCH_SIZE = 2000
+BATCH_PAUSE = 0.05
+VACUUM_STEP_PAGES = 1000
+
+_ID = ARCHIVE_FIELDS.index('id')
+_TIMESTAMP = ARCHIVE_FIELDS.index('timestamp')
+_USER_ID = ARCHIVE_FIELDS.index('user_id')
+
+
+def retention_days():
+    # None - результаты хранятся бессрочно
+    return getattr(settings, 'RESULTS_RETENTION_DAYS', 365)
+
+
+def archive_dir():
+    return Path(getattr(settings, 'RESULTS_ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+
+
+def archive_path(directory, month):
+    return Path(directory) / f'results-{month}.ndjson.gz'
+
+
+def _write_archive(directory, rows):
+    by_month = {}
+    for row in rows:
+        month = f'{row[_TIMESTAMP].astimezone(dt_timezone.utc):%Y-%m}'
+        by_month.setdefault(month, []).append(export.format_row(row))
+
+    for month, month_rows in by_month.items():
+        with open(archive_path(directory, month), 'ab') as archive_file:
+            for chunk in export.gzip_chunks(export.iter_ndjson(month_rows, ARCHIVE_FIELDS)):
+                archive_file.write(chunk)
+            archive_file.flush()
+            os.fsync(archive_file.fileno())
+    return set(by_month)
+
+
+def archive(cutoff, directory=None, batch_size=BATCH_SIZE, pause=BATCH_PAUSE):
+    """Архивирует и удаляет результаты с timestamp < cutoff.
+
+    Сначала в сводки докладываются еще не учтенные результаты. Строки,
+    которые ждут геоданных, остаются до следующего запуска. Возвращает
+    (число удаленных строк, множество затронутых месяцев 'ГГГГ-ММ').
+    """
+    directory = Path(directory or archive_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+    rollups.compact(batch_size)
+
+    # По индексу result_time_idx
+    old = SpeedTestResult.objects.filter(timestamp__lt=cutoff, rolled_up=True).order_by('timestamp', 'id')
+    archived = 0
+    months = set()
+    while True:
+        rows = list(old.values_list(*ARCHIVE_FIELDS)[:batch_size])
+        if not rows:
+            return archived, months
+        months |= _write_archive(directory, rows)
+        with transaction.atomic():
+            # Вклад строк в ячейки карты переживает пересчет MapTile
+            tiles.archive([dict(zip(ARCHIVE_FIELDS, row)) for row in rows])
+            archived += ingest.delete_rows([(row[_ID], row[_USER_ID]) for row in rows])
+        if pause:
+            time.sleep(pause)
+
+
+def incremental_vacuum_enabled(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum')
+        return cursor.fetchone()[0] == 2  # INCREMENTAL
+
+
+def enable_incremental_vacuum(using=DEFAULT_DB_ALIAS):
+    """Переводит файл SQLite в режим auto_vacuum = INCREMENTAL.
+
+    Режим применяется полным VACUUM, который перестраивает весь файл и на
+    это время блокирует запись, поэтому нужен один раз.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('VACUUM')
+
+
+def vacuum(max_pages=None, step=VACUUM_STEP_PAGES, using=DEFAULT_DB_ALIAS):
+    """Возвращает файлу SQLite свободные страницы шагами по step.
+
+    Каждый шаг - отдельная короткая транзакция. Возвращает число
+    освобожденных страниц или None, если инкрементальный vacuum недоступен
+    (другая БД или не включен режим auto_vacuum = INCREMENTAL).
+    """
+    if not incremental_vacuum_enabled(using):
+        return None
+    freed = 0
+    with connections[using].cursor() as cursor:
+        cursor.execute('PRAGMA freelist_count')
+        free = cursor.fetchone()[0]
+        while free and (max_pages is None or freed < max_pages):
+            pages = min(step, free) if max_pages is None else min(step, free, max_pages - freed)
+            # Модуль sqlite3 делает один шаг прагмы за execute(), а шаг
+            # освобождает одну страницу; fetchall завершает оператор до COMMIT
+            with transaction.atomic(using=using):
+                for _ in range(pages):
+                    cursor.execute('PRAGMA incremental_vacuum(1)')
+                    cursor.fetchall()
+            cursor.execute('PRAGMA freelist_count')
+            left = cursor.fetchone()[0]
+            if left >= free:
+                break
+            freed += free - left
+            free = left
+    return freed
+
+
+def run(days=None, batch_size=BATCH_SIZE, pause=BATCH_PAUSE):
+    """Архивирует результаты старше days (по умолчанию RESULTS_RETENTION_DAYS) и возвращает место.
+
+    Задача для cron или планировщика (manage.py archive_results).
+    Возвращает {'archived', 'months', 'vacuumed_pages'}.
+    """
+    if days is None:
+        days = retention_days()
+    if days is None:
+        return {'archived': 0, 'months': [], 'vacuumed_pages': 0}
+    archived, months = archive(timezone.now() - timedelta(days=days), batch_size=batch_size, pause=pause)
+    return {
+        'archived': archived,
+        'months': sorted(months),
+        'vacuumed_pages': vacuum() if archived else 0,
+    }
@@ -0,0 +1,243 @@
+"""Инкрементальные сводки результатов (ResultRollup).
+
+Результат попадает в сводки один раз, когда его геоданные известны:
+при сохранении, после фонового заполнения геоданных или командой
+compact_rollups. Флаг SpeedTestResult.rolled_up защищает от двойного учета.
+Вместе со сводками обновляются ячейки карты (tiles.add).
+"""
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, Sum
+
+from . import response_cache, tiles
+from .models import ResultRollup, SpeedTestResult
+from .sketch import DDSketch
+
+METRICS = ('ping', 'download', 'upload')
+GROUP_FIELDS = ('provider', 'city', 'country', 'server')
+QUANTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))
+BATCH_SIZE = 1000
+
+
+def inline_enabled():
+    # Если False, сводки обновляет только команда compact_rollups
+    return getattr(settings, 'ROLLUPS_INLINE', True)
+
+
+def bucket_start(timestamp, period):
+    timestamp = timestamp.astimezone(dt_timezone.utc)
+    if period == ResultRollup.PERIOD_DAY:
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+class _Summary:
+    def __init__(self):
+        self.count = 0
+        self.sums = dict.fromkeys(METRICS, 0.0)
+        self.mins = dict.fromkeys(METRICS)
+        self.maxs = dict.fromkeys(METRICS)
+        self.sketches = {metric: DDSketch() for metric in METRICS}
+
+    def add(self, row):
+        self.count += 1
+        for metric in METRICS:
+            value = row[metric]
+            self.sums[metric] += value
+            if self.mins[metric] is None or value < self.mins[metric]:
+                self.mins[metric] = value
+            if self.maxs[metric] is None or value > self.maxs[metric]:
+                self.maxs[metric] = value
+            self.sketches[metric].add(value)
+
+
+def _apply(key, summary):
+    period, bucket, provider, city, country, server = key
+    rollup, _ = ResultRollup.objects.get_or_create(
+        period=period, bucket=bucket, provider=provider, city=city, country=country, server=server,
+    )
+    # Скетчи складываются в Python, поэтому строку сводки блокируем
+    rollup = ResultRollup.objects.select_for_update().get(pk=rollup.pk)
+
+    fields = ['count']
+    for metric in METRICS:
+        setattr(rollup, f'{metric}_sum', getattr(rollup, f'{metric}_sum') + summary.sums[metric])
+        if rollup.count:
+            setattr(rollup, f'{metric}_min', min(getattr(rollup, f'{metric}_min'), summary.mins[metric]))
+            setattr(rollup, f'{metric}_max', max(getattr(rollup, f'{metric}_max'), summary.maxs[metric]))
+        else:
+            setattr(rollup, f'{metric}_min', summary.mins[metric])
+            setattr(rollup, f'{metric}_max', summary.maxs[metric])
+
+        sketch = DDSketch.from_bytes(getattr(rollup, f'{metric}_sketch'))
+        sketch.merge(summary.sketches[metric])
+        setattr(rollup, f'{metric}_sketch', sketch.to_bytes())
+        fields += [f'{metric}_sum', f'{metric}_min', f'{metric}_max', f'{metric}_sketch']
+
+    rollup.count += summary.count
+    rollup.save(update_fields=fields)
+
+
+def roll_up(ids):
+    """Учитывает в сводках результаты с данными id (уже учтенные пропускаются).
+
+    Возвращает число учтенных результатов.
+    """
+    ids = [pk for pk in ids if pk is not None]
+    if not ids:
+        return 0
+
+    with transaction.atomic():
+        rows = list(
+            SpeedTestResult.objects.select_for_update()
+            .filter(pk__in=ids, rolled_up=False, geo_pending=False)
+            .values('id', 'timestamp', 'latitude', 'longitude', *METRICS, *GROUP_FIELDS)
+        )
+        if not rows:
+            return 0
+
+        summaries = {}
+        for row in rows:
+            group = tuple(row[field] or '' for field in GROUP_FIELDS)
+            for period in (ResultRollup.PERIOD_HOUR, ResultRollup.PERIOD_DAY):
+                key = (period, bucket_start(row['timestamp'], period)) + group
+                summaries.setdefault(key, _Summary()).add(row)
+
+        for key, summary in summaries.items():
+            _apply(key, summary)
+        tiles.add(rows)
+
+        SpeedTestResult.objects.filter(pk__in=[row['id'] for row in rows]).update(rolled_up=True)
+        response_cache.bump(response_cache.STATS_SCOPE)
+
+    return len(rows)
+
+
+def compact(batch_size=BATCH_SIZE):
+    """Учитывает все пропущенные результаты пачками"""
+    total = 0
+    while True:
+        ids = list(
+            SpeedTestResult.objects.filter(rolled_up=False, geo_pending=False)
+            .order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return total
+        total += roll_up(ids)
+
+
+def query_stats(period, start, end, filters=None, group_by=(), limit=100, quantiles=True):
+    """Статистика из сводок за [start, end]. Время ответа зависит от числа
+    строк сводки в диапазоне, а не от размера таблицы результатов.
+
+    Квантили p50/p90/p99 получаются слиянием скетчей строк сводки и имеют
+    относительную ошибку не больше sketch.RELATIVE_ACCURACY.
+    """
+    rollups = ResultRollup.objects.filter(
+        period=period, bucket__gte=bucket_start(start, period), bucket__lte=end,
+    )
+    for field, value in (filters or {}).items():
+        rollups = rollups.filter(**{field: value})
+
+    aggregates = {'total': Sum('count')}
+    for metric in METRICS:
+        aggregates[f'{metric}_total'] = Sum(f'{metric}_sum')
+        aggregates[f'{metric}_lowest'] = Min(f'{metric}_min')
+        aggregates[f'{metric}_highest'] = Max(f'{metric}_max')
+
+    if group_by:
+        rows = rollups.values(*group_by).annotate(**aggregates).order_by('-total')[:limit]
+    else:
+        rows = [rollups.aggregate(**aggregates)]
+
+    groups = {}
+    for row in rows:
+        count = row['total'] or 0
+        if not count:
+            continue
+        group = {field: row[field] for field in group_by}
+        group['count'] = count
+        for metric in METRICS:
+            group[metric] = {
+                'avg': round(row[f'{metric}_total'] / count, 3),
+                'min': row[f'{metric}_lowest'],
+                'max': row[f'{metric}_highest'],
+            }
+        groups[tuple(row[field] for field in group_by)] = group
+
+    if quantiles and groups:
+        sketches = {key: {metric: DDSketch() for metric in METRICS} for key in groups}
+        sketch_fields = [f'{metric}_sketch' for metric in METRICS]
+        for row in rollups.values_list(*group_by, *sketch_fields).iterator():
+            key = tuple(row[:len(group_by)])
+            if key not in sketches:
+                continue  # группа не вошла в limit
+            for metric, data in zip(METRICS, row[len(group_by):]):
+                sketches[key][metric].merge(DDSketch.from_bytes(data))
+
+        for key, group in groups.items():
+            for metric in METRICS:
+                sketch = sketches[key][metric]
+                for name, q in QUANTILES:
+                    value = sketch.quantile(q)
+                    group[metric][name] = round(value, 3) if value is not None else None
+
+    return list(groups.values())
+
+
+def rebuild_sketches(since=None, chunk_size=50000):
+    """Пересобирает скетчи сводок по уже учтенным результатам.
+
+    Нужна для сводок, созданных до появления скетчей. since - пересобрать
+    только корзины, начиная с этого времени. Значения группируются и
+    раскладываются по корзинам скетча пачками (с numpy - векторизованно).
+    Сводка, часть результатов которой уже удалена из таблицы (архив,
+    удаление в админке), остается как есть: по оставшимся строкам ее
+    скетчи не восстановить. Возвращает число обработанных результатов.
+    """
+    rollups = ResultRollup.objects.all()
+    results = SpeedTestResult.objects.filter(rolled_up=True)
+    if since is not None:
+        rollups = rollups.filter(bucket__gte=bucket_start(since, ResultRollup.PERIOD_DAY))
+        results = results.filter(timestamp__gte=bucket_start(since, ResultRollup.PERIOD_DAY))
+
+    sketches = {}
+    processed = 0
+    batch = []
+    columns = ('timestamp', *METRICS, *GROUP_FIELDS)
+
+    def flush(batch):
+        values = {}
+        for row in batch:
+            group = tuple(field or '' for field in row[1 + len(METRICS):])
+            for period in (ResultRollup.PERIOD_HOUR, ResultRollup.PERIOD_DAY):
+                key = (period, bucket_start(row[0], period)) + group
+                values.setdefault(key, []).append(row[1:1 + len(METRICS)])
+        for key, rows in values.items():
+            target = sketches.setdefault(key, {metric: DDSketch() for metric in METRICS})
+            for position, metric in enumerate(METRICS):
+                target[metric].add_many([row[position] for row in rows])
+
+    for row in results.values_list(*columns).iterator(chunk_size=chunk_size):
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            flush(batch)
+            processed += len(batch)
+            batch = []
+    flush(batch)
+    processed += len(batch)
+
+    with transaction.atomic():
+        for rollup in rollups.select_for_update().iterator():
+            key = (rollup.period, rollup.bucket, rollup.provider, rollup.city, rollup.country, rollup.server)
+            found = sketches.get(key)
+            if found is None or found[METRICS[0]].count != rollup.count:
+                continue
+            for metric in METRICS:
+                setattr(rollup, f'{metric}_sketch', found[metric].to_bytes())
+            rollup.save(update_fields=[f'{metric}_sketch' for metric in METRICS])
+        response_cache.bump(response_cache.STATS_SCOPE)
+
+    return processed
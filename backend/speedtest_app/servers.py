@@ -0,0 +1,143 @@
+"""Реестр тестовых узлов: выбор ближайших и проверка здоровья.
+
+Ближайшие узлы ищутся по geohash: сначала в ячейке клиента и 8 соседних
+ячейках мелкого масштаба, затем масштаб укрупняется, пока не найдется
+достаточно кандидатов. Каждая ячейка - диапазон строк по индексу
+testserver_geohash_idx, поэтому время поиска не зависит от размера реестра.
+Найденные кандидаты сортируются по расстоянию; окончательный выбор клиент
+делает короткими пробами задержки до каждого из них.
+"""
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import geohash
+from .models import TestServer
+
+# Длины geohash для поиска: ~5 км, 40 км, 150 км, 1250 км, 5000 км
+SEARCH_PRECISIONS = (5, 4, 3, 2, 1)
+DEFAULT_CANDIDATES = 3
+MAX_CANDIDATES = 10
+PROBE_COUNT = 3
+PROBE_TIMEOUT = 2.0
+# Имена узлов для проверки присланного клиентом server кэшируются на минуту
+NAMES_TTL = 60
+
+_session = requests.Session()
+_names = (None, 0.0)
+
+
+def local_name():
+    """Имя узла, на котором работает это приложение"""
+    return getattr(settings, 'LOCAL_SERVER_NAME', 'pythonanywhere')
+
+
+def available():
+    """Узлы, которым можно отдавать клиентов: включены, здоровы и не заняты полностью"""
+    return TestServer.objects.filter(is_active=True, healthy=True, active_transfers__lt=F('capacity'))
+
+
+def _in_cells(cells):
+    condition = Q()
+    for cell in cells:
+        start, end = geohash.prefix_range(cell)
+        condition |= Q(geohash__gte=start, geohash__lt=end)
+    return condition
+
+
+def nearest(lat, lon, count=DEFAULT_CANDIDATES):
+    """До count ближайших доступных узлов: [(узел, расстояние в км)]"""
+    candidates = []
+    for precision in SEARCH_PRECISIONS:
+        cells = geohash.neighbours(geohash.encode(lat, lon, precision))
+        candidates = list(available().filter(_in_cells(cells)))
+        if len(candidates) >= count:
+            break
+    else:
+        # На самом крупном масштабе соседи покрывают не весь шар
+        candidates = list(available())
+
+    ranked = sorted(
+        ((server, geohash.distance_km(lat, lon, server.latitude, server.longitude)) for server in candidates),
+        key=lambda item: item[1],
+    )
+    return ranked[:count]
+
+
+def registered_names():
+    global _names
+    names, expires_at = _names
+    if names is None or expires_at < time.monotonic():
+        names = frozenset(TestServer.objects.values_list('name', flat=True))
+        _names = (names, time.monotonic() + NAMES_TTL)
+    return names
+
+
+def forget_names():
+    global _names
+    _names = (None, 0.0)
+
+
+def resolve_name(name):
+    """Имя узла для SpeedTestResult.server: зарегистрированный узел или локальный"""
+    if isinstance(name, str) and name in registered_names():
+        return name
+    return local_name()
+
+
+def probe(server, count=PROBE_COUNT, timeout=PROBE_TIMEOUT):
+    """Проверка узла: медиана RTT /api/ping/ и занятость по /api/admission/.
+
+    Возвращает {'healthy', 'rtt_ms', 'active_transfers'}.
+    """
+    base_url = server.url.rstrip('/')
+    rtts = []
+    try:
+        for _ in range(count):
+            started = time.perf_counter()
+            response = _session.get(f'{base_url}/api/ping/', timeout=timeout)
+            response.raise_for_status()
+            rtts.append((time.perf_counter() - started) * 1000)
+        admission = _session.get(f'{base_url}/api/admission/', timeout=timeout)
+        admission.raise_for_status()
+        active = int(admission.json().get('active') or 0)
+    except (requests.RequestException, ValueError):
+        return {'healthy': False, 'rtt_ms': None, 'active_transfers': 0}
+    return {'healthy': True, 'rtt_ms': round(statistics.median(rtts), 3), 'active_transfers': active}
+
+
+def check_all(servers=None, workers=8):
+    """Проверяет узлы параллельно и сохраняет результат. Возвращает число здоровых"""
+    servers = list(servers if servers is not None else TestServer.objects.filter(is_active=True))
+    if not servers:
+        return 0
+    with ThreadPoolExecutor(max_workers=min(workers, len(servers))) as pool:
+        results = list(pool.map(probe, servers))
+
+    now = timezone.now()
+    for server, result in zip(servers, results):
+        server.healthy = result['healthy']
+        server.rtt_ms = result['rtt_ms']
+        server.active_transfers = result['active_transfers']
+        server.checked_at = now
+    TestServer.objects.bulk_update(servers, ['healthy', 'rtt_ms', 'active_transfers', 'checked_at'])
+    return sum(1 for result in results if result['healthy'])
+
+
+def to_dict(server, distance=None):
+    return {
+        'name': server.name,
+        'url': server.url.rstrip('/'),
+        'city': server.city,
+        'country': server.country,
+        'latitude': server.latitude,
+        'longitude': server.longitude,
+        'distance_km': round(distance, 1) if distance is not None else None,
+        'load': round(server.active_transfers / server.capacity, 3) if server.capacity else None,
+        'rtt_ms': server.rtt_ms,
+    }
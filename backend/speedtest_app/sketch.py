@@ -0,0 +1,151 @@
+"""Сливаемый квантильный скетч в стиле DDSketch.
+
+Значение x > MIN_VALUE попадает в корзину i = ceil(log_gamma(x)), где
+gamma = (1 + a) / (1 - a). Квантиль возвращается как середина корзины
+2 * gamma^i / (gamma + 1), поэтому относительная ошибка любого квантиля не
+больше a (RELATIVE_ACCURACY = 1%). Значения <= MIN_VALUE считаются нулем.
+Скетчи складываются корзина к корзине, поэтому p50/p90/p99 за любой
+период получаются слиянием скетчей часовых/суточных сводок.
+
+Если корзин больше MAX_BINS, самые нижние сливаются - страдает точность
+только самых маленьких квантилей. Для ping (мс) и скоростей (Мбит/с) при
+a = 1% корзин в реальности не больше нескольких сотен.
+"""
+import math
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для ускорения пересборки
+    np = None
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+MIN_VALUE = 1e-3
+MAX_BINS = 2048
+VERSION = 1
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def bin_index(value):
+    return math.ceil(math.log(value) / LOG_GAMMA)
+
+
+class DDSketch:
+
+    def __init__(self):
+        self.bins = {}
+        self.zero_count = 0
+
+    @property
+    def count(self):
+        return self.zero_count + sum(self.bins.values())
+
+    def add(self, value, count=1):
+        if value <= MIN_VALUE:
+            self.zero_count += count
+            return
+        index = bin_index(value)
+        self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > MAX_BINS:
+            self._collapse()
+
+    def add_many(self, values):
+        """Добавляет массив значений (векторизованно, если есть numpy)"""
+        if np is None:
+            for value in values:
+                self.add(value)
+            return
+
+        values = np.asarray(values, dtype=np.float64)
+        positive = values[values > MIN_VALUE]
+        self.zero_count += int(values.size - positive.size)
+        if positive.size:
+            indexes, counts = np.unique(np.ceil(np.log(positive) / LOG_GAMMA).astype(np.int64), return_counts=True)
+            self.add_bins(indexes.tolist(), counts.tolist())
+
+    def add_bins(self, indexes, counts):
+        bins = self.bins
+        for index, count in zip(indexes, counts):
+            bins[index] = bins.get(index, 0) + count
+        if len(bins) > MAX_BINS:
+            self._collapse()
+
+    def merge(self, other):
+        self.zero_count += other.zero_count
+        self.add_bins(other.bins.keys(), other.bins.values())
+
+    def _collapse(self):
+        indexes = sorted(self.bins)
+        extra = len(indexes) - MAX_BINS
+        target = indexes[extra]
+        for index in indexes[:extra]:
+            self.bins[target] += self.bins.pop(index)
+
+    def quantile(self, q):
+        """Значение квантиля q (0..1) или None для пустого скетча"""
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return 2 * GAMMA ** index / (GAMMA + 1)
+        return 2 * GAMMA ** max(self.bins) / (GAMMA + 1)
+
+    def to_bytes(self):
+        """Компактный формат: версия, нули, число корзин, первая корзина
+        (zigzag), затем пары (шаг до следующей корзины, количество) в varint"""
+        out = bytearray([VERSION])
+        _write_varint(out, self.zero_count)
+        _write_varint(out, len(self.bins))
+        previous = None
+        for index in sorted(self.bins):
+            if previous is None:
+                _write_varint(out, (index << 1) ^ (index >> 63))
+            else:
+                _write_varint(out, index - previous)
+            _write_varint(out, self.bins[index])
+            previous = index
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        sketch = cls()
+        if not data:
+            return sketch
+        data = bytes(data)
+        if data[0] != VERSION:
+            raise ValueError(f'Неизвестная версия скетча: {data[0]}')
+
+        sketch.zero_count, pos = _read_varint(data, 1)
+        size, pos = _read_varint(data, pos)
+        index = None
+        for _ in range(size):
+            step, pos = _read_varint(data, pos)
+            index = ((step >> 1) ^ -(step & 1)) if index is None else index + step
+            sketch.bins[index], pos = _read_varint(data, pos)
+        return sketch
@@ -1,3 +1,1419 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import OperationalError, connection, connections
+from django.db.models import Sum
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import (
+    adaptive, admission, asgi_views, enrichment, export, geohash, geoip, ingest, ip_service, latency, metrics, payload,
+    response_cache, retention, rollups, servers, sketch, tiles, upload_sink,
+)
+from .management import benchutil
+from .management.commands import bench_concurrency, speedbench
+from .middleware import MeasurementFastPathMiddleware
+from .models import MapTile, SpeedTestResult, TestServer
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class DownloadSizeTests(SimpleTestCase):
+
+    def setUp(self):
+        admission.reset()
+        self.addCleanup(admission.reset)
+
+    def test_parse_size_is_clamped(self):
+        self.assertEqual(payload.parse_size('1000'), 1000)
+        self.assertEqual(payload.parse_size('0'), 1)
+        self.assertEqual(payload.parse_size('-5'), 1)
+        self.assertEqual(payload.parse_size(str(payload.MAX_SIZE + 1)), payload.MAX_SIZE)
+        self.assertEqual(payload.parse_size('abc'), payload.DEFAULT_SIZE)
+        self.assertEqual(payload.parse_size(None), payload.DEFAULT_SIZE)
+
+    def test_payload_has_exact_size_and_reuses_pool_blocks(self):
+        pool = payload.get_pool()
+        for size in (1, payload.CHUNK_SIZE, 3 * payload.CHUNK_SIZE + 17):
+            chunks = list(payload.iter_payload(size))
+            self.assertEqual(sum(len(chunk) for chunk in chunks), size)
+            for chunk in chunks:
+                if len(chunk) == payload.CHUNK_SIZE:
+                    self.assertTrue(any(chunk is block for block in pool))
+                else:
+                    self.assertIsInstance(chunk, memoryview)
+
+    def test_download_sends_requested_size(self):
+        response = self.client.get('/api/download/?size=1000')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], '1000')
+        self.assertIn('no-store', response['Cache-Control'])
+        self.assertEqual(len(b''.join(response.streaming_content)), 1000)
+
+    def test_download_size_is_clamped(self):
+        with mock.patch.object(payload, 'MAX_SIZE', 4096):
+            response = self.client.get('/api/download/?size=999999999')
+            self.assertEqual(response['Content-Length'], '4096')
+            self.assertEqual(len(b''.join(response.streaming_content)), 4096)
+
+        response = self.client.get('/api/download/?size=abc')
+        self.assertEqual(response['Content-Length'], str(payload.DEFAULT_SIZE))
+        self.assertEqual(len(b''.join(response.streaming_content)), payload.DEFAULT_SIZE)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class DownloadDurationTests(SimpleTestCase):
+
+    def setUp(self):
+        admission.reset()
+        self.addCleanup(admission.reset)
+
+    def test_parse_duration_is_capped(self):
+        self.assertEqual(payload.parse_duration('5'), 5.0)
+        self.assertEqual(payload.parse_duration('1000'), payload.MAX_DURATION)
+        for value in ('nan', '0', '-1', 'abc', None):
+            self.assertIsNone(payload.parse_duration(value))
+
+    def test_payload_stops_at_deadline(self):
+        clock = mock.Mock()
+        # Начало, затем проверка перед каждым куском
+        clock.monotonic.side_effect = [0.0, 0.0, 0.5, 1.0]
+        with mock.patch.object(payload, 'time', clock):
+            chunks = list(payload.iter_payload(duration=1.0))
+        self.assertEqual(len(chunks), 2)
+
+    def test_payload_stops_at_size_before_deadline(self):
+        chunks = payload.iter_payload(payload.CHUNK_SIZE + 10, duration=payload.MAX_DURATION)
+        self.assertEqual(sum(len(chunk) for chunk in chunks), payload.CHUNK_SIZE + 10)
+
+    def test_download_streams_without_content_length(self):
+        response = self.client.get('/api/download/?duration=nan&size=1000')
+        self.assertEqual(response['Content-Length'], '1000')
+        self.assertEqual(len(b''.join(response.streaming_content)), 1000)
+
+        response = self.client.get('/api/download/?duration=5&size=1000')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(len(b''.join(response.streaming_content)), 1000)
+
+        # Последним: за 0.05 с передача выбирает лимит скорости admission
+        started = time.monotonic()
+        response = self.client.get('/api/download/?duration=0.05')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertGreater(sum(len(chunk) for chunk in response.streaming_content), 0)
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class UploadSinkTests(SimpleTestCase):
+
+    def setUp(self):
+        admission.reset()
+        self.addCleanup(admission.reset)
+
+    def test_meter_speed_and_curve(self):
+        clock = mock.Mock()
+        clock.perf_counter.side_effect = [10.0, 10.0625, 10.125, 10.25]
+        received = []
+        meter = upload_sink.UploadMeter(sample_interval=0.125, on_data=received.append)
+        with mock.patch.object(upload_sink, 'time', clock):
+            for _ in range(4):
+                meter.feed(1000)
+            meter.feed(0)
+
+        result = meter.result()
+        self.assertEqual(received, [1000] * 4)
+        self.assertEqual(result['bytes_received'], 4000)
+        self.assertEqual(result['duration'], 0.25)
+        # Первый кусок в скорость не входит: 3000 байт за 0.25 с
+        self.assertEqual(result['mbps'], 0.096)
+        self.assertEqual(result['samples'], [[0.0, 1000], [0.125, 3000], [0.25, 4000]])
+
+    def test_consume_reads_stream_in_chunks(self):
+        sizes = []
+        result = upload_sink.consume(io.BytesIO(b'x' * 1000), read_size=300, on_data=sizes.append)
+        self.assertEqual(sizes, [300, 300, 300, 100])
+        self.assertEqual(result['bytes_received'], 1000)
+        self.assertEqual(result['samples'][-1][1], 1000)
+
+        self.assertEqual(upload_sink.consume(io.BytesIO())['bytes_received'], 0)
+
+    def test_upload_view_reports_received_bytes(self):
+        response = self.client.post(
+            '/api/upload/?start_time=123.5', b'x' * 200000, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['bytes_received'], 200000)
+        self.assertEqual(data['client_start'], 123.5)
+        self.assertEqual(data['samples'][-1][1], 200000)
+        for key in ('duration', 'mbps', 'server_time'):
+            self.assertIn(key, data)
+
+        response = self.client.post('/api/upload/?start_time=abc', b'x' * 10, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(response.json()['client_start'], time.time(), delta=60)
+
+        response = self.client.get('/api/upload/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'POST method required'})
+
+
+class AsgiMeasurementTests(SimpleTestCase):
+
+    def setUp(self):
+        admission.reset()
+        self.addCleanup(admission.reset)
+
+    def communicate(self, handler, method, path, query=b'', messages=()):
+        """Вызывает ASGI-приложение и возвращает (статус, заголовки, куски тела).
+        Сообщения клиента кончаются ожиданием без ответа, как у открытого соединения."""
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'query_string': query,
+            'headers': [], 'client': ('127.0.0.1', 50000),
+        }
+
+        async def run():
+            to_app = asyncio.Queue()
+            for message in messages:
+                await to_app.put(message)
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            await handler(scope, to_app.get, send)
+            return sent
+
+        sent = asyncio.run(run())
+        start, body = sent[0], sent[1:]
+        self.assertEqual(start['type'], 'http.response.start')
+        return start['status'], dict(start['headers']), body
+
+    def test_download_sends_size_with_no_cache_headers(self):
+        status, headers, body = self.communicate(asgi_views.download_test, 'GET', '/api/download/', b'size=300000')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-length'], b'300000')
+        self.assertEqual(headers[b'cache-control'], b'no-store, no-cache, must-revalidate, max-age=0')
+        self.assertEqual(sum(len(message['body']) for message in body), 300000)
+        self.assertFalse(body[-1].get('more_body', False))
+
+    def test_download_with_duration_has_no_content_length(self):
+        status, headers, body = self.communicate(
+            asgi_views.download_test, 'GET', '/api/download/', b'duration=5&size=1000')
+        self.assertNotIn(b'content-length', headers)
+        self.assertEqual(sum(len(message['body']) for message in body), 1000)
+
+    def test_download_stops_on_disconnect(self):
+        started = time.monotonic()
+        status, headers, body = self.communicate(
+            asgi_views.download_test, 'GET', '/api/download/', b'duration=5', [{'type': 'http.disconnect'}])
+        self.assertLess(time.monotonic() - started, 5)
+        # Ответ оборван: завершающего куска нет
+        self.assertTrue(body[-1]['more_body'])
+
+    def test_upload_counts_body_messages(self):
+        messages = [{'type': 'http.request', 'body': b'x' * 1000, 'more_body': True} for _ in range(2)]
+        messages.append({'type': 'http.request', 'body': b'x' * 500, 'more_body': False})
+        status, headers, body = self.communicate(
+            asgi_views.upload_test, 'POST', '/api/upload/', b'start_time=5', messages)
+        self.assertEqual(status, 200)
+        data = json.loads(body[0]['body'])
+        self.assertEqual(data['bytes_received'], 2500)
+        self.assertEqual(data['client_start'], 5.0)
+        self.assertEqual(data['samples'][-1][1], 2500)
+
+        status, headers, body = self.communicate(asgi_views.upload_test, 'GET', '/api/upload/')
+        self.assertEqual(status, 400)
+        self.assertEqual(json.loads(body[0]['body']), {'error': 'POST method required'})
+
+    def test_router_passes_other_requests_to_django(self):
+        passed = []
+
+        async def django_app(scope, receive, send):
+            passed.append((scope['method'], scope['path']))
+            await send({'type': 'http.response.start', 'status': 204, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        router = asgi_views.measurement_router(django_app)
+        status, headers, body = self.communicate(router, 'GET', '/api/ping/')
+        self.assertEqual(json.loads(body[0]['body'])['status'], 'ok')
+        self.assertEqual(self.communicate(router, 'OPTIONS', '/api/ping/')[0], 204)
+        self.assertEqual(self.communicate(router, 'GET', '/api/stats/')[0], 204)
+        self.assertEqual(passed, [('OPTIONS', '/api/ping/'), ('GET', '/api/stats/')])
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'], CORS_ALLOW_ALL_ORIGINS=True)
+class FastPathTests(TestCase):
+
+    def setUp(self):
+        admission.reset()
+        self.addCleanup(admission.reset)
+
+    def test_measurement_requests_skip_middleware(self):
+        self.client.force_login(User.objects.create_user('tester', password='secret'))
+        response = self.client.get('/api/ping/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Server-Timing'].startswith('app;dur='))
+        self.assertEqual(response['Access-Control-Allow-Origin'], '*')
+        # Ни сессии, ни пользователя: SessionMiddleware и AuthenticationMiddleware не вызывались
+        self.assertFalse(hasattr(response.wsgi_request, 'session'))
+        self.assertFalse(hasattr(response.wsgi_request, 'user'))
+        self.assertEqual(response.wsgi_request.resolver_match.url_name, 'ping')
+
+    def test_upload_needs_no_csrf_token(self):
+        client = self.client_class(enforce_csrf_checks=True)
+        response = client.post('/api/upload/', b'x' * 1000, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['bytes_received'], 1000)
+        self.assertTrue(response['Server-Timing'].startswith('app;dur='))
+
+    def test_other_requests_use_full_stack(self):
+        response = self.client.get('/api/admission/')
+        self.assertTrue(hasattr(response.wsgi_request, 'user'))
+        self.assertFalse(response['Server-Timing'].startswith('app;dur='))
+
+        # CORS preflight обслуживает corsheaders
+        response = self.client.options(
+            '/api/ping/', HTTP_ORIGIN='http://example.com', HTTP_ACCESS_CONTROL_REQUEST_METHOD='GET')
+        self.assertIn('Access-Control-Allow-Methods', response)
+        self.assertFalse(response['Server-Timing'].startswith('app;dur='))
+
+    def test_middleware_routes_only_measurement_paths(self):
+        get_response = mock.Mock(return_value='django')
+        middleware = MeasurementFastPathMiddleware(get_response)
+        factory = RequestFactory()
+
+        self.assertEqual(middleware(factory.get('/api/history/')), 'django')
+        self.assertEqual(middleware(factory.put('/api/upload/')), 'django')
+        self.assertEqual(get_response.call_count, 2)
+
+        response = middleware(factory.get('/api/ping/'))
+        self.assertEqual(get_response.call_count, 2)
+        self.assertEqual(json.loads(response.content)['status'], 'ok')
+        self.assertEqual(set(middleware.routes), {'/api/ping/', '/api/download/', '/api/upload/'})
+
+
+class FakeGeoIPHandler(BaseHTTPRequestHandler):
+    """Имитация ipapi.co: /<ip>/json/. IP, начинающиеся с 10.255, отвечают 500"""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+        time.sleep(server.delay)
+
+        ip = self.path.strip('/').split('/')[0]
+        if ip.startswith('10.255.'):
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        body = json.dumps({
+            'ip': ip,
+            'country_name': 'Россия',
+            'city': 'Москва',
+            'org': 'Test ISP',
+            'latitude': 55.75,
+            'longitude': 37.61,
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class IPServiceCacheTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGeoIPHandler)
+        cls.server.lock = threading.Lock()
+        cls.server.requests = []
+        cls.server.delay = 0
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.api = override_settings(
+            IP_INFO_API_URL=f'http://127.0.0.1:{cls.server.server_port}',
+            GEOIP_INDEX_PATH=None,
+        )
+        cls.api.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.api.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        ip_service.clear_cache()
+        self.server.requests.clear()
+        self.server.delay = 0
+
+    def test_repeated_lookup_served_from_cache(self):
+        first = ip_service.get_ip_info('1.2.3.4')
+        second = ip_service.get_ip_info('1.2.3.4')
+
+        self.assertEqual(first, second)
+        self.assertEqual(first['city'], 'Москва')
+        self.assertEqual(len(self.server.requests), 1)
+        stats = ip_service.get_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_failure_is_cached(self):
+        first = ip_service.get_ip_info('10.255.0.1')
+        second = ip_service.get_ip_info('10.255.0.1')
+
+        self.assertEqual(first['country'], 'Не определен')
+        self.assertEqual(second, first)
+        # Вариант для фонового заполнения отличает ошибку от ответа (тоже из кэша)
+        self.assertIsNone(ip_service.lookup_ip_info('10.255.0.1'))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(ip_service.lookup_ip_info('1.2.3.4')['city'], 'Москва')
+
+    def test_concurrent_lookups_are_collapsed(self):
+        self.server.delay = 0.2
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(ip_service.get_ip_info('5.6.7.8')))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(r['ip'] == '5.6.7.8' for r in results))
+        self.assertEqual(len(self.server.requests), 1)
+
+
+class IPInfoCacheTests(SimpleTestCase):
+
+    def test_ttl_and_lru_eviction(self):
+        now = [0.0]
+        cache = ip_service.IPInfoCache(max_size=2, clock=lambda: now[0])
+        cache.set('a', 1, ttl=10)
+        cache.set('b', 2, ttl=10)
+        cache.get('a')
+        cache.set('c', 3, ttl=10)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+
+        now[0] = 11
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 1)
+
+
+class GeoIPIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'geoip.idx')
+        dump = io.StringIO(
+            'ip_start,ip_end,country,city,isp,latitude,longitude\n'
+            '1.0.0.0,1.0.0.255,Австралия,Сидней,APNIC,-33.86,151.2\n'
+            '16777472,16778239,Китай,Фучжоу,ChinaNet,26.06,119.3\n'
+            '2a00:1450::,2a00:1450:ffff:ffff:ffff:ffff:ffff:ffff,Ирландия,Дублин,Google,53.34,-6.26\n'
+        )
+        self.assertEqual(geoip.build_index(geoip.read_csv(dump), self.path), 3)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_lookup_ipv4_and_ipv6(self):
+        index = geoip.GeoIPIndex(self.path)
+        try:
+            self.assertEqual(index.lookup('1.0.0.42')['city'], 'Сидней')
+            self.assertEqual(index.lookup('1.0.2.1')['provider'], 'ChinaNet')
+            self.assertEqual(index.lookup('2a00:1450:4001::1')['country'], 'Ирландия')
+            self.assertIsNone(index.lookup('1.0.4.0'))
+            self.assertIsNone(index.lookup('0.255.255.255'))
+            self.assertIsNone(index.lookup('не ip'))
+        finally:
+            index.close()
+
+    def test_get_ip_info_uses_local_index_without_network(self):
+        with override_settings(GEOIP_INDEX_PATH=self.path, IP_INFO_REMOTE_FALLBACK=False):
+            self.assertEqual(ip_service.get_ip_info('1.0.0.1')['city'], 'Сидней')
+            self.assertEqual(ip_service.get_ip_info('8.8.8.8')['city'], 'Не определен')
+
+    def test_broken_index_is_logged(self):
+        broken = os.path.join(self.tmp.name, 'broken.idx')
+        with open(broken, 'wb') as index_file:
+            index_file.write(b'not an index' * 4)
+        with override_settings(GEOIP_INDEX_PATH=broken):
+            with self.assertLogs('speedtest_app.geoip', 'ERROR') as logs:
+                self.assertIsNone(geoip.get_index())
+        self.assertIn(broken, logs.output[0])
+
+
+@override_settings(GEOIP_INDEX_PATH=None, GEO_ENRICHMENT_IN_PROCESS=False, ALLOWED_HOSTS=['testserver'])
+class SaveResultTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('tester', password='secret')
+        self.client.force_login(self.user)
+
+    def save(self, ip):
+        return self.client.post(
+            '/api/save/', data=json.dumps({'ping': 10, 'download': 50, 'upload': 20}),
+            content_type='application/json', REMOTE_ADDR=ip,
+        )
+
+    def test_save_defers_lookup_and_worker_dedupes_ips(self):
+        with mock.patch.object(enrichment, 'lookup_ip_info') as lookup:
+            for ip in ('1.1.1.1', '1.1.1.1', '2.2.2.2'):
+                self.assertEqual(self.save(ip).json()['status'], 'success')
+            lookup.assert_not_called()
+            self.assertEqual(SpeedTestResult.objects.filter(geo_pending=True).count(), 3)
+
+            lookup.side_effect = lambda ip: {
+                'ip': ip, 'isp': 'ISP', 'city': 'Город', 'country': 'Страна', 'lat': 1.5, 'lon': 2.5,
+            }
+            self.assertEqual(enrichment.enrich_pending(), 3)
+
+        self.assertEqual(lookup.call_count, 2)
+        self.assertFalse(SpeedTestResult.objects.filter(geo_pending=True).exists())
+        self.assertEqual(SpeedTestResult.objects.filter(city='Город', latitude=1.5).count(), 3)
+
+    def test_failed_lookup_is_retried_with_backoff(self):
+        location = {'ip': '9.9.9.9', 'isp': 'ISP', 'city': 'Город', 'country': 'Страна', 'lat': 1.5, 'lon': 2.5}
+        pk = self.save('9.9.9.9').json()['id']
+        with mock.patch.object(enrichment, 'lookup_ip_info', return_value=None) as lookup:
+            with self.assertLogs('speedtest_app.enrichment', 'WARNING'):
+                self.assertEqual(enrichment.enrich_pending(), 0)
+            # До geo_retry_at строка не запрашивается снова
+            self.assertEqual(enrichment.enrich_pending(), 0)
+        self.assertEqual(lookup.call_count, 1)
+
+        result = SpeedTestResult.objects.get(pk=pk)
+        self.assertEqual((result.geo_pending, result.rolled_up, result.geo_attempts), (True, False, 1))
+        self.assertAlmostEqual(
+            (result.geo_retry_at - timezone.now()).total_seconds(), enrichment.RETRY_DELAY, delta=5)
+        self.assertEqual(enrichment.next_retry(), result.geo_retry_at)
+        self.assertEqual(enrichment.retry_delay(3), 16 * enrichment.RETRY_DELAY)
+        self.assertEqual(enrichment.retry_delay(20), enrichment.MAX_RETRY_DELAY)
+
+        SpeedTestResult.objects.filter(pk=pk).update(geo_retry_at=timezone.now())
+        with mock.patch.object(enrichment, 'lookup_ip_info', return_value=location):
+            self.assertEqual(enrichment.enrich_pending(), 1)
+        result = SpeedTestResult.objects.get(pk=pk)
+        self.assertEqual((result.city, result.geo_pending, result.geo_attempts, result.geo_retry_at),
+                         ('Город', False, 0, None))
+        self.assertTrue(result.rolled_up)
+
+    def test_lookup_gives_up_after_max_attempts(self):
+        pk = self.save('9.9.9.8').json()['id']
+        SpeedTestResult.objects.filter(pk=pk).update(
+            geo_attempts=enrichment.MAX_ATTEMPTS - 1, geo_retry_at=timezone.now())
+        with mock.patch.object(enrichment, 'lookup_ip_info', return_value=None):
+            with self.assertLogs('speedtest_app.enrichment', 'WARNING'):
+                self.assertEqual(enrichment.enrich_pending(), 1)
+        result = SpeedTestResult.objects.get(pk=pk)
+        # Без заглушки "Не определен": поля пустые, строка учтена в сводках
+        self.assertEqual((result.geo_pending, result.country, result.rolled_up), (False, None, True))
+
+    def test_enrichment_errors_are_logged(self):
+        failing = mock.patch.object(enrichment, 'enrich_pending', side_effect=OperationalError('database is locked'))
+        # close_all закрыл бы соединение внутри транзакции теста
+        with failing, mock.patch.object(enrichment.connections, 'close_all'):
+            with self.assertLogs('speedtest_app.enrichment', 'ERROR') as logs:
+                enrichment._run()
+        self.assertIn('database is locked', logs.output[0])
+
+    def test_rollup_failure_keeps_saved_result(self):
+        location = {'isp': 'ISP', 'city': 'Город', 'country': 'Страна', 'lat': 1.5, 'lon': 2.5}
+        failing = mock.patch.object(rollups, 'roll_up', side_effect=OperationalError('database is locked'))
+        with mock.patch.object(geoip, 'lookup', return_value=location), failing:
+            with self.assertLogs('speedtest_app.ingest', 'ERROR'):
+                response = self.save('5.5.5.5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'success')
+
+        result = SpeedTestResult.objects.get(pk=response.json()['id'])
+        self.assertFalse(result.rolled_up)
+        # Пропущенную строку учитывает compact_rollups
+        self.assertEqual(rollups.compact(), 1)
+        self.assertTrue(SpeedTestResult.objects.get(pk=result.pk).rolled_up)
+
+    def test_batch_save_keeps_client_timestamps(self):
+        response = self.client.post('/api/save/batch/', data=json.dumps({'results': [
+            {'ping': 10, 'download': 50, 'upload': 20, 'timestamp': '2000-01-01T00:00:00Z'},
+            {'ping': 12, 'download': 55, 'upload': 21, 'timestamp': timezone.now().isoformat()},
+        ]}), content_type='application/json', REMOTE_ADDR='3.3.3.3')
+
+        self.assertEqual(response.json()['saved'], 2)
+        self.assertEqual(SpeedTestResult.objects.filter(user=self.user, geo_pending=True).count(), 2)
+        # Слишком старое время заменяется временем сохранения
+        self.assertFalse(SpeedTestResult.objects.filter(timestamp__year=2000).exists())
+
+    def test_buffered_mode_writes_through_queue(self):
+        with override_settings(RESULTS_WRITE_MODE='buffered', RESULTS_FLUSH_INTERVAL=3600):
+            self.assertTrue(self.save('4.4.4.4').json()['queued'])
+            self.assertEqual(ingest.get_queue().flush(), 1)
+        self.assertTrue(SpeedTestResult.objects.filter(ip_address='4.4.4.4').exists())
+
+    def test_queue_keeps_results_when_write_fails(self):
+        queue = ingest.WriteBehindQueue(flush_interval=3600, max_pending=3)
+        for ip in ('6.6.6.1', '6.6.6.2'):
+            queue.put(SpeedTestResult(ping=10, download=50, upload=20, ip_address=ip))
+
+        with mock.patch.object(ingest, 'write_results', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                queue.flush()
+            self.assertEqual(queue.pending(), 2)
+            # Синхронная запись при переполнении: ошибка у вызывающего, его результат не остается в очереди
+            with self.assertRaises(OperationalError):
+                queue.put(SpeedTestResult(ping=10, download=50, upload=20, ip_address='6.6.6.3'))
+            self.assertEqual(queue.pending(), 2)
+
+        self.assertEqual(queue.flush(), 2)
+        self.assertEqual(SpeedTestResult.objects.filter(ip_address__startswith='6.6.6.').count(), 2)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class HistoryTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('tester', password='secret')
+        self.client.force_login(self.user)
+        now = timezone.now()
+        SpeedTestResult.objects.bulk_create([
+            SpeedTestResult(user=self.user, timestamp=now - timedelta(minutes=i // 2), ping=i, download=1, upload=1)
+            for i in range(25)
+        ])
+
+    def test_cursor_pages_cover_all_rows_once(self):
+        seen = []
+        url = '/api/history/?limit=10'
+        while url:
+            data = self.client.get(url).json()
+            seen.extend(item['id'] for item in data['history'])
+            url = f"/api/history/?limit=10&before={data['next']}" if data['next'] else None
+
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(len(set(seen)), 25)
+
+    def test_limit_is_capped_and_bad_cursor_rejected(self):
+        self.assertEqual(len(self.client.get('/api/history/?limit=100000').json()['history']), 25)
+        self.assertEqual(self.client.get('/api/history/?before=???').status_code, 400)
+
+
+@override_settings(GEOIP_INDEX_PATH=None, GEO_ENRICHMENT_IN_PROCESS=False, ALLOWED_HOSTS=['testserver'])
+class StatsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_rollups_follow_inserts_and_enrichment(self):
+        user = User.objects.create_user('tester')
+        ingest.write_results([
+            SpeedTestResult(user=user, ping=10, download=100, upload=10, server='a', provider='ISP-1'),
+            SpeedTestResult(user=user, ping=30, download=300, upload=30, server='a', provider='ISP-1'),
+            SpeedTestResult(user=user, ping=50, download=50, upload=5, server='a', geo_pending=True,
+                            ip_address='5.5.5.5'),
+        ])
+        # Повторный учет тех же строк ничего не меняет
+        self.assertEqual(rollups.compact(), 0)
+
+        data = self.client.get('/api/stats/?group_by=provider&period=hour').json()
+        self.assertEqual(len(data['groups']), 1)
+        group = data['groups'][0]
+        self.assertEqual((group['provider'], group['count']), ('ISP-1', 2))
+        self.assertEqual(group['download']['avg'], 200.0)
+        self.assertEqual((group['download']['min'], group['download']['max']), (100.0, 300.0))
+        self.assertAlmostEqual(group['download']['p50'], 100, delta=100 * sketch.RELATIVE_ACCURACY)
+
+        with mock.patch.object(enrichment, 'lookup_ip_info', return_value={
+            'ip': '5.5.5.5', 'isp': 'ISP-2', 'city': '', 'country': '', 'lat': 0, 'lon': 0,
+        }):
+            enrichment.enrich_pending()
+
+        data = self.client.get('/api/stats/?server=a').json()
+        self.assertEqual(data['groups'][0]['count'], 3)
+        self.assertEqual(data['groups'][0]['ping']['max'], 50.0)
+
+
+class DDSketchTests(SimpleTestCase):
+
+    def test_quantiles_within_relative_accuracy_after_merge_and_roundtrip(self):
+        values = [0.5 * 1.001 ** i for i in range(10000)]
+        left, right = sketch.DDSketch(), sketch.DDSketch()
+        for value in values[::2]:
+            left.add(value)
+        right.add_many(values[1::2])
+        left.merge(sketch.DDSketch.from_bytes(right.to_bytes()))
+
+        self.assertEqual(left.count, len(values))
+        for q in (0.01, 0.5, 0.9, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(left.quantile(q), exact, delta=exact * sketch.RELATIVE_ACCURACY)
+
+    @skipIf(sketch.np is None, 'numpy не установлен')
+    def test_vectorised_add_many_matches_pure_python(self):
+        rng = random.Random(12)
+        values = [rng.lognormvariate(3, 2) for _ in range(20000)] + [0, -1.5, sketch.MIN_VALUE]
+        vectorised = sketch.DDSketch()
+        vectorised.add_many(values)
+        with mock.patch.object(sketch, 'np', None):
+            pure = sketch.DDSketch()
+            pure.add_many(values)
+
+        self.assertEqual(vectorised.zero_count, 3)
+        self.assertEqual(vectorised.bins, pure.bins)
+        self.assertEqual(vectorised.to_bytes(), pure.to_bytes())
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class MultiStreamSessionTests(SimpleTestCase):
+
+    def test_streams_are_aggregated_into_one_session(self):
+        session = self.client.post('/api/session/?streams=2').json()['session']
+
+        for stream in ('1', '2'):
+            response = self.client.get(f'/api/download/?size=1000000&session={session}&stream={stream}')
+            self.assertEqual(len(b''.join(response.streaming_content)), 1000000)
+        self.client.post(f'/api/upload/?session={session}&stream=1', data=b'x' * 300000,
+                         content_type='application/octet-stream')
+
+        result = self.client.get(f'/api/session/{session}/').json()
+        self.assertEqual(result['download']['bytes'], 2000000)
+        self.assertEqual(result['download']['streams'], 2)
+        self.assertEqual(result['upload']['bytes'], 300000)
+
+    def test_streams_beyond_declared_count_are_rejected(self):
+        session = self.client.post('/api/session/?streams=2').json()['session']
+        for stream in ('a', 'b', 'a'):
+            response = self.client.get(f'/api/download/?size=10&session={session}&stream={stream}')
+            self.assertEqual(len(b''.join(response.streaming_content)), 10)
+        self.assertEqual(self.client.get(f'/api/download/?size=10&session={session}&stream=c').status_code, 400)
+        response = self.client.post(f'/api/upload/?session={session}&stream=c', data=b'x',
+                                    content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(f'/api/session/{session}/').json()['download']['streams'], 2)
+
+    def test_unknown_session_is_rejected(self):
+        self.assertEqual(self.client.get('/api/download/?session=nope').status_code, 404)
+        self.assertEqual(self.client.get('/api/session/nope/').status_code, 404)
+
+
+class AdaptiveSizingTests(SimpleTestCase):
+
+    def simulate(self, mbps):
+        intervals = []
+        step = adaptive.next_step(intervals)
+        while not step['done']:
+            # Задержка на установку соединения плюс передача
+            seconds = 0.02 + step['next_size'] * 8 / (mbps * 1000000)
+            intervals.append((step['next_size'], seconds))
+            step = adaptive.next_step(intervals)
+        return step, intervals
+
+    def test_fast_link_ramps_up_and_stops_when_stable(self):
+        step, intervals = self.simulate(500)
+        self.assertEqual(step['reason'], 'stable')
+        self.assertAlmostEqual(step['mbps'], 500, delta=500 * 0.1)
+        self.assertGreater(intervals[-1][0], intervals[0][0] * 16)
+
+    def test_slow_link_uses_small_portions(self):
+        step, intervals = self.simulate(1)
+        self.assertEqual(step['reason'], 'stable')
+        self.assertLess(sum(size for size, _ in intervals), 2 * 1024 * 1024)
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def test_malformed_intervals_are_rejected(self):
+        self.assertEqual(adaptive.parse_intervals([[1000, 0.5], (2000, 1)]), [(1000, 0.5), (2000, 1.0)])
+        for intervals in ([{}], [[1]], [[1, 2, 3]], ['ab'], [[True, 1]], [['1', 1]], [[1000, None]],
+                          [[1000, float('nan')]], [[float('inf'), 1]], [[0, 0]], [[-1, 1]], {'a': 1},
+                          [[1, 1]] * (adaptive.MAX_INTERVALS + 1)):
+            with self.assertRaises(ValueError):
+                adaptive.parse_intervals(intervals)
+
+        for body in ('{"intervals": [{}]}', '{"intervals": [[1e400, 1]]}', '{"intervals": [[1, 1e400]]}', '[]'):
+            response = self.client.post('/api/adaptive/', body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+
+class LatencySocketTests(SimpleTestCase):
+
+    def test_probes_are_echoed_and_summarised(self):
+        async def run():
+            to_server = asyncio.Queue()
+            results = []
+            await to_server.put({'type': 'websocket.connect'})
+
+            async def send(message):
+                if message['type'] != 'websocket.send':
+                    return
+                data = json.loads(message['text'])
+                if data['type'] == 'probe':
+                    # Теряем пробу 3
+                    if data['seq'] != 3:
+                        await to_server.put({'type': 'websocket.receive', 'text': json.dumps(
+                            {'type': 'echo', 'seq': data['seq']})})
+                else:
+                    results.append(data)
+
+            await to_server.put({'type': 'websocket.receive', 'text': json.dumps(
+                {'type': 'start', 'count': 10, 'interval_ms': 5})})
+            with mock.patch.object(asgi_views.latency, 'LOSS_TIMEOUT', 0.2):
+                await asgi_views.latency_socket({'type': 'websocket'}, to_server.get, send)
+            return results
+
+        results = asyncio.run(run())
+        self.assertEqual(len(results), 1)
+        result = results[0]
+        self.assertEqual((result['sent'], result['received'], result['lost']), (10, 9, 1))
+        self.assertEqual(result['packet_loss'], 10.0)
+        self.assertLessEqual(result['min'], result['median'])
+        self.assertLessEqual(result['median'], result['p95'])
+
+    def test_session_length_is_capped(self):
+        session = latency.ProbeSession(count=200, interval_ms=1e9)
+        self.assertEqual(session.interval, latency.MAX_INTERVAL_MS / 1000)
+        self.assertLessEqual(session.count * session.interval, latency.MAX_DURATION)
+
+        session = latency.ProbeSession(count=200, interval_ms=1)
+        self.assertEqual((session.count, session.interval), (latency.MAX_COUNT, latency.MIN_INTERVAL_MS / 1000))
+        with self.assertRaises(OverflowError):
+            latency.ProbeSession(interval_ms=float('inf'))
+
+        # Через сокет: JSON Infinity дает сессию по умолчанию, а не обрыв
+        async def run():
+            to_server = asyncio.Queue()
+            results = []
+            await to_server.put({'type': 'websocket.connect'})
+            await to_server.put({'type': 'websocket.receive', 'text': '{"type": "start", "interval_ms": Infinity}'})
+
+            async def send(message):
+                if message['type'] != 'websocket.send':
+                    return
+                data = json.loads(message['text'])
+                if data['type'] == 'probe':
+                    await to_server.put({'type': 'websocket.receive', 'text': json.dumps(
+                        {'type': 'echo', 'seq': data['seq']})})
+                else:
+                    results.append(data)
+
+            await asgi_views.latency_socket({'type': 'websocket'}, to_server.get, send)
+            return results
+
+        results = asyncio.run(run())
+        self.assertEqual(results[0]['sent'], latency.DEFAULT_COUNT)
+
+    def test_malformed_echoes_are_ignored(self):
+        async def run():
+            to_server = asyncio.Queue()
+            results = []
+            await to_server.put({'type': 'websocket.connect'})
+
+            async def send(message):
+                if message['type'] != 'websocket.send':
+                    return
+                data = json.loads(message['text'])
+                if data['type'] == 'probe':
+                    for seq in ([data['seq']], {'seq': data['seq']}, True, str(data['seq']), None):
+                        await to_server.put({'type': 'websocket.receive', 'text': json.dumps(
+                            {'type': 'echo', 'seq': seq})})
+                    if data['seq'] != 0:
+                        await to_server.put({'type': 'websocket.receive', 'text': json.dumps(
+                            {'type': 'echo', 'seq': data['seq']})})
+                else:
+                    results.append(data)
+
+            await to_server.put({'type': 'websocket.receive', 'text': json.dumps(
+                {'type': 'start', 'count': 3, 'interval_ms': 5})})
+            with mock.patch.object(asgi_views.latency, 'LOSS_TIMEOUT', 0.2):
+                await asgi_views.latency_socket({'type': 'websocket'}, to_server.get, send)
+            return results
+
+        results = asyncio.run(run())
+        self.assertEqual(len(results), 1)
+        self.assertEqual((results[0]['sent'], results[0]['received'], results[0]['lost']), (3, 2, 1))
+
+
+@override_settings(GEOIP_INDEX_PATH=None, GEO_ENRICHMENT_IN_PROCESS=False, ALLOWED_HOSTS=['testserver'])
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        metrics.registry.reset()
+        self.client.force_login(User.objects.create_user('tester', password='secret'))
+
+    def test_save_reports_db_phase_in_server_timing(self):
+        response = self.client.post(
+            '/api/save/', data=json.dumps({'ping': 10, 'download': 50, 'upload': 20}),
+            content_type='application/json',
+        )
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn('speedtest_phase_seconds_count{endpoint="save",phase="db"} 1', text)
+        self.assertIn('speedtest_request_duration_seconds_count{endpoint="save",method="POST",status="200"} 1', text)
+        self.assertIn('speedtest_received_bytes_total{endpoint="save"}', text)
+
+    def test_fast_path_download_counts_bytes_and_transfers(self):
+        response = self.client.get('/api/download/?size=1000')
+        self.assertIn('app;dur=', response['Server-Timing'])
+        self.assertEqual(len(b''.join(response.streaming_content)), 1000)
+        response.close()
+
+        text = metrics.render()
+        self.assertIn('speedtest_sent_bytes_total{endpoint="download"} 1000', text)
+        self.assertIn('speedtest_active_transfers{endpoint="download"} 0', text)
+        self.assertIn('speedtest_request_duration_seconds_bucket{endpoint="download",method="GET",status="200",le="+Inf"} 1', text)
+
+    def test_phases_outside_request_are_ignored(self):
+        with metrics.phase('db'):
+            pass
+        token = metrics.start_request()
+        with metrics.phase('geoip'):
+            pass
+        self.assertEqual(list(metrics.finish_request(token, 'ping')), ['geoip'])
+
+
+class SpeedbenchCompareTests(SimpleTestCase):
+
+    def test_flags_only_regressions_beyond_threshold(self):
+        baseline = {'endpoints': {'ping': {'rps': 1000, 'p99_ms': 5.0, 'cpu_ms_per_mb': None}}}
+        current = {'endpoints': {
+            'ping': {'rps': 850, 'p99_ms': 7.0, 'cpu_ms_per_mb': 3.0},
+            'save': {'rps': 10, 'p99_ms': 100.0, 'cpu_ms_per_mb': 1.0},
+        }}
+        regressions = speedbench.compare(current, baseline, max_regression=0.2)
+        self.assertEqual([(r['endpoint'], r['metric']) for r in regressions], [('ping', 'p99_ms')])
+
+    def test_percentile_uses_nearest_rank(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(benchutil.percentile(values, 0.5), 3)
+        self.assertEqual(benchutil.percentile(values, 0.99), 5)
+        self.assertEqual(benchutil.percentile(values, 0), 1)
+        self.assertIsNone(benchutil.percentile([], 0.5))
+
+
+class BenchConcurrencyTests(SimpleTestCase):
+
+    def test_only_successful_streams_get_ttfb(self):
+        async def handle(reader, writer):
+            request = await reader.readuntil(b'\r\n\r\n')
+            if request.startswith(b'GET /busy '):
+                writer.write(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 4\r\n\r\nbusy')
+            else:
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 1000\r\n\r\n' + b'x' * 1000)
+            await writer.drain()
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                busy = await bench_concurrency._client('127.0.0.1', port, '/busy', 5)
+                ok = await bench_concurrency._client('127.0.0.1', port, '/ok', 5)
+            return busy, ok
+
+        busy, ok = asyncio.run(run())
+        self.assertEqual((busy['status'], busy['ttfb'], busy['error']), (503, None, None))
+        self.assertEqual((ok['status'], ok['bytes']), (200, 1000))
+        self.assertIsNotNone(ok['ttfb'])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class AdmissionTests(SimpleTestCase):
+
+    def test_concurrency_cap_refuses_fast_until_release(self):
+        controller = admission.Admission(max_concurrent=2, clock=FakeClock())
+        first, _ = controller.admit('1.1.1.1')
+        controller.admit('2.2.2.2')
+
+        ticket, refusal = controller.admit('3.3.3.3')
+        self.assertIsNone(ticket)
+        self.assertEqual(refusal['reason'], 'concurrency')
+        self.assertEqual(admission.http_status(refusal), 503)
+        self.assertGreaterEqual(refusal['retry_after_ms'], admission.MIN_RETRY_MS)
+        self.assertEqual(controller.snapshot()['waiting'], 1)
+
+        first.release()
+        first.release()  # повторное освобождение ничего не меняет
+        self.assertIsNotNone(controller.admit('3.3.3.3')[0])
+        self.assertEqual(controller.snapshot()['active'], 2)
+
+    def test_bandwidth_budget_uses_recent_throughput(self):
+        clock = FakeClock()
+        controller = admission.Admission(max_bandwidth=1000, clock=clock)
+        ticket, _ = controller.admit('1.1.1.1')
+        ticket.record(1500)
+        self.assertEqual(controller.admit('2.2.2.2')[1]['reason'], 'bandwidth')
+
+        # Через окно измерения скорость обнуляется
+        clock.now += admission.WINDOW + 0.1
+        self.assertIsNotNone(controller.admit('2.2.2.2')[0])
+
+    def test_per_ip_token_bucket(self):
+        clock = FakeClock()
+        controller = admission.Admission(rate=2.0, burst=2, clock=clock)
+        for _ in range(2):
+            controller.admit('1.1.1.1')[0].release()
+
+        ticket, refusal = controller.admit('1.1.1.1')
+        self.assertEqual((refusal['reason'], refusal['retry_after_ms']), ('rate_limit', 500))
+        self.assertEqual(admission.http_status(refusal), 429)
+        # Другие IP не затронуты, токен восстанавливается со временем
+        self.assertIsNotNone(controller.admit('2.2.2.2')[0])
+        clock.now += 0.5
+        self.assertIsNotNone(controller.admit('1.1.1.1')[0])
+
+    def test_client_ip_ignores_client_supplied_forwarded_for(self):
+        with override_settings(TRANSFER_TRUSTED_PROXIES=0):
+            self.assertEqual(admission.client_ip('10.0.0.1', '6.6.6.6'), '10.0.0.1')
+        with override_settings(TRANSFER_TRUSTED_PROXIES=1):
+            self.assertEqual(admission.client_ip('10.0.0.1', '6.6.6.6, 1.1.1.1'), '1.1.1.1')
+            self.assertEqual(admission.client_ip('10.0.0.1', None), '10.0.0.1')
+        with override_settings(TRANSFER_TRUSTED_PROXIES=2):
+            self.assertEqual(admission.client_ip('10.0.0.2', '6.6.6.6, 1.1.1.1, 10.0.0.1'), '1.1.1.1')
+            # Запрос мимо прокси: записей меньше, чем прокси
+            self.assertEqual(admission.client_ip('10.0.0.2', '1.1.1.1'), '10.0.0.2')
+
+    @override_settings(ALLOWED_HOSTS=['testserver'], TRANSFER_TRUSTED_PROXIES=1, TRANSFER_RATE_PER_IP=0.001,
+                       TRANSFER_BURST_PER_IP=2, TRANSFER_MAX_CONCURRENT=None, TRANSFER_MAX_BANDWIDTH_MBPS=None)
+    def test_rate_limit_survives_forwarded_for_rotation(self):
+        admission.reset()
+        self.addCleanup(admission.reset)
+
+        statuses = [
+            self.client.get('/api/download/?size=10', HTTP_X_FORWARDED_FOR=f'7.7.7.{i}, 1.1.1.1').status_code
+            for i in range(3)
+        ]
+        self.assertEqual(statuses, [200, 200, 429])
+
+        scope = {'type': 'http', 'client': ('10.0.0.1', 1), 'headers': [(b'x-forwarded-for', b'7.7.7.9, 1.1.1.1')]}
+        self.assertEqual(asgi_views._admission_ip(scope), '1.1.1.1')
+
+    @override_settings(ALLOWED_HOSTS=['testserver'], TRANSFER_MAX_CONCURRENT=1)
+    def test_download_view_holds_slot_until_response_closed(self):
+        admission.reset()
+        self.addCleanup(admission.reset)
+
+        response = self.client.get('/api/download/?size=1000')
+        busy = self.client.get('/api/download/?size=1000')
+        self.assertEqual(busy.status_code, 503)
+        self.assertIn('Retry-After', busy)
+        self.assertEqual(busy.json()['reason'], 'concurrency')
+
+        response.close()
+        self.assertEqual(admission.snapshot()['active'], 0)
+        self.assertEqual(self.client.get('/api/download/?size=1000').status_code, 200)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('tester', password='secret')
+        self.other = User.objects.create_user('other', password='secret')
+        for i, user in enumerate([self.user] * 3 + [self.other] * 2):
+            SpeedTestResult.objects.create(
+                user=user, ping=10 + i, download=100.0, upload=20.0,
+                provider='ISP' if i % 2 else 'Other', country='Россия',
+                timestamp=timezone.now() - timedelta(days=i),
+            )
+        self.client.force_login(self.user)
+
+    def test_csv_export_is_own_results_only(self):
+        response = self.client.get('/api/export/')
+        self.assertIn('attachment;', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][:3], ['id', 'timestamp', 'ping'])
+        self.assertEqual([row[2] for row in rows[1:]], ['12.0', '11.0', '10.0'])
+
+    def test_gzip_ndjson_with_filters(self):
+        response = self.client.get('/api/export/?format=ndjson&gzip=1&provider=ISP')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual([json.loads(line)['ping'] for line in lines], [11.0])
+
+        since = (timezone.now() - timedelta(hours=36)).isoformat()
+        response = self.client.get('/api/export/', {'format': 'ndjson', 'from': since})
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 2)
+
+    def test_global_scope_requires_staff(self):
+        self.assertEqual(self.client.get('/api/export/?scope=all').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/api/export/?scope=all&format=ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual({row['user_id'] for row in rows}, {self.user.id, self.other.id})
+
+    def test_output_is_streamed_in_bounded_chunks(self):
+        with mock.patch.object(export, 'CHUNK_BYTES', 100):
+            chunks = list(export.stream(SpeedTestResult.objects.order_by('id'), export.FIELDS))
+        self.assertGreater(len(chunks), 2)
+        self.assertTrue(all(len(chunk) < 400 for chunk in chunks))
+
+
+@override_settings(GEOIP_INDEX_PATH=None, GEO_ENRICHMENT_IN_PROCESS=False, ALLOWED_HOSTS=['testserver'])
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        self.user = User.objects.create_user('tester', password='secret')
+        self.client.force_login(self.user)
+
+    def save(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/save/', data=json.dumps({'ping': 10, 'download': 50, 'upload': 20}),
+                             content_type='application/json')
+
+    def test_history_is_cached_until_save_and_supports_etag(self):
+        self.save()
+        first = self.client.get('/api/history/?limit=10')
+        self.assertEqual(len(first.json()['history']), 1)
+
+        with self.assertNumQueries(2):  # только сессия и пользователь
+            second = self.client.get('/api/history/?limit=10')
+        self.assertEqual(second.content, first.content)
+
+        not_modified = self.client.get('/api/history/?limit=10', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        # Запись результата меняет версию: старый ETag больше не подходит
+        self.save()
+        fresh = self.client.get('/api/history/?limit=10', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertEqual(len(fresh.json()['history']), 2)
+
+        stats = self.client.get('/api/cache/stats/').json()['history']
+        self.assertEqual((stats['hit'], stats['miss'], stats['not_modified']), (2, 2, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_users_do_not_share_cached_history(self):
+        self.save()
+        self.client.get('/api/history/')
+        self.client.force_login(User.objects.create_user('other', password='secret'))
+        self.assertEqual(self.client.get('/api/history/').json()['history'], [])
+
+
+class FakeNodeHandler(BaseHTTPRequestHandler):
+    """Тестовый узел: /api/ping/ и /api/admission/"""
+
+    def do_GET(self):
+        if self.path == '/api/ping/':
+            body = {'status': 'ok'}
+        elif self.path == '/api/admission/':
+            body = {'active': self.server.active}
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(GEOIP_INDEX_PATH=None, GEO_ENRICHMENT_IN_PROCESS=False, ALLOWED_HOSTS=['testserver'])
+class TestServerRegistryTests(TestCase):
+
+    def setUp(self):
+        servers.forget_names()
+        self.addCleanup(servers.forget_names)
+        self.nodes = []
+        for active in (0, 5):
+            node = ThreadingHTTPServer(('127.0.0.1', 0), FakeNodeHandler)
+            node.active = active
+            threading.Thread(target=node.serve_forever, daemon=True).start()
+            self.addCleanup(node.server_close)
+            self.addCleanup(node.shutdown)
+            self.nodes.append(node)
+
+        def add(name, lat, lon, url='http://127.0.0.1:9/', **extra):
+            return TestServer.objects.create(name=name, url=url, latitude=lat, longitude=lon, **extra)
+
+        self.moscow = add('msk', 55.75, 37.62, f'http://127.0.0.1:{self.nodes[0].server_port}/')
+        self.spb = add('spb', 59.93, 30.33, f'http://127.0.0.1:{self.nodes[1].server_port}/', capacity=5)
+        self.berlin = add('ber', 52.52, 13.40)
+        self.tokyo = add('tyo', 35.68, 139.69, f'http://127.0.0.1:{self.nodes[0].server_port}/')
+
+    def test_nearest_uses_geohash_cells_and_orders_by_distance(self):
+        # Тверь: ближе всего Москва, потом Петербург
+        found = servers.nearest(56.86, 35.90, count=2)
+        self.assertEqual([server.name for server, _ in found], ['msk', 'spb'])
+        self.assertLess(found[0][1], found[1][1])
+        # Если рядом кандидатов мало, поиск расширяется до всего реестра
+        self.assertEqual(len(servers.nearest(-33.87, 151.21, count=4)), 4)
+
+    def test_health_check_marks_dead_and_full_nodes(self):
+        self.assertEqual(servers.check_all(), 3)
+        self.berlin.refresh_from_db()
+        self.spb.refresh_from_db()
+        self.assertFalse(self.berlin.healthy)
+        self.assertEqual(self.spb.active_transfers, 5)
+
+        # Берлин недоступен, Петербург занят полностью (5 из 5)
+        data = self.client.get('/api/servers/?lat=52.5&lon=13.4&count=3').json()
+        self.assertEqual([item['name'] for item in data['servers']], ['msk', 'tyo'])
+
+    def test_chosen_node_is_recorded_in_result(self):
+        self.client.force_login(User.objects.create_user('tester', password='secret'))
+        for name in ('spb', 'unknown'):
+            self.client.post('/api/save/', data=json.dumps({'ping': 10, 'download': 50, 'upload': 20, 'server': name}),
+                             content_type='application/json')
+        self.assertEqual(
+            list(SpeedTestResult.objects.order_by('id').values_list('server', flat=True)),
+            ['spb', servers.local_name()],
+        )
+
+
+class MapTileTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def write(self, *points):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest.write_results([
+                SpeedTestResult(ping=10, download=download, upload=10, latitude=lat, longitude=lon)
+                for lat, lon, download in points
+            ])
+
+    def test_tiles_follow_inserts_and_skip_unknown_location(self):
+        self.write((55.75, 37.50, 100), (55.76, 37.55, 300), (59.93, 30.31, 50), (0, 0, 10), (None, None, 10))
+        self.assertEqual(MapTile.objects.filter(precision=2).aggregate(total=Sum('count'))['total'], 3)
+
+        moscow = MapTile.objects.get(precision=4, geohash=geohash.encode(55.75, 37.50, 4))
+        self.assertEqual(moscow.count, 2)
+        self.assertAlmostEqual(moscow.download_median, 100, delta=100 * sketch.RELATIVE_ACCURACY)
+
+        # Пересчет с нуля дает те же ячейки
+        before = sorted(MapTile.objects.values_list('precision', 'geohash', 'count', 'download_sum'))
+        self.assertEqual(tiles.rebuild(), 3)
+        self.assertEqual(sorted(MapTile.objects.values_list('precision', 'geohash', 'count', 'download_sum')), before)
+
+    def test_map_reads_tiles_in_bbox(self):
+        self.write((55.75, 37.50, 100), (55.76, 37.55, 300), (59.93, 30.31, 50), (35.68, 139.69, 500))
+
+        data = self.client.get('/api/map/?bbox=30,50,40,60&zoom=7').json()
+        self.assertEqual(data['precision'], 4)
+        self.assertEqual(sorted(tile['count'] for tile in data['tiles']), [1, 2])
+        moscow = max(data['tiles'], key=lambda tile: tile['count'])
+        self.assertEqual(moscow['download']['avg'], 200.0)
+        self.assertFalse(data['truncated'])
+
+        # Область через 180-й меридиан и слишком крупная для масштаба
+        data = self.client.get('/api/map/?bbox=120,-90,-120,90&zoom=12').json()
+        self.assertLess(data['precision'], 6)
+        self.assertEqual([tile['count'] for tile in data['tiles']], [1])
+
+        self.assertEqual(self.client.get('/api/map/?bbox=1,2,3').status_code, 400)
+        self.assertEqual(self.client.get('/api/map/?zoom=x').status_code, 400)
+
+        # Новый результат меняет версию кэша карты
+        cached = self.client.get('/api/map/?bbox=30,50,40,60&zoom=7')
+        self.write((59.94, 30.32, 70))
+        fresh = self.client.get('/api/map/?bbox=30,50,40,60&zoom=7')
+        self.assertNotEqual(fresh['ETag'], cached['ETag'])
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'], GEO_ENRICHMENT_IN_PROCESS=False)
+class ResultAdminTests(TestCase):
+    url = '/admin/speedtest_app/speedtestresult/'
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser('admin', password='secret')
+        self.client.force_login(self.admin)
+        ingest.write_results([
+            SpeedTestResult(user=self.admin, ping=10, download=100 + i, upload=10, server='a',
+                            country='Россия' if i % 2 else 'Германия', provider='ISP-1')
+            for i in range(6)
+        ])
+
+    def test_changelist_uses_estimated_count_and_rollup_filters(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 6)
+        sql = [query['sql'] for query in queries]
+        self.assertFalse(any('COUNT(*)' in query and 'speedtest_app_speedtestresult' in query for query in sql))
+        # Пользователь подгружается в том же запросе, что и результаты
+        self.assertEqual(sum('FROM "auth_user"' in query for query in sql), 1)
+        self.assertContains(response, '?country=%D0%A0%D0%BE%D1%81%D1%81%D0%B8%D1%8F')
+
+        response = self.client.get(self.url, {'country': 'Россия'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+    def test_batch_actions(self):
+        germany = SpeedTestResult.objects.filter(country='Германия')
+        ids = [str(pk) for pk in germany.values_list('pk', flat=True)]
+
+        self.client.post(self.url, {'action': 're_enrich_geo', '_selected_action': ids})
+        self.assertEqual(SpeedTestResult.objects.filter(geo_pending=True).count(), 3)
+
+        # Сначала страница подтверждения, ничего не удаляется
+        response = self.client.post(self.url, {'action': 'delete_in_batches', '_selected_action': ids})
+        self.assertContains(response, 'Будет удалено результатов: 3.')
+        self.assertContains(response, '<input type="hidden" name="post" value="yes">', html=True)
+        self.assertEqual(SpeedTestResult.objects.count(), 6)
+
+        version = response_cache.get_version(response_cache.user_scope(self.admin.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                self.url, {'action': 'delete_in_batches', '_selected_action': ids, 'post': 'yes'})
+        self.assertRedirects(response, self.url)
+        self.assertEqual(SpeedTestResult.objects.count(), 3)
+        self.assertFalse(germany.exists())
+        self.assertNotEqual(response_cache.get_version(response_cache.user_scope(self.admin.pk)), version)
+
+        # Выбор всех строк по фильтру переносится на страницу подтверждения
+        first = str(SpeedTestResult.objects.values_list('pk', flat=True)[0])
+        response = self.client.post(self.url + '?country=%D0%A0%D0%BE%D1%81%D1%81%D0%B8%D1%8F', {
+            'action': 'delete_in_batches', '_selected_action': [first], 'select_across': '1'})
+        self.assertContains(response, 'Будет удалено результатов: 3.')
+        self.assertContains(response, '<input type="hidden" name="select_across" value="1">', html=True)
+
+        # Пачки по 2 строки: 3 строки удаляются за 2 пачки, потом пустая выборка
+        with self.assertNumQueries(2 * 4 + 1):
+            self.assertEqual(ingest.delete_results(SpeedTestResult.objects.all(), batch_size=2), 3)
+        # Сводки сохраняют статистику удаленных результатов
+        self.assertEqual(rollups.query_stats('day', timezone.now() - timedelta(days=1), timezone.now())[0]['count'], 6)
+
+
+@override_settings(GEO_ENRICHMENT_IN_PROCESS=False)
+class RetentionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.user = User.objects.create_user('tester')
+
+    def write(self, days_ago, count=1, **fields):
+        timestamp = timezone.now() - timedelta(days=days_ago)
+        ingest.write_results([
+            SpeedTestResult(user=self.user, timestamp=timestamp, ping=10, download=100, upload=10, server='a', **fields)
+            for _ in range(count)
+        ])
+
+    def read_archive(self, month):
+        with gzip.open(retention.archive_path(self.directory.name, month), 'rt', encoding='utf-8') as archive_file:
+            return [json.loads(line) for line in archive_file]
+
+    def test_old_results_are_archived_by_month_and_deleted_in_batches(self):
+        self.write(800, count=3)
+        self.write(700, count=2)
+        self.write(10, count=2)
+        self.write(900, geo_pending=True, ip_address='5.5.5.5')
+        old_month = f'{timezone.now() - timedelta(days=800):%Y-%m}'
+
+        with override_settings(RESULTS_ARCHIVE_DIR=self.directory.name):
+            result = retention.run(days=365, batch_size=2, pause=0)
+        self.assertEqual(result['archived'], 5)
+        self.assertEqual(len(result['months']), 2)
+        self.assertIn(old_month, result['months'])
+
+        archived = self.read_archive(old_month)
+        self.assertEqual(len(archived), 3)  # пачки по 2 строки - несколько gzip-членов в файле
+        self.assertEqual(archived[0]['user_id'], self.user.pk)
+        self.assertEqual(set(archived[0]), set(retention.ARCHIVE_FIELDS))
+
+        # Остались свежие результаты и строка, ждущая геоданных
+        self.assertEqual(SpeedTestResult.objects.count(), 3)
+        # Статистика по архивным строкам осталась в сводках
+        stats = rollups.query_stats('day', timezone.now() - timedelta(days=1000), timezone.now(), quantiles=False)
+        self.assertEqual(stats[0]['count'], 7)
+
+        # Повторный запуск дописывает в тот же файл
+        self.write(800)
+        with override_settings(RESULTS_ARCHIVE_DIR=self.directory.name):
+            self.assertEqual(retention.run(days=365, pause=0)['archived'], 1)
+        self.assertEqual(len(self.read_archive(old_month)), 4)
+
+    def test_rebuilds_keep_aggregates_of_archived_results(self):
+        self.write(800, count=2, latitude=55.75, longitude=37.50)
+        self.write(10, latitude=55.75, longitude=37.50)
+        tiles_before = sorted(MapTile.objects.values_list('precision', 'geohash', 'count', 'download_sum'))
+        start, end = timezone.now() - timedelta(days=1000), timezone.now()
+
+        with override_settings(RESULTS_ARCHIVE_DIR=self.directory.name):
+            self.assertEqual(retention.run(days=365, pause=0)['archived'], 2)
+
+        # Скетчи сводок с архивными строками не затираются пустыми
+        self.assertEqual(rollups.rebuild_sketches(), 1)
+        stats = rollups.query_stats('day', start, end)
+        self.assertEqual(stats[0]['count'], 3)
+        self.assertAlmostEqual(stats[0]['download']['p50'], 100, delta=100 * sketch.RELATIVE_ACCURACY)
+
+        # Пересчет ячеек берет архивный вклад из ArchivedMapTile
+        self.assertEqual(tiles.rebuild(), 1)
+        self.assertEqual(
+            sorted(MapTile.objects.values_list('precision', 'geohash', 'count', 'download_sum')), tiles_before,
+        )
+
+
+class IncrementalVacuumTests(SimpleTestCase):
+    alias = 'vacuum_test'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_dict = dict(connections['default'].settings_dict, NAME=os.path.join(directory.name, 'vacuum.sqlite3'))
+        connections[self.alias] = connections['default'].__class__(settings_dict, alias=self.alias)
+        self.addCleanup(self.close)
+
+    def close(self):
+        connections[self.alias].close()
+        del connections[self.alias]
+
+    def test_vacuum_returns_free_pages_to_file(self):
+        path = connections[self.alias].settings_dict['NAME']
+        self.assertIsNone(retention.vacuum(using=self.alias))
+        retention.enable_incremental_vacuum(using=self.alias)
+        self.assertTrue(retention.incremental_vacuum_enabled(using=self.alias))
+
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('CREATE TABLE filler (data TEXT)')
+            cursor.executemany('INSERT INTO filler VALUES (%s)', [('x' * 1000,)] * 2000)
+            cursor.execute('DELETE FROM filler')
+        size = os.path.getsize(path)
+
+        self.assertGreater(retention.vacuum(max_pages=100, step=30, using=self.alias), 0)
+        freed = retention.vacuum(step=200, using=self.alias)
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('PRAGMA freelist_count')
+            self.assertEqual(cursor.fetchone()[0], 0)
+        self.assertGreater(freed, 100)
+        self.assertLess(os.path.getsize(path), size // 4)
@@ -0,0 +1,250 @@
+"""Сводки результатов по ячейкам geohash для карты (MapTile).
+
+Каждый результат с координатами учитывается в ячейках нескольких длин
+(TILE_PRECISIONS) одновременно со сводками rollups.roll_up, поэтому флаг
+SpeedTestResult.rolled_up защищает и ячейки от двойного учета.
+
+Запрос карты выбирает длину ячейки по масштабу и читает ячейки видимой
+области диапазонами префиксов по индексу maptile_unique_cell. Число
+диапазонов (MAX_RANGES) и прочитанных строк (MAX_SCAN) ограничено, поэтому
+время ответа не зависит ни от числа результатов, ни от размера области.
+"""
+from django.db import transaction
+from django.db.models import Q
+
+from . import geohash, response_cache
+from .models import ArchivedMapTile, MapTile, SpeedTestResult
+from .sketch import DDSketch
+
+METRICS = ('ping', 'download', 'upload')
+# ~630 км, 78 км, 20 км, 2.4 км, 0.6 км по широте
+TILE_PRECISIONS = (2, 3, 4, 5, 6)
+# Длина ячейки для масштаба карты 0, 1, 2, ... (дальше - последняя)
+ZOOM_PRECISIONS = (2, 2, 2, 2, 3, 3, 3, 4, 4, 5, 5, 5, 6)
+MAX_TILES = 5000
+MAX_RANGES = 64
+MAX_SCAN = 4 * MAX_TILES
+REBUILD_CHUNK = 50000
+
+
+def has_location(latitude, longitude):
+    # (0, 0) - заглушка ip_service для неопределенного IP
+    if latitude is None or longitude is None or (latitude == 0 and longitude == 0):
+        return False
+    return -90 <= latitude <= 90 and -180 <= longitude <= 180
+
+
+def cells(latitude, longitude):
+    """Ячейки всех длин TILE_PRECISIONS, в которые попадает точка"""
+    code = geohash.encode(latitude, longitude, TILE_PRECISIONS[-1])
+    return [(precision, code[:precision]) for precision in TILE_PRECISIONS]
+
+
+class _Summary:
+    def __init__(self):
+        self.count = 0
+        self.sums = dict.fromkeys(METRICS, 0.0)
+        self.sketches = {metric: DDSketch() for metric in METRICS}
+
+    def add(self, row):
+        self.count += 1
+        for metric in METRICS:
+            self.sums[metric] += row[metric]
+            self.sketches[metric].add(row[metric])
+
+
+def _median(sketch):
+    value = sketch.quantile(0.5)
+    return round(value, 3) if value is not None else None
+
+
+def _apply(model, precision, cell, summary):
+    tile, _ = model.objects.get_or_create(precision=precision, geohash=cell)
+    # Скетчи складываются в Python, поэтому строку ячейки блокируем
+    tile = model.objects.select_for_update().get(pk=tile.pk)
+
+    fields = ['count']
+    for metric in METRICS:
+        setattr(tile, f'{metric}_sum', getattr(tile, f'{metric}_sum') + summary.sums[metric])
+        sketch = DDSketch.from_bytes(getattr(tile, f'{metric}_sketch'))
+        sketch.merge(summary.sketches[metric])
+        setattr(tile, f'{metric}_sketch', sketch.to_bytes())
+        fields += [f'{metric}_sum', f'{metric}_sketch']
+        if model is MapTile:
+            setattr(tile, f'{metric}_median', _median(sketch))
+            fields.append(f'{metric}_median')
+
+    tile.count += summary.count
+    tile.save(update_fields=fields)
+
+
+def _add(model, rows):
+    summaries = {}
+    added = 0
+    for row in rows:
+        if not has_location(row['latitude'], row['longitude']):
+            continue
+        added += 1
+        for key in cells(row['latitude'], row['longitude']):
+            summaries.setdefault(key, _Summary()).add(row)
+
+    for (precision, cell), summary in summaries.items():
+        _apply(model, precision, cell, summary)
+    return added
+
+
+def add(rows):
+    """Учитывает строки результатов (dict с latitude, longitude и METRICS) в ячейках.
+
+    Вызывается из rollups.roll_up внутри его транзакции. Возвращает число
+    учтенных строк (без координат пропускаются).
+    """
+    return _add(MapTile, rows)
+
+
+def archive(rows):
+    """Запоминает вклад удаляемых в архив строк (ArchivedMapTile).
+
+    Вызывается в одной транзакции с удалением строк, поэтому каждый
+    результат всегда учтен либо в таблице, либо здесь - ровно один раз.
+    """
+    return _add(ArchivedMapTile, rows)
+
+
+def rebuild(chunk_size=REBUILD_CHUNK):
+    """Пересчитывает все ячейки заново по уже учтенным в сводках результатам.
+
+    Нужна для результатов, сохраненных до появления ячеек. Результаты,
+    перенесенные в архив, берутся из ArchivedMapTile. Пока идет пересчет,
+    новые результаты лучше не учитывать (ROLLUPS_INLINE = False).
+    Возвращает число учтенных результатов из таблицы.
+    """
+    results = (
+        SpeedTestResult.objects.filter(rolled_up=True, latitude__isnull=False, longitude__isnull=False)
+        .values_list('latitude', 'longitude', *METRICS)
+    )
+    totals = {}
+    processed = 0
+    batch = {}
+
+    def total_for(key):
+        return totals.setdefault(key, [0, dict.fromkeys(METRICS, 0.0), {metric: DDSketch() for metric in METRICS}])
+
+    for archived in ArchivedMapTile.objects.iterator(chunk_size=1000):
+        total = total_for((archived.precision, archived.geohash))
+        total[0] += archived.count
+        for metric in METRICS:
+            total[1][metric] += getattr(archived, f'{metric}_sum')
+            total[2][metric].merge(DDSketch.from_bytes(getattr(archived, f'{metric}_sketch')))
+
+    def flush(batch):
+        for key, values in batch.items():
+            total = total_for(key)
+            total[0] += len(values)
+            for position, metric in enumerate(METRICS):
+                column = [value[position] for value in values]
+                total[1][metric] += sum(column)
+                total[2][metric].add_many(column)
+
+    pending = 0
+    for latitude, longitude, *values in results.iterator(chunk_size=chunk_size):
+        if not has_location(latitude, longitude):
+            continue
+        processed += 1
+        pending += 1
+        for key in cells(latitude, longitude):
+            batch.setdefault(key, []).append(values)
+        if pending >= chunk_size:
+            flush(batch)
+            batch = {}
+            pending = 0
+    flush(batch)
+
+    tiles = []
+    for (precision, cell), (count, sums, sketches) in totals.items():
+        tile = MapTile(precision=precision, geohash=cell, count=count)
+        for metric in METRICS:
+            setattr(tile, f'{metric}_sum', sums[metric])
+            setattr(tile, f'{metric}_sketch', sketches[metric].to_bytes())
+            setattr(tile, f'{metric}_median', _median(sketches[metric]))
+        tiles.append(tile)
+
+    with transaction.atomic():
+        MapTile.objects.all().delete()
+        MapTile.objects.bulk_create(tiles, batch_size=1000)
+        response_cache.bump(response_cache.STATS_SCOPE)
+    return processed
+
+
+def precision_for_zoom(zoom):
+    return ZOOM_PRECISIONS[max(0, min(zoom, len(ZOOM_PRECISIONS) - 1))]
+
+
+def split_bbox(min_lat, min_lon, max_lat, max_lon):
+    """Области запроса; bbox через 180-й меридиан (min_lon > max_lon) делится на две"""
+    if min_lon > max_lon:
+        return [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+    return [(min_lat, min_lon, max_lat, max_lon)]
+
+
+def _estimate(boxes, precision):
+    # Верхняя оценка числа ячеек длины precision в областях
+    height, width = geohash.cell_size(precision)
+    return sum(
+        (int((max_lat - min_lat) / height) + 2) * (int((max_lon - min_lon) / width) + 2)
+        for min_lat, min_lon, max_lat, max_lon in boxes
+    )
+
+
+def _intersects(cell, boxes):
+    cell_min_lat, cell_min_lon, cell_max_lat, cell_max_lon = geohash.bounds(cell)
+    return any(
+        cell_min_lat <= max_lat and min_lat <= cell_max_lat and cell_min_lon <= max_lon and min_lon <= cell_max_lon
+        for min_lat, min_lon, max_lat, max_lon in boxes
+    )
+
+
+def query(min_lat, min_lon, max_lat, max_lon, zoom):
+    """Ячейки карты в bbox для масштаба zoom.
+
+    Длина ячейки уменьшается, если область слишком велика для масштаба
+    (больше MAX_TILES ячеек). Возвращает (длина ячейки, [ячейки], truncated).
+    """
+    boxes = split_bbox(min_lat, min_lon, max_lat, max_lon)
+    precision = precision_for_zoom(zoom)
+    while precision > TILE_PRECISIONS[0] and _estimate(boxes, precision) > MAX_TILES:
+        precision -= 1
+
+    # Диапазоны префиксов берутся по ячейкам покрупнее, чтобы их было не больше MAX_RANGES
+    coarse = precision
+    while coarse > 1 and _estimate(boxes, coarse) > MAX_RANGES:
+        coarse -= 1
+    # precision в каждом условии: иначе SQLite ищет по индексу только precision = ?
+    condition = Q()
+    for box in boxes:
+        for cell in geohash.covering(*box, coarse):
+            start, end = geohash.prefix_range(cell)
+            condition |= Q(precision=precision, geohash__gte=start, geohash__lt=end)
+
+    columns = ['geohash', 'count']
+    for metric in METRICS:
+        columns += [f'{metric}_sum', f'{metric}_median']
+    rows = list(MapTile.objects.filter(condition).values(*columns)[:MAX_SCAN])
+    truncated = len(rows) == MAX_SCAN
+
+    tiles = []
+    for row in rows:
+        if not row['count'] or not _intersects(row['geohash'], boxes):
+            continue
+        if len(tiles) == MAX_TILES:
+            truncated = True
+            break
+        lat, lon = geohash.center(row['geohash'])
+        tile = {'geohash': row['geohash'], 'lat': round(lat, 5), 'lon': round(lon, 5), 'count': row['count']}
+        for metric in METRICS:
+            tile[metric] = {
+                'avg': round(row[f'{metric}_sum'] / row['count'], 3),
+                'p50': row[f'{metric}_median'],
+            }
+        tiles.append(tile)
+    return precision, tiles, truncated
@@ -0,0 +1,78 @@
+import time
+
+# Размер куска, которым читается тело запроса
+READ_SIZE = 64 * 1024  # 64 KB
+
+# Шаг, с которым точки попадают в кривую скорости
+SAMPLE_INTERVAL = 0.1  # секунды
+
+
+class UploadMeter:
+    """Считает пришедшие байты и время их прихода.
+
+    Скорость считается от первого до последнего куска, поэтому установка
+    соединения и отправка ответа в нее не входят.
+    """
+
+    def __init__(self, sample_interval=SAMPLE_INTERVAL, on_data=None):
+        self.sample_interval = sample_interval
+        # Вызывается с размером каждого куска (например, учет в сессии multistream)
+        self.on_data = on_data
+        self.received = 0
+        self.first_at = None
+        self.first_size = 0
+        self.last_at = None
+        self.samples = []
+        self._next_sample = 0.0
+
+    def feed(self, size):
+        if not size:
+            return
+        now = time.perf_counter()
+        self.received += size
+        if self.on_data is not None:
+            self.on_data(size)
+
+        if self.first_at is None:
+            self.first_at = now
+            self.first_size = size
+        self.last_at = now
+
+        elapsed = now - self.first_at
+        if elapsed >= self._next_sample:
+            self.samples.append([round(elapsed, 4), self.received])
+            self._next_sample = elapsed + self.sample_interval
+
+    def result(self):
+        """Количество байт, скорость по данным сервера и кривая
+        [секунды от первого куска, байт всего]"""
+        duration = (self.last_at - self.first_at) if self.first_at is not None else 0.0
+        samples = list(self.samples)
+        if samples and samples[-1][1] != self.received:
+            samples.append([round(duration, 4), self.received])
+
+        # Байты первого куска пришли в момент first_at, поэтому в скорость не входят
+        if duration > 0:
+            mbps = (self.received - self.first_size) * 8 / (duration * 1000000)
+        else:
+            mbps = 0.0
+
+        return {
+            'bytes_received': self.received,
+            'duration': round(duration, 6),
+            'mbps': round(mbps, 3),
+            'samples': samples,
+        }
+
+
+def consume(stream, read_size=READ_SIZE, sample_interval=SAMPLE_INTERVAL, on_data=None):
+    """Читает тело загрузки кусками и сразу их отбрасывает"""
+    meter = UploadMeter(sample_interval, on_data)
+
+    while True:
+        chunk = stream.read(read_size)
+        if not chunk:
+            break
+        meter.feed(len(chunk))
+
+    return meter.result()
@@ -9,9 +9,20 @@ urlpatterns = [
     path('ping/', views.ping_test, name='ping'),
     path('download/', views.download_test, name='download'),
     path('upload/', views.upload_test, name='upload'),
+    path('adaptive/', views.adaptive_step, name='adaptive'),
+    path('admission/', views.admission_view, name='admission'),
+    path('servers/', views.nearest_servers, name='servers'),
+    path('session/', views.create_session, name='session_create'),
+    path('session/<str:session_id>/', views.session_result, name='session_result'),
     path('save/', views.save_result, name='save'),
+    path('save/batch/', views.save_batch, name='save_batch'),
     path('history/', views.get_history, name='history'),
+    path('stats/', views.get_stats, name='stats'),
+    path('map/', views.result_map, name='map'),
+    path('export/', views.export_results, name='export'),
     path('ipinfo/', get_ip_info_view, name='ipinfo'),
+    path('ipinfo/stats/', views.ip_cache_stats_view, name='ipinfo_stats'),
+    path('cache/stats/', views.response_cache_stats_view, name='cache_stats'),
     path('register/', register_view, name='register'),
     path('login/', auth_views.LoginView.as_view(template_name='registration/login.html'), name='login'),
     path('logout/', auth_views.LogoutView.as_view(next_page='/'), name='logout')
@@ -1,13 +1,31 @@
-from django.http import JsonResponse, HttpResponse
+from django.http import Http404, JsonResponse, HttpResponse, StreamingHttpResponse
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from .models import SpeedTestResult
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.db.models import Q
+from .models import ResultRollup, SpeedTestResult
 from django.contrib.auth import login, logout
 from django.shortcuts import render, redirect
-from .ip_service import get_ip_info
+from .ip_service import get_ip_info, get_cache_stats
 from .forms import RegisterForm
+from . import (
+    adaptive, admission, enrichment, export, geoip, ingest, metrics, multistream, payload, response_cache, rollups,
+    servers, tiles, upload_sink,
+)
+import base64
+import binascii
 import time
-import random
 import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+MAX_BATCH_RESULTS = 100
+MAX_RESULT_AGE = timedelta(days=30)
+MAX_HISTORY_LIMIT = 100
+STATS_DEFAULT_RANGE = {
+    ResultRollup.PERIOD_HOUR: timedelta(hours=48),
+    ResultRollup.PERIOD_DAY: timedelta(days=30),
+}
 
 def register_view(request):
     if request.method == 'POST':
@@ -34,16 +52,45 @@ def ping_test(request):
     })
 
 
+def busy_response(refusal):
+    """Быстрый отказ контроля допуска: клиент повторит через retry_after_ms"""
+    response = JsonResponse(refusal, status=admission.http_status(refusal))
+    response['Retry-After'] = admission.retry_after(refusal)
+    return response
+
+
 def download_test(request):
-    """Генерация тестовых данных для скачивания"""
-    # Используем фиксированный размер для стабильности
-    size = 2 * 1024 * 1024  # 2 MB
+    """Отдача тестовых данных для скачивания из заранее сгенерированного пула.
+
+    ?size=N - отдать ровно N байт.
+    ?duration=S - отдавать данные потоком в течение S секунд (размер заранее
+    неизвестен, поэтому ответ идет без Content-Length).
+    ?session=&stream= - учитывать переданные байты в многопоточной сессии.
+    """
+    try:
+        session, stream = multistream.from_params(request.GET)
+    except LookupError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=404)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    duration = payload.parse_duration(request.GET.get('duration'))
+    if duration:
+        size = payload.parse_size(request.GET['size']) if 'size' in request.GET else None
+    else:
+        size = payload.parse_size(request.GET.get('size'))
+
+    ticket, refusal = admission.admit(get_admission_ip(request))
+    if refusal is not None:
+        return busy_response(refusal)
 
-    # Генерируем случайные данные
-    data = bytes([random.randint(0, 255) for _ in range(size)])
+    chunks = payload.iter_payload(size, duration)
+    if session is not None:
+        chunks = session.track('download', chunks, stream)
 
-    response = HttpResponse(data, content_type='application/octet-stream')
-    response['Content-Length'] = str(size)
+    response = StreamingHttpResponse(ticket.track(metrics.track_stream('download', chunks)), content_type='application/octet-stream')
+    if not duration:
+        response['Content-Length'] = str(size)
     response['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
     response['Pragma'] = 'no-cache'
 
@@ -52,18 +99,43 @@ def download_test(request):
 
 @csrf_exempt
 def upload_test(request):
+    """Прием тестовых данных без буферизации тела запроса"""
     if request.method == 'POST':
         # Получаем время начала от клиента
-        start_time = float(request.GET.get('start_time', time.time()))
+        try:
+            start_time = float(request.GET.get('start_time', time.time()))
+        except ValueError:
+            start_time = time.time()
+
+        try:
+            session, stream = multistream.from_params(request.GET)
+        except LookupError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=404)
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+        ticket, refusal = admission.admit(get_admission_ip(request))
+        if refusal is not None:
+            return busy_response(refusal)
 
-        # Читаем данные
-        data = request.body
-        content_length = len(data)
+        def on_data(size):
+            ticket.record(size)
+            if session is not None:
+                session.record('upload', size, stream)
+
+        # Читаем данные кусками и сразу отбрасываем
+        metrics.transfer_started('upload')
+        try:
+            stats = upload_sink.consume(request, on_data=on_data)
+        finally:
+            metrics.transfer_finished('upload')
+            ticket.release()
 
-        # Возвращаем только факт получения
         return JsonResponse({
             'status': 'ok',
-            'bytes_received': content_length,
+            'bytes_received': stats['bytes_received'],
+            'duration': stats['duration'],
+            'mbps': stats['mbps'],
+            'samples': stats['samples'],
             'server_time': time.time(),
             'client_start': start_time
         })
@@ -71,6 +143,135 @@ def upload_test(request):
     return JsonResponse({'error': 'POST method required'}, status=400)
 
 
+@csrf_exempt
+def adaptive_step(request):
+    """Размер следующей порции адаптивного теста.
+
+    Тело: {"direction": "download"|"upload", "intervals": [[байт, секунд], ...]}
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'POST required'}, status=400)
+
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+        intervals = adaptive.parse_intervals(data.get('intervals', []))
+    except (ValueError, TypeError, IndexError, AttributeError) as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    max_step_size = adaptive.MAX_STEP_SIZE
+    if data.get('direction', 'download') == 'download':
+        max_step_size = min(max_step_size, payload.MAX_SIZE)
+
+    return JsonResponse(adaptive.next_step(intervals, max_step_size))
+
+
+@csrf_exempt
+def create_session(request):
+    """Создание сессии многопоточного теста (?streams=N)"""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'POST required'}, status=400)
+
+    try:
+        streams = int(request.GET.get('streams', multistream.DEFAULT_STREAMS))
+    except ValueError:
+        streams = multistream.DEFAULT_STREAMS
+    session = multistream.store.create(streams)
+
+    return JsonResponse({
+        'session': session.id,
+        'streams': session.streams,
+        'warmup': multistream.WARMUP,
+        'expires_in': multistream.TTL
+    })
+
+
+def session_result(request, session_id):
+    """Общая скорость по всем потокам сессии (без разгона)"""
+    session = multistream.store.get(session_id)
+    if session is None:
+        return JsonResponse({'status': 'error', 'message': 'Сессия не найдена или истекла'}, status=404)
+    return JsonResponse(session.to_dict())
+
+
+def nearest_servers(request):
+    """Ближайшие к клиенту тестовые узлы.
+
+    ?lat=&lon= - координаты клиента; без них берутся из локального индекса
+    GeoIP по IP. ?count= - сколько кандидатов вернуть (клиент выбирает из
+    них узел с наименьшей задержкой).
+    """
+    try:
+        count = max(1, min(int(request.GET.get('count', servers.DEFAULT_CANDIDATES)), servers.MAX_CANDIDATES))
+        if 'lat' in request.GET and 'lon' in request.GET:
+            lat, lon = float(request.GET['lat']), float(request.GET['lon'])
+            if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                raise ValueError('lat/lon вне диапазона')
+        else:
+            ip_info = geoip.lookup(get_client_ip(request))
+            lat, lon = (ip_info['lat'], ip_info['lon']) if ip_info else (None, None)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    if lat is None:
+        # Местоположение неизвестно: наименее загруженные узлы
+        found = [(server, None) for server in servers.available().order_by('active_transfers', 'name')[:count]]
+    else:
+        found = servers.nearest(lat, lon, count)
+
+    return JsonResponse({
+        'location': {'lat': lat, 'lon': lon} if lat is not None else None,
+        'local': servers.local_name(),
+        'servers': [servers.to_dict(server, distance) for server, distance in found],
+    })
+
+
+def get_client_ip(request):
+    # ВАЖНО: PythonAnywhere передает реальный IP в HTTP_X_FORWARDED_FOR
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        # Берем первый IP из списка
+        return x_forwarded_for.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR')
+
+
+def get_admission_ip(request):
+    # Для лимитов admission: X-Forwarded-For только от доверенных прокси
+    return admission.client_ip(request.META.get('REMOTE_ADDR'), request.META.get('HTTP_X_FORWARDED_FOR'))
+
+
+def build_result(user, data, client_ip, ip_info):
+    """SpeedTestResult из присланных клиентом данных (без сохранения)"""
+    ping = max(0, min(float(data.get('ping', 0)), 1000))
+    download = max(0, min(float(data.get('download', 0)), 2000))
+    upload = max(0, min(float(data.get('upload', 0)), 2000))
+    # Есть только у тестов через WebSocket
+    jitter = max(0, min(float(data['jitter']), 1000)) if data.get('jitter') is not None else None
+    packet_loss = max(0, min(float(data['packet_loss']), 100)) if data.get('packet_loss') is not None else None
+
+    # Офлайн-клиенты присылают время теста. Будущее и слишком старое - не принимаем
+    now = timezone.now()
+    timestamp = parse_datetime(str(data['timestamp'])) if data.get('timestamp') else None
+    if timestamp is not None and timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, dt_timezone.utc)
+    if timestamp is None or timestamp > now or timestamp < now - MAX_RESULT_AGE:
+        timestamp = now
+
+    return SpeedTestResult(
+        user=user,
+        timestamp=timestamp,
+        ip_address=client_ip,
+        ping=ping,
+        jitter=jitter,
+        packet_loss=packet_loss,
+        download=download,
+        upload=upload,
+        # Узел, выбранный клиентом (/api/servers/); неизвестные имена не принимаем
+        server=servers.resolve_name(data.get('server')),
+        geo_pending=ip_info is None,
+        **(enrichment.geo_fields(ip_info) if ip_info else {})
+    )
+
+
 @csrf_exempt
 def save_result(request):
     """Сохранение результатов теста в БД"""
@@ -78,43 +279,23 @@ def save_result(request):
         try:
             data = json.loads(request.body.decode('utf-8'))
 
-            # ПОПРАВКА: Получаем IP клиента (так же как в get_ip_info_view)
-            x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-            if x_forwarded_for:
-                client_ip = x_forwarded_for.split(',')[0].strip()
-            else:
-                client_ip = request.META.get('REMOTE_ADDR')
+            client_ip = get_client_ip(request)
 
-            # Получаем информацию о местоположении для этого IP
-            ip_info = get_ip_info(client_ip)  # Передаем IP!
-
-            # ... остальной код функции без изменений ...
-            ping = max(0, min(float(data.get('ping', 0)), 1000))
-            download = max(0, min(float(data.get('download', 0)), 2000))
-            upload = max(0, min(float(data.get('upload', 0)), 2000))
+            # Геоданные из локального индекса (без сети). Если там IP нет,
+            # строка сохраняется сразу, а геоданные заполнит фоновый обработчик
+            ip_info = geoip.lookup(client_ip)
 
             # Сохраняем только для авторизованных
             if request.user.is_authenticated:
-                result = SpeedTestResult(
-                    user=request.user,
-                    ip_address=ip_info['ip'],  # Теперь будет IP пользователя
-                    ping=ping,
-                    download=download,
-                    upload=upload,
-                    server='pythonanywhere',
-                    provider=ip_info['isp'],
-                    city=ip_info['city'],
-                    country=ip_info['country'],
-                    latitude=ip_info.get('lat', 0),
-                    longitude=ip_info.get('lon', 0)
-                )
-                result.save()
+                result = build_result(request.user, data, client_ip, ip_info)
+                stored = ingest.save_result(result)
 
                 return JsonResponse({
                     'status': 'success',
-                    'id': result.id,
+                    'id': result.id if stored else None,
+                    'queued': not stored,
                     'timestamp': result.timestamp.isoformat(),
-                    'location': f"{ip_info['city']}, {ip_info['country']}"
+                    'location': f"{ip_info['city']}, {ip_info['country']}" if ip_info else None
                 })
             else:
                 return JsonResponse({
@@ -128,40 +309,264 @@ def save_result(request):
     return JsonResponse({'status': 'error', 'message': 'POST required'}, status=400)
 
 
+@csrf_exempt
+def save_batch(request):
+    """Пакетное сохранение результатов (офлайн-клиенты и киоски копят тесты).
+
+    Тело - список результатов или {"results": [...]}, не больше
+    MAX_BATCH_RESULTS штук. Все пишется одной транзакцией.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'POST required'}, status=400)
+
+    if not request.user.is_authenticated:
+        return JsonResponse({
+            'status': 'success',
+            'message': 'Результаты не сохранены (требуется авторизация)'
+        })
+
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+        items = data if isinstance(data, list) else data.get('results')
+        if not isinstance(items, list) or not items:
+            raise ValueError('Нужен непустой список results')
+        if len(items) > MAX_BATCH_RESULTS:
+            raise ValueError(f'Не больше {MAX_BATCH_RESULTS} результатов за запрос')
+
+        client_ip = get_client_ip(request)
+        ip_info = geoip.lookup(client_ip)
+        results = [build_result(request.user, item, client_ip, ip_info) for item in items]
+        ingest.write_results(results)
+
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    return JsonResponse({
+        'status': 'success',
+        'saved': len(results),
+        'ids': [result.id for result in results]
+    })
+
+
+def encode_cursor(timestamp, pk):
+    raw = f'{timestamp.isoformat()}|{pk}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """(timestamp, id) из курсора ?before= или ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+        timestamp, pk = raw.split('|')
+        timestamp = datetime.fromisoformat(timestamp)
+        return timestamp, int(pk)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise ValueError('Некорректный курсор')
+
+
 def get_history(request):
-    limit = int(request.GET.get('limit', 10))
+    """История тестов пользователя, от новых к старым.
 
+    Постраничная навигация по курсору: в ответе next - значение для
+    ?before= следующей страницы (None, если страниц больше нет). Ответ
+    кэшируется до следующей записи результатов пользователя.
+    """
     # Берем результаты ТОЛЬКО для авторизованного пользователя
-    if request.user.is_authenticated:
-        results = SpeedTestResult.objects.filter(user=request.user).order_by('-timestamp')[:limit]
-    else:
+    if not request.user.is_authenticated:
         # Для неавторизованных - пустой список
-        results = []
+        return JsonResponse({'history': [], 'next': None})
+
+    return response_cache.cached_response(
+        request, 'history', response_cache.user_scope(request.user.pk),
+        lambda: build_history(request), response_cache.HISTORY_TIMEOUT,
+    )
+
+
+def build_history(request):
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 10)), MAX_HISTORY_LIMIT))
+    except ValueError:
+        limit = 10
+
+    results = SpeedTestResult.objects.filter(user=request.user)
+
+    before = request.GET.get('before')
+    if before:
+        try:
+            timestamp, pk = decode_cursor(before)
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+        # timestamp <= ? отдельным условием - чтобы индекс искал сразу с позиции курсора
+        results = results.filter(Q(timestamp__lte=timestamp), Q(timestamp__lt=timestamp) | Q(id__lt=pk))
+
+    # Берем только нужные поля и на одну строку больше, чтобы узнать,
+    # есть ли следующая страница
+    rows = list(
+        results.order_by('-timestamp', '-id')
+        .values_list('id', 'timestamp', 'ping', 'jitter', 'packet_loss', 'download', 'upload', 'server')[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
 
     history = []
-    for result in results:
+    for pk, timestamp, ping, jitter, packet_loss, download, upload, server in rows:
         history.append({
-            'id': result.id,
-            'timestamp': result.timestamp.isoformat(),
-            'ping': float(result.ping),
-            'download': float(result.download),
-            'upload': float(result.upload),
-            'server': result.server
+            'id': pk,
+            'timestamp': timestamp.isoformat(),
+            'ping': float(ping),
+            'jitter': jitter,
+            'packet_loss': packet_loss,
+            'download': float(download),
+            'upload': float(upload),
+            'server': server
         })
 
-    return JsonResponse({'history': history})
+    return JsonResponse({
+        'history': history,
+        'next': encode_cursor(rows[-1][1], rows[-1][0]) if has_more else None
+    })
+
+
+def parse_stats_time(value, default):
+    if not value:
+        return default
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Некорректная дата: {value}')
+        parsed = datetime(day.year, day.month, day.day)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def get_stats(request):
+    """Статистика скорости по провайдерам, городам, странам и серверам.
+
+    ?period=hour|day, ?from=, ?to= (ISO дата или время), фильтры
+    ?provider= ?city= ?country= ?server= и ?group_by=provider,country.
+    Считается по сводкам ResultRollup, а не по сырым результатам.
+    """
+    return response_cache.cached_response(
+        request, 'stats', response_cache.STATS_SCOPE, lambda: build_stats(request), response_cache.STATS_TIMEOUT,
+    )
+
+
+def build_stats(request):
+    period = request.GET.get('period', ResultRollup.PERIOD_DAY)
+    if period not in (ResultRollup.PERIOD_HOUR, ResultRollup.PERIOD_DAY):
+        return JsonResponse({'status': 'error', 'message': 'period: hour или day'}, status=400)
+
+    group_by = [field for field in request.GET.get('group_by', '').split(',') if field]
+    if any(field not in rollups.GROUP_FIELDS for field in group_by):
+        return JsonResponse({'status': 'error', 'message': f'group_by: {", ".join(rollups.GROUP_FIELDS)}'}, status=400)
+
+    try:
+        end = parse_stats_time(request.GET.get('to'), timezone.now())
+        start = parse_stats_time(request.GET.get('from'), end - STATS_DEFAULT_RANGE[period])
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    filters = {field: request.GET[field] for field in rollups.GROUP_FIELDS if field in request.GET}
+    groups = rollups.query_stats(period, start, end, filters, group_by)
+
+    return JsonResponse({
+        'period': period,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'groups': groups
+    })
+
+
+def result_map(request):
+    """Ячейки карты результатов: число тестов и средние/медианные скорости.
+
+    ?bbox=min_lon,min_lat,max_lon,max_lat (min_lon > max_lon - область через
+    180-й меридиан), ?zoom= - масштаб карты 0..20. Читаются готовые ячейки
+    MapTile, а не сырые результаты.
+    """
+    return response_cache.cached_response(
+        request, 'map', response_cache.STATS_SCOPE, lambda: build_map(request), response_cache.MAP_TIMEOUT,
+    )
+
+
+def build_map(request):
+    try:
+        zoom = int(request.GET.get('zoom', 0))
+        bbox = [float(value) for value in request.GET.get('bbox', '-180,-90,180,90').split(',')]
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'zoom - целое число, bbox - четыре числа'}, status=400)
+    if len(bbox) != 4:
+        return JsonResponse({'status': 'error', 'message': 'bbox: min_lon,min_lat,max_lon,max_lat'}, status=400)
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        return JsonResponse({'status': 'error', 'message': 'bbox вне допустимых координат'}, status=400)
+    if not 0 <= zoom <= 20:
+        return JsonResponse({'status': 'error', 'message': 'zoom: от 0 до 20'}, status=400)
+
+    precision, cells, truncated = tiles.query(min_lat, min_lon, max_lat, max_lon, zoom)
+    return JsonResponse({
+        'zoom': zoom,
+        'precision': precision,
+        'tiles': cells,
+        'truncated': truncated
+    })
+
+
+def export_results(request):
+    """Потоковая выгрузка результатов в CSV или NDJSON.
+
+    ?format=csv|ndjson, ?gzip=1 - сжать на лету, фильтры ?from= ?to=
+    (ISO дата или время), ?provider= ?country=. ?scope=all - результаты всех
+    пользователей (только для staff), иначе - только свои.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'status': 'error', 'message': 'Требуется авторизация'}, status=403)
+
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return JsonResponse({'status': 'error', 'message': 'format: csv или ndjson'}, status=400)
+
+    if request.GET.get('scope') == 'all':
+        if not request.user.is_staff:
+            return JsonResponse({'status': 'error', 'message': 'scope=all доступен только staff'}, status=403)
+        # Глобальная выгрузка идет по первичному ключу
+        results = SpeedTestResult.objects.order_by('id')
+        fields = export.GLOBAL_FIELDS
+    else:
+        # По индексу (user, timestamp, id)
+        results = SpeedTestResult.objects.filter(user=request.user).order_by('timestamp', 'id')
+        fields = export.FIELDS
+
+    try:
+        if request.GET.get('from'):
+            results = results.filter(timestamp__gte=parse_stats_time(request.GET['from'], None))
+        if request.GET.get('to'):
+            results = results.filter(timestamp__lte=parse_stats_time(request.GET['to'], None))
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    for field in ('provider', 'country'):
+        if field in request.GET:
+            results = results.filter(**{field: request.GET[field]})
+
+    compress = request.GET.get('gzip') in ('1', 'true')
+    content_type, extension = export.FORMATS[fmt]
+    filename = f"speedtest-{timezone.now():%Y%m%d-%H%M%S}.{extension}"
+    if compress:
+        content_type = 'application/gzip'
+        filename += '.gz'
+
+    response = StreamingHttpResponse(export.stream(results, fields, fmt, compress), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'no-store'
+    return response
 
 
 def get_ip_info_view(request):
     """Возвращает информацию о IP клиента"""
     try:
-        # ВАЖНО: PythonAnywhere передает реальный IP в HTTP_X_FORWARDED_FOR
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            # Берем первый IP из списка
-            client_ip = x_forwarded_for.split(',')[0].strip()
-        else:
-            client_ip = request.META.get('REMOTE_ADDR')
+        client_ip = get_client_ip(request)
 
         # Если localhost, возвращаем тестовые данные
         if client_ip in ['127.0.0.1', '::1']:
@@ -173,7 +578,6 @@ def get_ip_info_view(request):
             })
 
         # Используем сервис с переданным IP
-        from .ip_service import get_ip_info
         ip_data = get_ip_info(client_ip)
         return JsonResponse(ip_data)
 
@@ -183,4 +587,26 @@ def get_ip_info_view(request):
             'provider': 'Не определен',
             'city': 'Не определен',
             'country': 'Не определен'
-        })
\ No newline at end of file
+        })
+
+
+def response_cache_stats_view(request):
+    """Попадания и промахи кэша ответов истории и статистики"""
+    return JsonResponse(response_cache.get_stats())
+
+
+def ip_cache_stats_view(request):
+    """Счетчики попаданий/промахов кэша геолокации"""
+    return JsonResponse(get_cache_stats())
+
+
+def admission_view(request):
+    """Текущий бюджет передач: занятые места, суммарная скорость, очередь"""
+    return JsonResponse(admission.snapshot())
+
+
+def metrics_view(request):
+    """Метрики процесса в текстовом формате Prometheus"""
+    if not getattr(settings, 'METRICS_ENABLED', True):
+        raise Http404
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
@@ -18,6 +18,9 @@ class SpeedTest {
         this.uploadCard = this.uploadValue.closest('.result-card');
 
         this.chart = null;
+        this.latency = null;
+        // Узел для теста ({name, url}); null - сервер, с которого открыта страница
+        this.server = null;
 
         this.init();
     }
@@ -73,6 +76,10 @@ class SpeedTest {
         this.showStatus('Начинаем тест скорости...', 'info');
 
         try {
+            // 0. Выбор ближайшего узла
+            await this.updateProgress(5, 'Выбираем сервер...');
+            this.server = await this.selectServer();
+
             // 1. Ping тест
             await this.updateProgress(10, 'Измеряем ping...');
             const ping = await this.testPing();
@@ -106,13 +113,92 @@ class SpeedTest {
         }
     }
 
+    apiUrl(path) {
+        return (this.server ? this.server.url : '') + path;
+    }
+
+    async probeServer(url, count = 3) {
+        // Медиана нескольких коротких ping до узла
+        const rtts = [];
+        for (let i = 0; i < count; i++) {
+            const start = performance.now();
+            const response = await fetch(`${url}/api/ping/`, {cache: 'no-store'});
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            rtts.push(performance.now() - start);
+        }
+        rtts.sort((a, b) => a - b);
+        return rtts[Math.floor(rtts.length / 2)];
+    }
+
+    async selectServer() {
+        // Сервер предлагает ближайшие узлы, окончательно выбираем по задержке
+        try {
+            const response = await fetch('/api/servers/?count=3');
+            if (!response.ok) return null;
+            const {servers} = await response.json();
+
+            let best = null;
+            for (const server of servers) {
+                try {
+                    const rtt = await this.probeServer(server.url);
+                    if (!best || rtt < best.rtt) best = {name: server.name, url: server.url, rtt: rtt};
+                } catch (error) {
+                    console.log(`Узел ${server.name} недоступен:`, error.message);
+                }
+            }
+            return best;
+        } catch (error) {
+            console.log('Выбор узла недоступен, тестируем свой сервер:', error.message);
+            return null;
+        }
+    }
+
+    testPingWebSocket(count = 20, intervalMs = 50) {
+        // RTT и джиттер по одному WebSocket-соединению (доступно под ASGI)
+        return new Promise((resolve, reject) => {
+            const base = new URL(this.apiUrl('/api/ws/latency/'), location.href);
+            const protocol = base.protocol === 'https:' ? 'wss' : 'ws';
+            const socket = new WebSocket(`${protocol}://${base.host}${base.pathname}`);
+            const timer = setTimeout(() => {
+                socket.close();
+                reject(new Error('WebSocket timeout'));
+            }, 10000);
+
+            socket.onopen = () => {
+                socket.send(JSON.stringify({type: 'start', count: count, interval_ms: intervalMs}));
+            };
+            socket.onmessage = (event) => {
+                const message = JSON.parse(event.data);
+                if (message.type === 'probe') {
+                    socket.send(JSON.stringify({type: 'echo', seq: message.seq}));
+                } else if (message.type === 'result') {
+                    clearTimeout(timer);
+                    socket.close();
+                    message.median !== null ? resolve(message) : reject(new Error('Нет ответов на пробы'));
+                }
+            };
+            socket.onerror = () => {
+                clearTimeout(timer);
+                reject(new Error('WebSocket недоступен'));
+            };
+        });
+    }
+
     async testPing() {
+        this.latency = null;
+        try {
+            this.latency = await this.testPingWebSocket();
+            return this.latency.median;
+        } catch (error) {
+            console.log('WebSocket ping недоступен, измеряем через HTTP:', error.message);
+        }
+
         let totalPing = 0;
         const measurements = 5;
 
         for (let i = 0; i < measurements; i++) {
             const start = performance.now();
-            await fetch('/api/ping/');
+            await fetch(this.apiUrl('/api/ping/'));
             const end = performance.now();
             totalPing += (end - start);
 
@@ -125,32 +211,95 @@ class SpeedTest {
         return totalPing / measurements;
     }
 
-    async testDownload() {
-        const size = 2 * 1024 * 1024; // 2 MB
-        const start = performance.now();
+    async nextStep(direction, intervals) {
+        // Сервер подсказывает размер следующей порции по уже измеренной скорости
+        const response = await fetch('/api/adaptive/', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({direction: direction, intervals: intervals})
+        });
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        return response.json();
+    }
 
-        try {
-            const response = await fetch(`/api/download/?size=${size}`);
+    async adaptiveTest(direction, measureChunk) {
+        // Порции растут, пока скорость не стабилизируется
+        const intervals = [];
+        let step = await this.nextStep(direction, intervals);
 
-            // Читаем данные потоком для точного измерения
-            const reader = response.body.getReader();
-            let received = 0;
+        while (!step.done) {
+            const {bytes, seconds} = await measureChunk(step.next_size);
+            intervals.push([bytes, Math.max(seconds, 0.001)]);
+            step = await this.nextStep(direction, intervals);
+        }
+
+        return Math.min(step.mbps || 0, 1000);
+    }
 
-            while (true) {
-                const {done, value} = await reader.read();
-                if (done) break;
-                received += value.length;
+    async fetchAdmitted(url, options = {}, attempts = 5) {
+        // Сервер под нагрузкой отвечает 503/429 с retry_after_ms: ждем и
+        // повторяем, чтобы не мерить скорость на перегруженном сервере.
+        // start - время последней попытки, ожидание в замер не входит
+        for (let attempt = 1; ; attempt++) {
+            const start = performance.now();
+            const response = await fetch(url, options);
+            if ((response.status !== 503 && response.status !== 429) || attempt >= attempts) {
+                return {response, start};
             }
+            const busy = await response.json().catch(() => ({}));
+            const retryMs = busy.retry_after_ms || Number(response.headers.get('Retry-After')) * 1000 || 1000;
+            this.progressText.textContent = 'Сервер занят, повтор...';
+            await this.sleep(retryMs);
+        }
+    }
 
-            const end = performance.now();
-            const duration = (end - start) / 1000; // секунды
+    async downloadChunk(size) {
+        const {response, start} = await this.fetchAdmitted(this.apiUrl(`/api/download/?size=${size}`));
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+
+        // Читаем данные потоком для точного измерения
+        const reader = response.body.getReader();
+        let received = 0;
+
+        while (true) {
+            const {done, value} = await reader.read();
+            if (done) break;
+            received += value.length;
+        }
+
+        return {bytes: received, seconds: (performance.now() - start) / 1000};
+    }
+
+    async uploadChunk(size) {
+        const testData = new ArrayBuffer(size);
+
+        const {response, start} = await this.fetchAdmitted(this.apiUrl('/api/upload/'), {
+            method: 'POST',
+            body: testData,
+            headers: {
+                'Content-Type': 'application/octet-stream',
+                'X-CSRFToken': this.getCsrfToken()
+            }
+        });
 
-            // Расчет: (байты * 8) / (секунды * 1000000)
-            const speed = (size * 8) / (duration * 1000000);
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
 
-            // Ограничиваем разумными значениями
-            return Math.min(speed, 1000);
+        const result = await response.json();
+        const clientSeconds = (performance.now() - start) / 1000;
+
+        // Скорость, измеренная сервером по приходу данных, точнее. Если сервер
+        // получил все одним куском (mbps = 0) - берем время клиента
+        return {
+            bytes: result.bytes_received,
+            seconds: result.mbps > 0
+                ? (result.bytes_received * 8) / (result.mbps * 1000000)
+                : clientSeconds
+        };
+    }
 
+    async testDownload() {
+        try {
+            return await this.adaptiveTest('download', (size) => this.downloadChunk(size));
         } catch (error) {
             console.error('Download test failed:', error);
             return 0;
@@ -159,32 +308,7 @@ class SpeedTest {
 
     async testUpload() {
         try {
-            const testData = new ArrayBuffer(1024 * 1024); // 1 МБ данных
-            const startTime = performance.now();
-
-            console.log('Отправляю upload запрос...'); // ← для отладки
-
-            const response = await fetch('/api/upload/', {
-                method: 'POST',
-                body: testData,
-                headers: {
-                    'Content-Type': 'application/octet-stream',
-                    'X-CSRFToken': this.getCsrfToken()
-                }
-            });
-
-            console.log('Upload ответ:', response.status); // ← для отладки
-
-            if (!response.ok) throw new Error(`HTTP ${response.status}`);
-
-            const endTime = performance.now();
-            const duration = (endTime - startTime) / 1000; // секунды
-            const sizeInBits = 8; // 1 МБ = 8 Мбит
-            const speed = sizeInBits / duration;
-
-            console.log('Upload скорость:', speed, 'duration:', duration); // ← для отладки
-
-            return Math.min(speed, 1000);
+            return await this.adaptiveTest('upload', (size) => this.uploadChunk(size));
         } catch (error) {
             console.error('Upload test error:', error);
             return 0;
@@ -196,8 +320,12 @@ class SpeedTest {
             ping: ping,
             download: download,
             upload: upload,
-            server: 'local'
+            server: this.server ? this.server.name : null
         };
+        if (this.latency) {
+            data.jitter = this.latency.jitter;
+            data.packet_loss = this.latency.packet_loss;
+        }
 
         const response = await fetch('/api/save/', {
             method: 'POST',